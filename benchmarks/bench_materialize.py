@@ -0,0 +1,77 @@
+"""Compares per-row from_dict (iterrows) with the bulk from_frame constructors.
+
+Run from the repository root: python benchmarks/bench_materialize.py [rows]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "library"))
+
+from library_db import Book, Reader
+
+
+def make_books(rows: int):
+    now = datetime.now()
+    lent = [i % 3 == 0 for i in range(rows)]
+    return pd.DataFrame({
+        "ID": range(1, rows + 1),
+        "Title": [f"Title {i}" for i in range(rows)],
+        "Author": [f"Author {i % 500}" for i in range(rows)],
+        "ISBN": [str(9780000000000 + i) for i in range(rows)],
+        "Publisher": [f"Publisher {i % 50}" for i in range(rows)],
+        "Pages": [100 + i % 400 for i in range(rows)],
+        "Lent": lent,
+        "Lent to": [float(i % 1000 + 1) if l else None for i, l in enumerate(lent)],
+        "Lent date": [now if l else None for l in lent],
+        "Return date": [now + timedelta(days=30) if l else None for l in lent],
+        "Reserved": [False] * rows,
+        "Reserved by": [None] * rows,
+        "Reserved until": [None] * rows,
+        "Version": [0] * rows,
+    })
+
+
+def make_readers(rows: int):
+    return pd.DataFrame({
+        "ID": range(1, rows + 1),
+        "Name": [f"Name {i % 300}" for i in range(rows)],
+        "Surname": [f"Surname {i}" for i in range(rows)],
+        "Phone": [500000000 + i for i in range(rows)],
+        "City": [f"City {i % 40}" for i in range(rows)],
+        "Street": [f"Street {i % 900}" for i in range(rows)],
+        "Apartment": [f"{i % 90}/{i % 7}" for i in range(rows)],
+        "Postal Code": [f"{i % 100:02d}-{i % 1000:03d}" for i in range(rows)],
+        "Version": [0] * rows,
+    })
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main(rows: int):
+    books = make_books(rows)
+    readers = make_readers(rows)
+
+    results = {
+        "books iterrows + from_dict": timed(lambda: [Book.from_dict(row) for _, row in books.iterrows()]),
+        "books from_frame": timed(lambda: Book.from_frame(books)),
+        "readers iterrows + from_dict": timed(lambda: [Reader.from_dict(row, []) for _, row in readers.iterrows()]),
+        "readers from_frame": timed(lambda: Reader.from_frame(readers)),
+    }
+
+    print(f"{rows} rows")
+    for name, seconds in results.items():
+        print(f"  {name:<30} {seconds:8.3f} s")
+    print(f"  books speedup:   {results['books iterrows + from_dict'] / results['books from_frame']:.1f}x")
+    print(f"  readers speedup: {results['readers iterrows + from_dict'] / results['readers from_frame']:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,74 @@
+"""Memory footprint of 100k materialized books and readers.
+
+"before" rebuilds the records with the previous dict-backed layout (four history dicts per reader,
+no interning), "after" uses Book.from_frame / Reader.from_frame.
+
+Run from the repository root: python benchmarks/bench_memory.py [rows]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "library"))
+
+from bench_materialize import make_books, make_readers
+from library_db import Book, Reader
+
+
+class DictAddress:
+    def __init__(self, city, street, apartment, postal_code):
+        self.city = city
+        self.street = street
+        self.apartment = apartment
+        self.postal_code = postal_code
+
+
+class DictBook:
+    def __init__(self, row):
+        (self.id, self.title, self.author, self.isbn, self.publisher, self.page_count, self.lent,
+         self.lent_to, self.lent_date, self.return_date, self.reserved, self.reserved_by,
+         self.reserved_until, self.version) = row
+
+
+class DictReader:
+    def __init__(self, row):
+        self.id, self.name, self.surname, phone, city, street, apartment, postal_code, self.version = row
+        self.phone_num = str(phone)
+        self.address = DictAddress(city, street, apartment, postal_code)
+        self.borrowed_books = []
+        self.past_borrowed = {}
+        self.past_returned = {}
+        self.past_extended = {}
+        self.past_reserved = {}
+
+
+def footprint(build):
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main(rows: int):
+    books = make_books(rows)
+    readers = make_readers(rows)
+
+    results = {
+        "books before": footprint(lambda: [DictBook(row) for row in books.itertuples(index=False, name=None)]),
+        "books after": footprint(lambda: Book.from_frame(books)),
+        "readers before": footprint(lambda: [DictReader(row) for row in readers.itertuples(index=False, name=None)]),
+        "readers after": footprint(lambda: Reader.from_frame(readers)),
+    }
+
+    print(f"{rows} records")
+    for name, size in results.items():
+        print(f"  {name:<16} {size / 2 ** 20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,428 @@
+"""Times the public functions of library/book.py and library/reader.py and the Reader loan methods
+on generated catalogs (see datagen.py), and prints the results as JSON.
+
+Run from the repository root:
+    python benchmarks/bench_storage.py [--sizes 1000 10000 100000] [--out results.json] [--compare baseline.json]
+
+Every size runs in a fresh process on its own copy of the data in a temporary folder, LIBRARY_STORAGE /
+LIBRARY_FORMAT pick the storage as for the app. "cold" cases drop the in-process caches before every call,
+the others run with the data already loaded. Times are per call in milliseconds; --compare prints
+the median of every case against an earlier result file to stderr.
+"""
+import ast
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import cycle
+from typing import Callable, NamedTuple
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+library_dir = os.path.join(benchmarks_dir, "..", "library")
+
+# Write-path helpers that only run inside the write functions, they are timed as part of those
+timed_within = {
+    "apply_book_change", "commit_book_changes", "versioned_book_update", "record_book_change",
+    "update_search_index", "mark_search_index_synced", "apply_reader_change", "commit_reader_changes",
+    "record_reader_change", "reader_index_keys", "update_reader_index", "mark_reader_index_synced",
+}
+
+
+class Case(NamedTuple):
+    name: str
+    run: Callable
+    # Untimed, runs before every call and may return a tuple of arguments for run
+    prepare: Callable = None
+    # Calls per timing, for functions too fast to time one by one
+    number: int = 1
+
+
+def measure(case: Case, repeat: int, budget: float) -> dict:
+    """Per call times of up to repeat timings, fewer once budget seconds are spent (at least one)."""
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - started < budget):
+        try:
+            args = (case.prepare() or ()) if case.prepare else ()
+        except IndexError:
+            # The case used up its share of the generated books (small catalogs)
+            break
+        start = time.perf_counter()
+        for _ in range(case.number):
+            case.run(*args)
+        times.append((time.perf_counter() - start) / case.number)
+    return {
+        "calls": len(times) * case.number,
+        "min_ms": round(min(times) * 1000, 4),
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "mean_ms": round(statistics.fmean(times) * 1000, 4),
+        "max_ms": round(max(times) * 1000, 4),
+    }
+
+
+def public_functions(module_name: str) -> list[str]:
+    with open(os.path.join(library_dir, f"{module_name}.py"), encoding="utf-8") as file:
+        tree = ast.parse(file.read())
+    return [node.name for node in tree.body if isinstance(node, ast.FunctionDef) and not node.name.startswith("_")]
+
+
+"""
+Cases =====
+"""
+
+def drop_caches():
+    import book
+    import cache
+    import reader
+    cache.invalidate()
+    book._search_index = None
+    reader._reader_index = None
+
+def drop_caches_and_index_file():
+    import book
+    drop_caches()
+    if os.path.exists(book.books_index_path):
+        os.remove(book.books_index_path)
+
+
+class Pools:
+    """Generated IDs by loan state, shuffled. Write cases pop from them, so no two cases touch the same book."""
+
+    def __init__(self, seed: int):
+        import random
+        from book import load_books
+        from reader import load_readers
+        books = load_books()
+        lent = books["Lent"].astype(bool)
+        reserved = books["Reserved"].astype(bool)
+        rng = random.Random(seed)
+
+        def ids(mask) -> list[int]:
+            found = books.loc[mask, "ID"].astype(int).tolist()
+            rng.shuffle(found)
+            return found
+
+        self.available = ids(~lent & ~reserved)
+        self.lent = ids(lent & ~reserved)
+        self.reserved = ids(lent & reserved)
+        self.held = ids(~lent & reserved)
+        self.books = ids(books["ID"].notna())
+        self.readers = readers = load_readers()["ID"].astype(int).tolist()
+        rng.shuffle(readers)
+        self.isbns = cycle(books.set_index("ID").loc[self.books[:200], "ISBN"].tolist())
+        sample = books.set_index("ID").loc[self.books[:50]]
+        self.book_queries = cycle([*sample["Title"].str.split().str[1].str[:4], *sample["Author"].str.split().str[-1]])
+        names = load_readers().set_index("ID").loc[readers[:50]]
+        self.reader_queries = cycle([*names["Surname"].str[:4], *(names["Name"] + " " + names["Surname"].str[:2]),
+                                     *names["Phone"].astype(str).str[:5]])
+        self.rng = rng
+
+    def reader_for(self, *excluded) -> int:
+        while True:
+            reader_id = self.rng.choice(self.readers)
+            if reader_id not in excluded:
+                return reader_id
+
+
+def read_cases(pools: Pools) -> list[Case]:
+    import book
+    import cache
+    import reader
+    from library_db import Reader
+    from loan_history import loans_events_path
+
+    book_ids = cycle(pools.books)
+    reader_ids = cycle(pools.readers)
+    narrowed = {}
+
+    def narrow_within():
+        query = next(pools.reader_queries)
+        if query not in narrowed:
+            narrowed[query] = reader.search_reader_ids(query[:-1], None)
+        return query, narrowed[query]
+
+    def a_reader():
+        return (reader.get_reader(next(reader_ids)),)
+
+    def reader_without_loan_events():
+        cache.invalidate(loans_events_path)
+        return a_reader()
+
+    def books_loaded():
+        book.load_books_lookup()
+
+    def readers_loaded():
+        reader.load_readers_lookup()
+
+    reader_rows = reader.load_readers().to_dict("records")
+    reader_rows_cycle = cycle(reader_rows)
+    readers_frame = reader.load_readers()
+    books_frame = book.load_books()
+
+    return [
+        Case("book.excel_file_preparer", book.excel_file_preparer, number=100),
+        Case("book.books_store_paths", book.books_store_paths, number=1000),
+        Case("book.normalize_isbn", lambda: book.normalize_isbn("978-83-240-1234-5"), number=1000),
+        Case("book.load_books cold", book.load_books, drop_caches),
+        Case("book.load_books", book.load_books),
+        Case("book.load_books_columns cold", lambda: book.load_books_columns(["Title", "Author", "Lent"]), drop_caches),
+        Case("book.load_books_columns", lambda: book.load_books_columns(["Title", "Author", "Lent"])),
+        Case("book.load_books_lookup cold", book.load_books_lookup, drop_caches),
+        Case("book.load_books_lookup", book.load_books_lookup, number=100),
+        Case("book.load_books_object", book.load_books_object, number=10),
+        Case("book.get_book", lambda: book.get_book(next(book_ids)), number=1000),
+        Case("book.get_books_by_isbn", lambda: book.get_books_by_isbn(next(pools.isbns)), number=1000),
+        Case("book.fresh_books_lookup", book.fresh_books_lookup, number=1000),
+        Case("book.books_signature", book.books_signature, number=100),
+        Case("book.build_search_index", lambda: book.build_search_index(books_frame)),
+        Case("book.get_search_index rebuild", book.get_search_index, drop_caches_and_index_file),
+        Case("book.save_search_index", book.save_search_index),
+        Case("book.get_search_index cold", book.get_search_index, drop_caches),
+        Case("book.get_search_index", book.get_search_index, number=100),
+        Case("book.search_index_in_sync", book.search_index_in_sync, number=1000),
+        Case("book.search_book", lambda: book.search_book(next(pools.book_queries)), number=10),
+        Case("book.find_books", lambda: book.find_books(next(pools.book_queries), 8, lambda found: not found.lent), number=10),
+        Case("book.find_books empty query", lambda: book.find_books("", 8), number=10),
+        Case("book.iter_books", lambda: sum(1 for _ in book.iter_books())),
+        Case("book.query_books cold", lambda: book.query_books(50), drop_caches),
+        Case("book.query_books", lambda: book.query_books(50, after_id=next(book_ids)), books_loaded),
+        Case("book.query_books sorted", lambda: book.query_books(50, sort_by="Title")),
+
+        Case("reader.prepare_readers_file", reader.prepare_readers_file, number=100),
+        Case("reader.readers_store_paths", reader.readers_store_paths, number=1000),
+        Case("reader.normalize_phone", lambda: reader.normalize_phone(501234567.0), number=1000),
+        Case("reader.normalize_reader_query", lambda: reader.normalize_reader_query("Łucja  Wiśn"), number=1000),
+        Case("reader.load_readers cold", reader.load_readers, drop_caches),
+        Case("reader.load_readers", reader.load_readers),
+        Case("reader.load_readers_lookup cold", reader.load_readers_lookup, drop_caches),
+        Case("reader.load_readers_lookup", reader.load_readers_lookup, number=100),
+        Case("reader.get_reader", lambda: reader.get_reader(next(reader_ids)), number=1000),
+        Case("reader.fresh_readers_lookup", reader.fresh_readers_lookup, number=1000),
+        Case("reader.load_loans_by_reader cold", reader.load_loans_by_reader, drop_caches),
+        Case("reader.load_loans_by_reader", reader.load_loans_by_reader, number=100),
+        Case("reader.load_readers_object", reader.load_readers_object),
+        Case("reader.load_readers_object without loans", lambda: reader.load_readers_object(with_loans=False)),
+        Case("reader.readers_signature", reader.readers_signature, number=100),
+        Case("reader.get_reader_index cold", reader.get_reader_index, drop_caches),
+        Case("reader.get_reader_index", reader.get_reader_index, number=100),
+        Case("reader.reader_index_in_sync", reader.reader_index_in_sync, number=1000),
+        Case("reader.search_reader", lambda: reader.search_reader(next(pools.reader_queries)), number=10),
+        Case("reader.search_reader_ids", lambda: reader.search_reader_ids(next(pools.reader_queries)), number=100),
+        Case("reader.search_reader_ids within", lambda query, within: reader.search_reader_ids(query, 50, within),
+             narrow_within),
+        Case("reader.find_readers", lambda: reader.find_readers(next(pools.reader_queries), 8), number=10),
+        Case("reader.find_readers empty query", lambda: reader.find_readers("", 8), number=10),
+        Case("reader.iter_readers", lambda: sum(1 for _ in reader.iter_readers())),
+        Case("reader.query_readers cold", lambda: reader.query_readers(50), drop_caches),
+        Case("reader.query_readers", lambda: reader.query_readers(50, after_id=next(reader_ids)),
+             readers_loaded),
+        Case("reader.query_readers sorted", lambda: reader.query_readers(50, sort_by="Surname")),
+
+        Case("Reader.from_dict", lambda: Reader.from_dict(next(reader_rows_cycle), []), number=1000),
+        Case("Reader.from_frame", lambda: Reader.from_frame(readers_frame)),
+        Case("Reader.to_dict", lambda: reader.get_reader(next(reader_ids)).to_dict(), number=1000),
+        Case("Reader.history cold", lambda found: found.history("borrowed"), reader_without_loan_events),
+        Case("Reader.history", lambda found: found.history("borrowed"), a_reader),
+    ]
+
+
+def write_cases(pools: Pools) -> list[Case]:
+    import book
+    import reader
+    from address import Address
+    from library_db import Book, Reader, record_id
+    from reservations import waiting_readers
+
+    added_books = []
+    added_readers = []
+    new_books = (Book(f"Benchmark Title {i}", "Benchmark Author", "9780000000002", "Benchmark Press", 100 + i % 300)
+                 for i in range(10 ** 9))
+    new_readers = (Reader("Bench", f"Marker{i}", str(600000000 + i), Address("Warszawa", "Polna", "1", "00-001"))
+                   for i in range(10 ** 9))
+
+    def add_book():
+        added = next(new_books)
+        book.add_book(added)
+        added_books.append(added.id)
+
+    def add_reader():
+        added = next(new_readers)
+        reader.add_reader(added)
+        added_readers.append(added.id)
+
+    def edit_book(book_id: int = None):
+        book_id = book_id or pools.books.pop()
+        edited = book.get_book(book_id)
+        book.edit_book(book_id, Book(edited.title + " (2nd ed.)", edited.author, edited.isbn, edited.publisher,
+                                     edited.page_count), edited.version)
+
+    def edit_reader(reader_id: int = None):
+        reader_id = reader_id or pools.readers.pop()
+        edited = reader.get_reader(reader_id)
+        reader.edit_reader(reader_id, Reader(edited.name, edited.surname + "-Nowak", edited.phone_num, edited.address),
+                           edited.version)
+
+    def journal_some_changes(edit, count: int = 5):
+        for _ in range(count):
+            edit()
+
+    def loan_parties(pool: list[int], holder: str = None):
+        found = book.get_book(pool.pop())
+        if holder:
+            reader_id = record_id(getattr(found, holder))
+        else:
+            reader_id = pools.reader_for(record_id(found.lent_to), record_id(found.reserved_by), *waiting_readers(found.id))
+        return reader.get_reader(reader_id), found
+
+    def hold_changes(count: int = 10):
+        # As a sweep or a return hands books on the shelf to the next reader
+        until = datetime.now() + timedelta(days=7)
+        return ([(pools.available.pop(), {"Reserved": True, "Reserved by": pools.reader_for(), "Reserved until": until})
+                 for _ in range(count)],)
+
+    return [
+        Case("book.edit_book", edit_book),
+        Case("book.update_book_status", lambda book_id: book.update_book_status(book_id, True, pools.reader_for()),
+             lambda: (pools.available.pop(),)),
+        Case("book.update_book_reservation",
+             lambda book_id: book.update_book_reservation(book_id, True, pools.reader_for(), datetime.now() + timedelta(days=7)),
+             lambda: (pools.lent.pop(),)),
+        Case("book.update_book_reservations", book.update_book_reservations, hold_changes),
+        Case("book.add_book", add_book),
+        Case("book.add_books", lambda: book.add_books([next(new_books) for _ in range(100)])),
+        Case("book.remove_book", book.remove_book, lambda: (added_books.pop(),)),
+        Case("book.compact_books", book.compact_books, lambda: journal_some_changes(edit_book)),
+
+        Case("reader.edit_reader", edit_reader),
+        Case("reader.add_reader", add_reader),
+        Case("reader.add_readers", lambda: reader.add_readers([next(new_readers) for _ in range(100)])),
+        Case("reader.remove_reader", reader.remove_reader, lambda: (added_readers.pop(),)),
+        Case("reader.compact_readers", reader.compact_readers, lambda: journal_some_changes(edit_reader)),
+
+        Case("Reader.borrow", lambda borrower, found: borrower.borrow(found), lambda: loan_parties(pools.available)),
+        Case("Reader.return_book", lambda borrower, found: borrower.return_book(found),
+             lambda: loan_parties(pools.lent, "lent_to")),
+        Case("Reader.extend", lambda borrower, found: borrower.extend(found), lambda: loan_parties(pools.lent, "lent_to")),
+        Case("Reader.reserve", lambda borrower, found: borrower.reserve(found), lambda: loan_parties(pools.lent)),
+        Case("Reader.reserve queued", lambda borrower, found: borrower.reserve(found),
+             lambda: loan_parties(pools.reserved)),
+    ]
+
+
+"""
+Running =====
+"""
+
+def run_size(size: int, seed: int, repeat: int, budget: float) -> dict:
+    """Generates the catalog in the current folder and times every case on it."""
+    sys.path.insert(0, benchmarks_dir)
+    sys.path.insert(0, library_dir)
+    import datagen
+
+    started = time.perf_counter()
+    catalog = datagen.generate(size, seed=seed)
+    datagen.write(".", *catalog)
+    generated = time.perf_counter() - started
+
+    pools = Pools(seed)
+    results = {}
+    for cases in (read_cases, write_cases):
+        for case in cases(pools):
+            results[case.name] = measure(case, repeat, budget)
+
+    timed = {name.split()[0].split(".")[1] for name in results} | timed_within
+    return {
+        "catalog": datagen.summary(*catalog),
+        "generate_s": round(generated, 3),
+        "cases": results,
+        "not_timed": [f"{module}.{name}" for module in ("book", "reader")
+                      for name in public_functions(module) if name not in timed],
+    }
+
+
+def run_isolated(size: int, args) -> dict:
+    """run_size in a fresh process and data folder, so caches and ID counters don't carry over between sizes."""
+    folder = tempfile.mkdtemp(prefix=f"library-bench-{size}-")
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--seed", str(args.seed),
+                   "--repeat", str(args.repeat), "--budget", str(args.budget)]
+        output = subprocess.run(command, cwd=folder, check=True, stdout=subprocess.PIPE, text=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict):
+    """Prints median_ms of every case against the baseline, biggest slowdowns first."""
+    rows = []
+    for size, current in results["results"].items():
+        previous = baseline.get("results", {}).get(size, {}).get("cases", {})
+        for name, timing in current["cases"].items():
+            if name in previous and previous[name]["median_ms"] > 0:
+                rows.append((timing["median_ms"] / previous[name]["median_ms"], size, name,
+                             previous[name]["median_ms"], timing["median_ms"]))
+    for ratio, size, name, before, after in sorted(rows, reverse=True):
+        flag = "slower" if ratio > 1.1 else "faster" if ratio < 0.9 else ""
+        print(f"{size:>7} {name:<45} {before:12.4f} -> {after:12.4f} ms  {ratio:6.2f}x {flag}", file=sys.stderr)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=benchmarks_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    import pandas as pd
+    results = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "storage": os.environ.get("LIBRARY_STORAGE", "xlsx"),
+            "format": os.environ.get("LIBRARY_FORMAT", "xlsx"),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "budget_s": args.budget,
+        },
+        "results": {str(size): run_isolated(size, args) for size in args.sizes},
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Storage layer micro-benchmarks on generated catalogs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="books (and readers) per catalog")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=20, help="timings per case")
+    parser.add_argument("--budget", type=float, default=5, help="seconds per case after which no more timings start")
+    parser.add_argument("--out", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier result file to compare the medians with")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker, args.seed, args.repeat, args.budget)))
+    else:
+        main(args)
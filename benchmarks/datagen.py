@@ -0,0 +1,269 @@
+"""Deterministic synthetic catalogs for the benchmarks: books, readers, current loans, reservations and loan history.
+
+The same seed and sizes always give the same rows. Dates are relative to `now` (the start of today by default),
+so loans stay current, some of them overdue, and some holds expire while the benchmark runs.
+
+Run from the repository root:
+    python benchmarks/datagen.py <books> --target DIR [--readers N] [--seed 1]
+writes DIR/library/data in the configured storage (LIBRARY_STORAGE / LIBRARY_FORMAT), replacing the data there.
+"""
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "library"))
+
+import config
+import data_files
+import journal
+import loan_history
+import reservations
+from book import books_columns, book_dtypes
+from reader import readers_columns, reader_dtypes
+
+# Share of the catalog in each state, the rest is on the shelf
+lent_share = 0.30
+# Lent books someone reserved, and books held on the shelf for a reader
+reserved_share = 0.12
+held_share = 0.02
+# Readers queued behind the holder: 0, 1, 2, 3, 4 or 5 of them
+waitlist_weights = [50, 25, 12, 7, 4, 2]
+# Past borrow / return pairs per reader (on average) over the last two years
+past_loans_per_reader = 4
+
+adjectives = [
+    "Silent", "Red", "Lost", "Hidden", "Broken", "Golden", "Last", "Northern", "Dark", "Little", "Forgotten",
+    "Winter", "Secret", "Wild", "Distant", "Quiet", "Burning", "Glass", "Iron", "Paper",
+]
+nouns = [
+    "River", "Garden", "House", "Kingdom", "Letters", "Memory", "Forest", "City", "Island", "Road", "Mountain",
+    "Sea", "Night", "Clock", "Bridge", "Witness", "Harbour", "Orchard", "Archive", "Voyage", "Mirror", "Station",
+]
+first_names = [
+    "Anna", "Maria", "Katarzyna", "Małgorzata", "Agnieszka", "Barbara", "Ewa", "Krystyna", "Zofia", "Łucja",
+    "Piotr", "Krzysztof", "Andrzej", "Tomasz", "Paweł", "Jan", "Michał", "Marcin", "Jakub", "Łukasz",
+    "Grzegorz", "Józef", "Stanisław", "Wojciech", "Żaneta", "Joanna", "Magdalena", "Monika", "Adam", "Marek",
+]
+surnames = [
+    "Nowak", "Kowalski", "Wiśniewski", "Wójcik", "Kowalczyk", "Kamiński", "Lewandowski", "Zieliński", "Szymański",
+    "Woźniak", "Dąbrowski", "Kozłowski", "Jankowski", "Mazur", "Kwiatkowski", "Krawczyk", "Piotrowski", "Grabowski",
+    "Nowakowski", "Pawłowski", "Michalski", "Król", "Wieczorek", "Jabłoński", "Wróbel", "Nowicki", "Majewski",
+    "Olszewski", "Stępień", "Jaworski", "Malinowski", "Pawlak", "Górski", "Witkowski", "Walczak", "Sikora",
+    "Baran", "Rutkowski", "Michalak", "Szewczyk", "Ostrowski", "Tomaszewski", "Zalewski", "Żółw", "Pietrzak",
+]
+publisher_words = ["Press", "Books", "Publishing", "House", "Editions", "Media"]
+# City, weight, first two digits of its postal codes
+cities = [
+    ("Warszawa", 30, 0), ("Kraków", 14, 30), ("Łódź", 10, 90), ("Wrocław", 10, 50), ("Poznań", 8, 60),
+    ("Gdańsk", 7, 80), ("Szczecin", 5, 70), ("Bydgoszcz", 4, 85), ("Lublin", 4, 20), ("Białystok", 3, 15),
+    ("Katowice", 3, 40), ("Gdynia", 2, 81),
+]
+streets = [
+    "Marszałkowska", "Długa", "Polna", "Leśna", "Słoneczna", "Krótka", "Szkolna", "Ogrodowa", "Lipowa", "Brzozowa",
+    "Łąkowa", "Kwiatowa", "Mickiewicza", "Kościuszki", "Sienkiewicza", "Piłsudskiego", "Żeromskiego", "Kolejowa",
+]
+
+
+def isbn13(number: int) -> str:
+    digits = f"978{number:09d}"
+    check = (10 - sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return digits + str(check)
+
+
+def person_name(rng: random.Random) -> tuple[str, str]:
+    name = rng.choice(first_names)
+    surname = rng.choice(surnames)
+    # Feminine form of -ski / -cki surnames, as they would be written
+    if name.endswith("a") and surname.endswith(("ski", "cki")):
+        surname = surname[:-1] + "a"
+    return name, surname
+
+
+def make_readers(count: int, rng: random.Random) -> pd.DataFrame:
+    city_names = [city for city, _, _ in cities]
+    city_weights = [weight for _, weight, _ in cities]
+    postal_prefixes = {city: prefix for city, _, prefix in cities}
+    rows = []
+    for reader_id in range(1, count + 1):
+        name, surname = person_name(rng)
+        city = rng.choices(city_names, city_weights)[0]
+        apartment = str(rng.randint(1, 120))
+        if rng.random() < 0.6:
+            apartment += f"/{rng.randint(1, 80)}"
+        rows.append({
+            "ID": reader_id,
+            "Name": name,
+            "Surname": surname,
+            # 7919 is coprime with the 400M range, so the numbers never repeat
+            "Phone": str(500000000 + reader_id * 7919 % 400000000),
+            "City": city,
+            "Street": rng.choice(streets),
+            "Apartment": apartment,
+            "Postal Code": f"{postal_prefixes[city] + rng.randint(0, 4):02d}-{rng.randint(0, 999):03d}",
+            "Version": rng.choice((0, 0, 0, 1, 1, 2)),
+        })
+    return pd.DataFrame(rows, columns=readers_columns)
+
+
+def make_books(count: int, rng: random.Random) -> pd.DataFrame:
+    authors = [" ".join(person_name(rng)) for _ in range(max(count // 8, 1))]
+    publishers = [f"{rng.choice(surnames)} {rng.choice(publisher_words)}" for _ in range(max(min(count // 100, 80), 1))]
+    rows = []
+    for book_id in range(1, count + 1):
+        title = f"The {rng.choice(adjectives)} {rng.choice(nouns)}"
+        if rng.random() < 0.3:
+            title += f" of the {rng.choice(nouns)}"
+        rows.append({
+            "ID": book_id,
+            "Title": title,
+            # A few authors write most of the books
+            "Author": authors[min(int(rng.paretovariate(1.2)) - 1, len(authors) - 1)] if rng.random() < 0.3
+                      else rng.choice(authors),
+            "ISBN": isbn13(book_id * 7919 % 10 ** 9),
+            "Publisher": rng.choice(publishers),
+            "Pages": min(max(int(rng.lognormvariate(5.6, 0.4)), 48), 1500),
+            "Lent": False, "Lent to": None, "Lent date": None, "Return date": None,
+            "Reserved": False, "Reserved by": None, "Reserved until": None,
+            "Version": rng.randint(0, 3),
+        })
+    return pd.DataFrame(rows, columns=books_columns)
+
+
+def generate(books: int, readers: int = None, seed: int = 1, now: datetime = None):
+    """Returns (books frame, readers frame, loan events [(kind, book ID, reader ID, at)], queue entries [(book ID, reader ID, at)]).
+
+    readers defaults to the number of books.
+    """
+    readers = readers or books
+    now = now or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rng = random.Random(seed)
+    books_df = make_books(books, rng)
+    readers_df = make_readers(readers, rng)
+    events = []
+    queued = []
+
+    def random_reader(*excluded):
+        while True:
+            reader_id = rng.randint(1, readers)
+            if reader_id not in excluded or readers <= len(excluded):
+                return reader_id
+
+    states = books_df.to_dict("records")
+    for book in states:
+        draw = rng.random()
+        if draw < lent_share:
+            # Most loans are recent, about one in five is past its return date
+            days_out = min(rng.expovariate(1 / 18), 180)
+            lent_date = now - timedelta(days=days_out, minutes=rng.randint(0, 600))
+            book.update({"Lent": True, "Lent to": random_reader(), "Lent date": lent_date,
+                         "Return date": lent_date + timedelta(days=30), "Version": book["Version"] + 1})
+            events.append(("borrowed", book["ID"], book["Lent to"], lent_date))
+            if days_out > 20 and rng.random() < 0.25:
+                events.append(("extended", book["ID"], book["Lent to"], lent_date + timedelta(days=rng.uniform(20, days_out))))
+                book["Return date"] += timedelta(days=30)
+            reserved = rng.random() < reserved_share
+            hold_until = book["Return date"] + timedelta(days=config.reservation_hold_days)
+        else:
+            reserved = draw < lent_share + held_share
+            # Returned lately and waiting on the shelf, a few of the holds have already run out
+            hold_until = now + timedelta(days=rng.uniform(-2, config.reservation_hold_days))
+
+        if reserved:
+            reserved_at = now - timedelta(days=rng.uniform(0, 20))
+            holder = random_reader(book["Lent to"])
+            book.update({"Reserved": True, "Reserved by": holder, "Reserved until": hold_until,
+                         "Version": book["Version"] + 1})
+            events.append(("reserved", book["ID"], holder, reserved_at))
+            waiting = [holder, book["Lent to"]]
+            for _ in range(rng.choices(range(len(waitlist_weights)), waitlist_weights)[0]):
+                reader_id = random_reader(*waiting)
+                waiting.append(reader_id)
+                queued_at = reserved_at + timedelta(hours=rng.uniform(1, 240))
+                queued.append((book["ID"], reader_id, queued_at))
+                events.append(("reserved", book["ID"], reader_id, queued_at))
+
+    for reader_id in range(1, readers + 1):
+        for _ in range(int(rng.expovariate(1 / past_loans_per_reader))):
+            book_id = rng.randint(1, books)
+            borrowed_at = now - timedelta(days=rng.uniform(60, 730))
+            events.append(("borrowed", book_id, reader_id, borrowed_at))
+            if rng.random() < 0.15:
+                events.append(("extended", book_id, reader_id, borrowed_at + timedelta(days=rng.uniform(20, 30))))
+            events.append(("returned", book_id, reader_id, borrowed_at + timedelta(days=rng.uniform(1, 55))))
+
+    events.sort(key=lambda event: event[3])
+    queued.sort(key=lambda entry: entry[2])
+    books_df = pd.DataFrame(states, columns=books_columns)
+    for column in ("Lent date", "Return date", "Reserved until"):
+        books_df[column] = pd.to_datetime(books_df[column])
+    return books_df, readers_df, events, queued
+
+
+def write(target: str, books_df: pd.DataFrame, readers_df: pd.DataFrame, events: list, queued: list):
+    """Writes the catalog into target/library/data, replacing what is there."""
+    data_dir = os.path.join(target, config.data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    for name in os.listdir(data_dir):
+        if name.startswith(("books.", "readers.", "library.db", "loans.", "reservations.")):
+            os.remove(os.path.join(data_dir, name))
+
+    if config.storage_engine == "sqlite":
+        import sqlite3
+        import sqlite_storage
+        conn = sqlite3.connect(os.path.join(target, sqlite_storage.db_path))
+        sqlite_storage.create_tables(conn)
+        with conn:
+            sqlite_storage.insert_rows(conn, "books", books_columns, books_df.itertuples(index=False, name=None))
+            sqlite_storage.insert_rows(conn, "readers", readers_columns, readers_df.itertuples(index=False, name=None))
+            sqlite_storage.insert_rows(conn, "loan_events", ["At", "Kind", "Book ID", "Reader ID"],
+                                       ((at, kind, book_id, reader_id) for kind, book_id, reader_id, at in events))
+            sqlite_storage.insert_rows(conn, "reservations", ["Book ID", "Reader ID", "Priority", "At"],
+                                       ((book_id, reader_id, 0, at) for book_id, reader_id, at in queued))
+        conn.close()
+        return
+
+    data_files.write_table(books_df, os.path.join(target, data_files.data_path("books")), book_dtypes)
+    data_files.write_table(readers_df, os.path.join(target, data_files.data_path("readers")), reader_dtypes)
+    records = np.array([(at.timestamp(), book_id, reader_id, loan_history.event_kinds.index(kind))
+                        for kind, book_id, reader_id, at in events], dtype=loan_history.event_dtype)
+    records.tofile(os.path.join(target, loan_history.loans_events_path))
+    journal.append_many(os.path.join(target, reservations.reservations_path), [
+        ("enqueue", book_id, {"Reader": reader_id, "Priority": 0, "Seq": seq, "At": at})
+        for seq, (book_id, reader_id, at) in enumerate(queued, start=1)
+    ])
+
+
+def summary(books_df: pd.DataFrame, readers_df: pd.DataFrame, events: list, queued: list, now: datetime = None) -> dict:
+    now = now or datetime.now()
+    lent = books_df["Lent"].astype(bool)
+    reserved = books_df["Reserved"].astype(bool)
+    return {
+        "books": len(books_df),
+        "readers": len(readers_df),
+        "lent": int(lent.sum()),
+        "overdue": int((lent & (books_df["Return date"] < now)).sum()),
+        "reserved": int((lent & reserved).sum()),
+        "held": int((~lent & reserved).sum()),
+        "waiting": len(queued),
+        "loan_events": len(events),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Writes a deterministic synthetic catalog for benchmarking")
+    parser.add_argument("books", type=int)
+    parser.add_argument("--readers", type=int, help="defaults to the number of books")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--target", required=True, help="folder that gets library/data")
+    args = parser.parse_args()
+
+    catalog = generate(args.books, args.readers, args.seed)
+    write(args.target, *catalog)
+    print(json.dumps(summary(*catalog), indent=2))
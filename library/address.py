@@ -1,7 +1,15 @@
+import sys
+
+def intern_str(value):
+    """Authors, publishers and cities repeat a lot, so equal strings share one object."""
+    return sys.intern(value) if type(value) is str else value
+
 # Part responsible for addresses
 class Address:
+    __slots__ = ("city", "street", "apartment", "postal_code")
+
     def __init__(self, city, street, apartment, postal_code):
-        self.city = city
+        self.city = intern_str(city)
         self.street = street
         self.apartment = apartment
         self.postal_code = postal_code
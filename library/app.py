@@ -1,15 +1,100 @@
+import importlib
+
 from kivy.app import App
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+import config
+import desk
+import metrics
+import startup
+from background import io_queue
 from gui import Home
+from widgets import ActivityLabel, MetricsOverlay
+
+# Shows / hides the metrics overlay
+overlay_key = 293  # F12
 
 class GuiApp(App):
+    """Paints the home screen first; pandas, the catalog and the other screens are loaded right after, off the way."""
+
     def __init__(self):
         super().__init__()
-        self.root_widget = Home(self.switch_layout)
+        self.root_widget = None
+        self.activity_label = None
+        self.metrics_overlay = None
 
     def build(self):
+        with startup.phase("build home"), metrics.timer("screen.Home"):
+            self.root_widget = Home(self.switch_layout)
+        self.activity_label = ActivityLabel(io_queue)
+        self.root_widget.add_widget(self.activity_label)
         return self.root_widget
 
     def switch_layout(self, layout_class):
         self.root_widget.clear_widgets()
-        new_layout = layout_class(switch_layout_callback=self.switch_layout)
-        self.root_widget.add_widget(new_layout)
\ No newline at end of file
+        with metrics.timer(f"screen.{layout_class.__name__}"):
+            new_layout = layout_class(switch_layout_callback=self.switch_layout)
+        self.root_widget.add_widget(new_layout)
+        self.root_widget.add_widget(self.activity_label)
+        if self.metrics_overlay is not None:
+            self.root_widget.add_widget(self.metrics_overlay)
+
+    def on_key_down(self, window, key, *args):
+        if key != overlay_key:
+            return False
+        if self.metrics_overlay is None:
+            self.metrics_overlay = MetricsOverlay()
+            self.root_widget.add_widget(self.metrics_overlay)
+        else:
+            self.root_widget.remove_widget(self.metrics_overlay)
+            self.metrics_overlay = None
+        return True
+
+    def on_start(self):
+        from kivy.core.window import Window
+        startup.mark("window open")
+        Window.bind(on_key_down=self.on_key_down, on_flip=self.on_first_frame)
+        # With a library service the service sweeps the holds itself
+        if not desk.remote:
+            Clock.schedule_interval(self.sweep_reservations, config.expiry_sweep_interval)
+
+    def on_first_frame(self, window):
+        window.unbind(on_flip=self.on_first_frame)
+        startup.mark("first paint")
+        Logger.info(f"Startup: home screen painted after {startup.reached('first paint')} ms")
+        io_queue.submit(self.warm_up, self.on_warm, self.on_warm, key=("warm up",))
+        Clock.schedule_once(self.preload_screens)
+
+    @staticmethod
+    def warm_up():
+        """Runs on the I/O thread, so the first search or list finds the data in memory."""
+        if desk.remote:
+            return
+        with startup.phase("import pandas"):
+            importlib.import_module("pandas")
+        with startup.phase("warm up data"):
+            desk.warm_up()
+
+    def on_warm(self, error=None):
+        startup.mark("data warm")
+        if error is not None:
+            Logger.error(f"Startup: loading the data failed: {error!r}")
+        if startup.enabled:
+            startup.print_report()
+            self.stop()
+
+    @staticmethod
+    def preload_screens(dt):
+        """Imports the screen modules after the first frame, so the first click doesn't wait for them."""
+        with startup.phase("import screens"):
+            importlib.import_module("manage_books")
+            importlib.import_module("manage_readers")
+
+    @staticmethod
+    def sweep_reservations(dt):
+        io_queue.submit(desk.sweep_expired, key=("expiry sweep",))
+
+    def on_stop(self):
+        io_queue.shutdown()
+        desk.compact()
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.logger import Logger
+from kivy.properties import NumericProperty
+
+#Part responsible for running storage I/O off the Kivy main thread
+# A single worker keeps storage calls in submission order, as they were on the main thread.
+
+class IOQueue(EventDispatcher):
+    """Runs storage calls on a background thread and hands the results back on the main thread."""
+    pending = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super(IOQueue, self).__init__(**kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library-io")
+        self.in_flight = set()
+
+    def submit(self, work, on_done=None, on_error=None, key=None) -> bool:
+        """Runs work() in the background, then on_done(result) or on_error(exception) through Clock.schedule_once.
+
+        While an operation with the same key is in flight further ones are dropped, so a double-click
+        does not write twice. Returns False when the call was dropped.
+        """
+        if key is not None:
+            if key in self.in_flight:
+                return False
+            self.in_flight.add(key)
+        self.pending += 1
+        future = self.executor.submit(work)
+        future.add_done_callback(
+            lambda done: Clock.schedule_once(lambda dt: self.finish(done, key, on_done, on_error))
+        )
+        return True
+
+    def finish(self, future, key, on_done, on_error):
+        self.in_flight.discard(key)
+        self.pending -= 1
+        error = future.exception()
+        if error is None:
+            if on_done is not None:
+                on_done(future.result())
+        elif on_error is not None:
+            on_error(error)
+        else:
+            Logger.error(f"IOQueue: {error!r}")
+
+    def shutdown(self):
+        """Waits for the queued writes, called before the app exits."""
+        self.executor.shutdown(wait=True)
+
+io_queue = IOQueue()
@@ -1,13 +1,35 @@
 import os
+import threading
 from datetime import datetime, timedelta
 
 import pandas as pd
 
+import cache
+import data_files
+import expiry
+import journal
+import locks
+import lookup
+import metrics
+import paging
+import search_index
+from config import storage_engine, journal_compact_threshold
 from exceptions import NoBookFound
 from library_db import Book
 
-books_path = "./library/data/books.xlsx"
-books_columns = ["ID", "Title", "Author", "ISBN", "Publisher", "Pages", "Lent", "Lent to", "Lent date", "Return date", "Reserved", "Reserved by", "Reserved until"]
+books_path = data_files.data_path("books")
+books_journal_path = journal.journal_path_for(books_path)
+books_index_path = os.path.splitext(books_path)[0] + ".index"
+books_lookup_key = ("objects", "books")
+book_index_fields = {"Title": 3, "ISBN": 3, "Author": 2, "Publisher": 1}
+books_columns = ["ID", "Title", "Author", "ISBN", "Publisher", "Pages", "Lent", "Lent to", "Lent date", "Return date", "Reserved", "Reserved by", "Reserved until", "Version"]
+book_dtypes = {
+    "ID": "int64", "Title": "str", "Author": "str", "ISBN": "str", "Publisher": "str", "Pages": "int64",
+    "Lent": "bool", "Lent to": "float64", "Lent date": "datetime64[us]", "Return date": "datetime64[us]",
+    "Reserved": "bool", "Reserved by": "float64", "Reserved until": "datetime64[us]",
+    "Version": "int64"
+}
+cast_book_row = data_files.row_caster(book_dtypes)
 
 """
 Pandas books =====
@@ -15,69 +37,292 @@ Pandas books =====
 
 def excel_file_preparer():
     os.makedirs("./library/data", exist_ok=True)
-    if not os.path.exists(books_path):
-        df = pd.DataFrame(columns=books_columns)
-        df.to_excel(books_path, index=False)
+    if os.path.exists(books_path):
+        return
+    with locks.data_lock("books"):
+        if not os.path.exists(books_path):
+            df = pd.DataFrame(columns=books_columns)
+            data_files.write_table(df, books_path, book_dtypes)
+            cache.invalidate(books_path)
+
+def books_store_paths():
+    return [books_path, books_journal_path]
+
+def books_lock():
+    """The lock every book write takes, hold it to keep a read-check-write sequence atomic across desks."""
+    return locks.data_lock("books")
 
 def load_books():
     excel_file_preparer()
-    return pd.read_excel(books_path)
+    snapshot = cache.cached(("frame", books_path), [books_path], lambda: data_files.read_table(books_path))
+    return data_files.with_versions(journal.replay(snapshot.copy(), books_journal_path))
+
+def load_books_columns(columns: list[str]):
+    """Only the given columns (ID is always included). Parquet/Feather read just those from disk."""
+    columns = ["ID", *(column for column in columns if column != "ID")]
+    excel_file_preparer()
+    snapshot = cache.cached(("frame", books_path, tuple(columns)), [books_path],
+                            lambda: data_files.read_table(books_path, columns))
+    return journal.replay(snapshot.copy(), books_journal_path)[columns]
+
+def normalize_isbn(isbn) -> str:
+    if isinstance(isbn, float) and isbn.is_integer():
+        isbn = int(isbn)
+    return str(isbn).replace("-", "").replace(" ", "")
+
+def load_books_lookup():
+    """Book objects by ID (and ISBN), shared between callers and patched in place by the write functions."""
+    return cache.cached(books_lookup_key, books_store_paths(),
+                        lambda: lookup.KeyedStore(Book.from_frame(load_books()), "id", {"isbn": normalize_isbn}))
 
 def load_books_object():
-    df = load_books()
-    return [Book.from_dict(row) for _, row in df.iterrows()]
+    return list(load_books_lookup().values())
+
+def get_book(book_id: int) -> Book | None:
+    return load_books_lookup().get(int(book_id))
+
+def get_books_by_isbn(isbn) -> list[Book]:
+    return load_books_lookup().find("isbn", isbn)
+
+def fresh_books_lookup():
+    return cache.peek(books_lookup_key) if cache.is_fresh(books_lookup_key) else None
+
+def apply_book_change(books: lookup.KeyedStore, op: str, book_id: int, values: dict = None):
+    if op == "add":
+        books.add(Book.from_dict(values))
+    elif op == "update":
+        books.update(book_id, lambda book: book.apply(values))
+    elif op == "remove":
+        books.remove(book_id)
+
+def commit_book_changes(changes: list[tuple], write):
+    """Runs write() and applies changes [(op, ID, values)] to the loaded lookup and search index instead of dropping them."""
+    books = fresh_books_lookup()
+    index_in_sync = search_index_in_sync()
+    # Holds this process writes are scheduled through expiry.watch, so only other desks' writes need a re-scan
+    deadlines_current = expiry.scheduler.is_current()
+    write()
+    if deadlines_current:
+        expiry.scheduler.mark_current()
+    if books is not None:
+        for op, book_id, values in changes:
+            apply_book_change(books, op, book_id, values)
+        cache.store(books_lookup_key, books_store_paths(), books)
+    if index_in_sync:
+        for op, book_id, values in changes:
+            update_search_index(op, book_id, values)
+        mark_search_index_synced()
+
+def versioned_book_update(book_id: int, values: dict, expected_version: int = None) -> dict:
+    """values plus the row's next Version. Call under the books lock, the lookup is reloaded if another desk wrote."""
+    book = load_books_lookup().get(book_id)
+    if book is None:
+        raise NoBookFound(f"No book with ID {book_id} found.")
+    locks.check_version(book.version, expected_version, f"Book {book_id}")
+    return {**values, "Version": int(book.version) + 1}
+
+def record_book_change(op: str, book_id: int, values: dict = None, expected_version: int = None):
+    """Journals one change under the books lock, updates fail with WriteConflict if the row is not at expected_version."""
+    with locks.data_lock("books"):
+        if op == "update":
+            values = versioned_book_update(book_id, values, expected_version)
+        def write():
+            if journal.append(books_journal_path, op, book_id, values) >= journal_compact_threshold:
+                compact_books()
+            cache.invalidate(books_journal_path)
+        commit_book_changes([(op, book_id, values)], write)
+
+def compact_books():
+    """Folds the journal back into books.xlsx."""
+    with locks.data_lock("books"):
+        if not journal.count_records(books_journal_path):
+            return
+        def write():
+            df = load_books()
+            data_files.write_table(df, books_path, book_dtypes)
+            journal.clear(books_journal_path)
+            cache.invalidate(books_path)
+        commit_book_changes([], write)
 
 def add_book(book: Book):
     excel_file_preparer()
 
-    df = load_books()
-    new_id = 1 if df.empty else int(df["ID"].max()) + 1
-    book.id = new_id
-    Book._Book__id = new_id
-    new_df = pd.DataFrame([book.to_dict()])
-    df = pd.concat([df, new_df], ignore_index=True)
-    df.to_excel(books_path, index=False)
+    # The next ID is taken under the lock, so two desks never hand out the same one
+    with locks.data_lock("books"):
+        new_id = int(load_books_lookup().max_key()) + 1
+        book.id = new_id
+        Book._Book__id = new_id
+        record_book_change("add", new_id, book.to_dict())
+
+def add_books(books: list[Book]):
+    """Adds many books with a single workbook write, their IDs form one contiguous block."""
+    if not books:
+        return
+    excel_file_preparer()
+
+    with locks.data_lock("books"):
+        first_id = int(load_books_lookup().max_key()) + 1
+        for book_id, book in enumerate(books, start=first_id):
+            book.id = book_id
+        Book._Book__id = max(Book._Book__id, books[-1].id)
+        rows = [book.to_dict() for book in books]
+
+        def write():
+            df = pd.concat([load_books(), pd.DataFrame(rows, columns=books_columns)], ignore_index=True)
+            data_files.write_table(df, books_path, book_dtypes)
+            journal.clear(books_journal_path)
+            cache.invalidate(books_path)
+        commit_book_changes([("add", row["ID"], row) for row in rows], write)
 
 def remove_book(book_id: int):
-    df = load_books()
-    df = df[df["ID"] != book_id]
-    df.to_excel(books_path, index=False)
-
-
-def edit_book(book_id: int, updated_book: Book):
-    df = load_books()
-    if book_id in df["ID"].values:
-        df.loc[df["ID"] == book_id, ["Title", "Author", "ISBN", "Publisher", "Pages"]] = [
-            updated_book.title,
-            updated_book.author,
-            updated_book.isbn,
-            updated_book.publisher,
-            updated_book.page_count
-        ]
-        df.to_excel(books_path, index=False)
-    else:
-        raise NoBookFound(f"No book with ID {book_id} found.")
+    record_book_change("remove", book_id)
+
+
+def edit_book(book_id: int, updated_book: Book, expected_version: int = None):
+    record_book_change("update", book_id, {
+        "Title": updated_book.title,
+        "Author": updated_book.author,
+        "ISBN": updated_book.isbn,
+        "Publisher": updated_book.publisher,
+        "Pages": updated_book.page_count
+    }, expected_version)
+
+def update_book_status(book_id: int, is_lent: bool, lent_to: int = None, expected_version: int = None):
+    record_book_change("update", book_id, {
+        "Lent": is_lent,
+        "Lent to": lent_to,
+        "Lent date": datetime.now() if is_lent else None,
+        "Return date": (datetime.now() + timedelta(days=30)) if is_lent else None
+    }, expected_version)
+
+def update_book_return_date(book_id: int, return_date: datetime, expected_version: int = None):
+    record_book_change("update", book_id, {"Return date": return_date}, expected_version)
+
+def update_book_reservation(book_id: int, reserved: bool, reserved_by: int = None, reserved_until: datetime = None,
+                            expected_version: int = None):
+    record_book_change("update", book_id, {
+        "Reserved": reserved,
+        "Reserved by": reserved_by,
+        "Reserved until": reserved_until
+    }, expected_version)
 
-def update_book_status(book_id: int, is_lent: bool, lent_to: int = None):
-    df = load_books()
-    if book_id in df["ID"].values:
-        df.loc[df["ID"] == book_id, ["Lent", "Lent to", "Lent date", "Return date"]] = [
-            is_lent,
-            lent_to,
-            datetime.now() if is_lent else None,
-            (datetime.now() + timedelta(days=30)) if is_lent else None
-        ]
-        df.to_excel(books_path, index=False)
+def update_book_reservations(changes: list[tuple[int, dict]], expected_versions: dict[int, int] = None):
+    """Several reservation updates [(ID, {"Reserved": ..., "Reserved by": ..., "Reserved until": ...})] in one write.
+
+    expected_versions maps IDs to the Version they were read at, any mismatch fails the whole write with WriteConflict.
+    """
+    if not changes:
+        return
+    expected_versions = expected_versions or {}
+    with locks.data_lock("books"):
+        changes = [("update", book_id, versioned_book_update(book_id, values, expected_versions.get(book_id)))
+                   for book_id, values in changes]
+        def write():
+            if journal.append_many(books_journal_path, changes) >= journal_compact_threshold:
+                compact_books()
+            cache.invalidate(books_journal_path)
+        commit_book_changes(changes, write)
+
+def search_book(query: str, limit: int = 50):
+    """Books whose Title/Author/Publisher/ISBN words start with the query words, best matches first."""
+    books = load_books_lookup()
+    ids = get_search_index().search(query, limit)
+    return pd.DataFrame([book.to_dict() for book in map(books.get, ids) if book is not None], columns=books_columns)
+
+def find_books(query: str, limit: int = 10, where=None) -> list[Book]:
+    """Best matching books for a picker, only those where(book) accepts. An empty query lists books by ID."""
+    books = load_books_lookup()
+    if search_index.tokenize(query):
+        candidates = map(books.get, get_search_index().search(query))
     else:
-        raise NoBookFound(f"No book with ID {book_id} found.")
+        candidates = books.ordered()
+    found = []
+    for book in candidates:
+        if book is not None and (where is None or where(book)):
+            found.append(book)
+            if len(found) >= limit:
+                break
+    return found
+
+"""
+Search index =====
+"""
+
+_search_index: search_index.TokenIndex | None = None
+_search_index_signature = None
+_search_index_lock = threading.RLock()
+
+def books_signature():
+    return tuple(cache.file_signature(path) for path in books_store_paths())
+
+def build_search_index(df: pd.DataFrame):
+    records = df[["ID", *book_index_fields]].to_dict("records")
+    return search_index.TokenIndex.build(book_index_fields, ((record["ID"], record) for record in records))
+
+def get_search_index():
+    """Token index over Title/Author/Publisher/ISBN. Loaded from books.index, rebuilt only when the data changed elsewhere."""
+    global _search_index, _search_index_signature
+    signature = books_signature()
+    if _search_index is not None and _search_index_signature == signature:
+        return _search_index
+    # Concurrent readers (the service answers reads on several threads) wait for one rebuild
+    with _search_index_lock:
+        signature = books_signature()
+        if _search_index is None or _search_index_signature != signature:
+            index = search_index.load_index(books_index_path, signature)
+            if index is None:
+                index = build_search_index(load_books())
+                search_index.save_index(index, books_index_path, signature)
+            _search_index, _search_index_signature = index, signature
+        return _search_index
+
+def search_index_in_sync():
+    return _search_index is not None and _search_index_signature == books_signature()
+
+def mark_search_index_synced():
+    global _search_index_signature
+    _search_index_signature = books_signature()
+
+def update_search_index(op: str, book_id: int, values: dict = None):
+    if op == "remove":
+        _search_index.remove(book_id)
+    elif op == "add" or any(field in values for field in book_index_fields):
+        _search_index.update(book_id, values)
+
+def save_search_index():
+    if search_index_in_sync():
+        search_index.save_index(_search_index, books_index_path, _search_index_signature)
+
+"""
+Paging =====
+"""
+
+def stream_books(after_id: int = None):
+    """Raw book rows in ID order from the data file with the journal applied, types as the file gives them."""
+    excel_file_preparer()
+    rows = journal.replay_rows(data_files.iter_table_rows(books_path), books_journal_path)
+    if after_id is not None:
+        rows = (row for row in rows if row["ID"] > after_id)
+    return rows
+
+def iter_books(where=None, after_id: int = None):
+    """Streams book rows (dicts, ID order) from the data file with the journal applied, without loading the catalog.
+
+    Every engine and file format yields the same dicts: columns and types of book_dtypes, as query_books returns them.
+    """
+    rows = map(cast_book_row, stream_books(after_id))
+    return rows if where is None else filter(where, rows)
+
+def query_books(limit: int = 50, offset: int = 0, after_id: int = None, sort_by: str = None,
+                descending: bool = False, where=None) -> list[dict]:
+    """A page of book rows. after_id continues after the last ID of the previous page, where(row) filters.
+
+    e.g. query_books(20, where=lambda row: not row["Lent"], sort_by="Title")
+    """
+    return paging.query(fresh_books_lookup(), load_books_lookup, iter_books, limit, offset, after_id,
+                        sort_by, descending, where, cast_book_row)
+
+if storage_engine == "sqlite":
+    from sqlite_storage import books_store_paths, books_lock, load_books, load_books_columns, add_book, add_books, remove_book, edit_book, update_book_status, update_book_return_date, update_book_reservation, update_book_reservations, search_book, stream_books
 
-def search_book(query: str):
-    df = load_books()
-    query = query.lower()
-    mask = (
-        df["Title"].str.lower().str.contains(query) |
-        df["Author"].str.lower().str.contains(query) |
-        df["Publisher"].str.lower().str.contains(query) |
-        df["ISBN"].astype(str).str.contains(query)
-    )
-    return df[mask]
+metrics.instrument(globals(), "book")
@@ -0,0 +1,107 @@
+import csv
+import os
+
+from address import Address
+from book import add_books
+from data_files import iter_table_rows
+from exceptions import InvalidPhoneNumber, PageCountException, AddingException
+from library_db import Book, Reader
+from reader import add_readers
+
+#Part responsible for importing many books / readers at once
+book_import_columns = ["Title", "Author", "ISBN", "Publisher", "Pages"]
+reader_import_columns = ["Name", "Surname", "Phone", "City", "Street", "Apartment", "Postal Code"]
+
+def iter_rows(path: str):
+    """Streams the rows of a .csv or .xlsx file as dicts keyed by the header row."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            yield from csv.DictReader(file)
+        return
+    yield from iter_table_rows(path)
+
+def cell_text(row: dict, column: str) -> str:
+    value = row.get(column)
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def isbn_is_valid(isbn: str) -> bool:
+    """Checks the ISBN-10 or ISBN-13 check digit, dashes and spaces are ignored."""
+    isbn = isbn.replace("-", "").replace(" ", "").upper()
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == "X"):
+        digits = [int(c) for c in isbn[:9]] + [10 if isbn[9] == "X" else int(isbn[9])]
+        return sum((10 - position) * digit for position, digit in enumerate(digits)) % 11 == 0
+    if len(isbn) == 13 and isbn.isdigit():
+        return sum((3 if position % 2 else 1) * int(c) for position, c in enumerate(isbn)) % 10 == 0
+    return False
+
+def book_from_row(row: dict) -> Book:
+    values = {column: cell_text(row, column) for column in book_import_columns}
+    missing = [column for column, value in values.items() if not value]
+    if missing:
+        raise AddingException(f"Missing {', '.join(missing)}")
+    if not isbn_is_valid(values["ISBN"]):
+        raise AddingException(f"Invalid ISBN {values['ISBN']}")
+    if not values["Pages"].isdigit() or int(values["Pages"]) <= 0:
+        raise PageCountException(f"Invalid page count {values['Pages']}")
+    return Book(values["Title"], values["Author"], values["ISBN"], values["Publisher"], int(values["Pages"]))
+
+def reader_from_row(row: dict) -> Reader:
+    values = {column: cell_text(row, column) for column in reader_import_columns}
+    if not values["Name"] or not values["Surname"]:
+        raise AddingException("Missing Name or Surname")
+    address = Address(values["City"], values["Street"], values["Apartment"], values["Postal Code"])
+    return Reader(values["Name"], values["Surname"], values["Phone"], address)
+
+def write_error_report(path: str, columns: list[str], errors: list[tuple[int, dict, str]]):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Row", *columns, "Error"])
+        for row_number, row, error in errors:
+            writer.writerow([row_number, *(cell_text(row, column) for column in columns), error])
+
+def import_rows(path: str, build, commit, columns: list[str], error_report_path: str = None):
+    records = []
+    errors = []
+    # Row 1 is the header
+    for row_number, row in enumerate(iter_rows(path), start=2):
+        try:
+            records.append(build(row))
+        except (AddingException, PageCountException, InvalidPhoneNumber) as e:
+            errors.append((row_number, row, str(e)))
+
+    commit(records)
+    if errors:
+        write_error_report(error_report_path or os.path.splitext(path)[0] + ".errors.csv", columns, errors)
+    return len(records), len(errors)
+
+def import_books(path: str, error_report_path: str = None):
+    """Validates and adds every book of a .csv/.xlsx file in one write.
+
+    Rejected rows go to <file>.errors.csv. Returns (imported, rejected).
+    """
+    return import_rows(path, book_from_row, add_books, book_import_columns, error_report_path)
+
+def import_readers(path: str, error_report_path: str = None):
+    """Validates and adds every reader of a .csv/.xlsx file in one write.
+
+    Rejected rows go to <file>.errors.csv. Returns (imported, rejected).
+    """
+    return import_rows(path, reader_from_row, add_readers, reader_import_columns, error_report_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk import of books or readers from .csv/.xlsx")
+    parser.add_argument("kind", choices=["books", "readers"])
+    parser.add_argument("path")
+    parser.add_argument("--errors", help="where to write rejected rows (default: <file>.errors.csv)")
+    args = parser.parse_args()
+
+    importer = import_books if args.kind == "books" else import_readers
+    imported, rejected = importer(args.path, args.errors)
+    print(f"Imported {imported} {args.kind}, rejected {rejected}.")
@@ -0,0 +1,77 @@
+import os
+import threading
+
+#Part responsible for caching parsed data files
+# key -> (paths, signature, value); an entry is valid while none of its files changed
+_entries = {}
+hits = 0
+misses = 0
+# Held while a loader runs, so threads missing the same entry build it once (re-entrant: loaders use other entries)
+_build_lock = threading.RLock()
+
+# Pseudo paths of sources that are not files (e.g. one sqlite table) -> function returning their signature
+_sources = {}
+
+def register_source(path: str, signature):
+    _sources[path] = signature
+
+def file_signature(path: str):
+    source = _sources.get(path)
+    if source is not None:
+        return source()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def cached(key, paths: list[str], loader):
+    """Returns the value stored under key, calling loader() again if any of paths changed on disk."""
+    global hits, misses
+    signature = tuple(file_signature(path) for path in paths)
+    entry = _entries.get(key)
+    if entry is not None and entry[1] == signature:
+        hits += 1
+        return entry[2]
+
+    with _build_lock:
+        # Another thread may have built it while this one waited
+        signature = tuple(file_signature(path) for path in paths)
+        entry = _entries.get(key)
+        if entry is not None and entry[1] == signature:
+            hits += 1
+            return entry[2]
+        misses += 1
+        value = loader()
+        _entries[key] = (tuple(paths), signature, value)
+        return value
+
+def is_fresh(key):
+    """True when key is cached and none of its files changed since."""
+    entry = _entries.get(key)
+    return entry is not None and entry[1] == tuple(file_signature(path) for path in entry[0])
+
+def peek(key):
+    """The cached value without validation or counting, None when missing."""
+    entry = _entries.get(key)
+    return entry[2] if entry is not None else None
+
+def store(key, paths: list[str], value):
+    """Puts back a value the caller has just patched to match the current files."""
+    _entries[key] = (tuple(paths), tuple(file_signature(path) for path in paths), value)
+
+def invalidate(path: str = None):
+    """Drops every entry built from path (all entries when path is None)."""
+    if path is None:
+        _entries.clear()
+        return
+    for key in [key for key, entry in _entries.items() if path in entry[0]]:
+        del _entries[key]
+
+def stats():
+    return {"hits": hits, "misses": misses, "entries": len(_entries)}
+
+def reset_stats():
+    global hits, misses
+    hits = 0
+    misses = 0
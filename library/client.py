@@ -0,0 +1,126 @@
+import http.client
+import json
+import math
+import threading
+from datetime import datetime
+
+import config
+import exceptions
+from exceptions import ServiceError
+
+#Part responsible for talking to the library service
+# Same functions as desk.py, each one a POST /<operation> to service.py. desk.py switches to these
+# when LIBRARY_SERVICE is set.
+
+def encode(value):
+    """JSON-ready copy of value: datetimes as {"__datetime__": iso}, NaN/NaT as None, numpy scalars as Python ones."""
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if value is None or isinstance(value, (str, bool, int)):
+        return value
+    if value != value:
+        return None
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if hasattr(value, "item"):
+        return encode(value.item())
+    if isinstance(value, float) and math.isinf(value):
+        return None
+    return value
+
+def decode_object(d: dict):
+    if "__datetime__" in d and len(d) == 1:
+        return datetime.fromisoformat(d["__datetime__"])
+    return d
+
+class LibraryClient:
+    """One keep-alive HTTP connection to the service, calls are sent one at a time."""
+
+    def __init__(self, address: str, timeout: float = 30):
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def call(self, operation: str, *args, **kwargs):
+        """Runs desk.<operation>(*args, **kwargs) in the service, its exceptions are raised here again."""
+        from desk import read_operations
+        body = json.dumps(encode({"args": args, "kwargs": kwargs}), ensure_ascii=False).encode()
+        with self.lock:
+            response = self.post(operation, body, retry=operation in read_operations)
+        if "error" not in response:
+            return response["result"]
+
+        error = getattr(exceptions, response["error"], None)
+        if isinstance(error, type) and issubclass(error, Exception):
+            raise error(response["message"])
+        raise ServiceError(f"{response['error']}: {response['message']}")
+
+    def post(self, operation: str, body: bytes, retry: bool = False) -> dict:
+        """Sends one request. retry resends it once on a dropped keep-alive connection, only safe for reads."""
+        reused = self.connection is not None
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request("POST", f"/{operation}", body, {"Content-Type": "application/json"})
+            return json.loads(self.connection.getresponse().read(), object_hook=decode_object)
+        except (OSError, http.client.HTTPException) as e:
+            self.connection.close()
+            self.connection = None
+            # Usually an idle connection the service already dropped, but the service may also have run the request
+            # before closing (e.g. while shutting down), so writes are never sent twice
+            if retry and reused and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)):
+                return self.post(operation, body)
+            raise ServiceError(f"The library service at {self.host}:{self.port} is not reachable ({e}).")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+_client = None
+
+def get_client() -> LibraryClient:
+    global _client
+    if _client is None:
+        _client = LibraryClient(config.service_address)
+    return _client
+
+def remote(operation: str):
+    def call(*args, **kwargs):
+        return get_client().call(operation, *args, **kwargs)
+    call.__name__ = operation
+    return call
+
+book_choices = remote("book_choices")
+get_book = remote("get_book")
+book_summaries = remote("book_summaries")
+search_books = remote("search_books")
+query_books = remote("query_books")
+add_book = remote("add_book")
+edit_book = remote("edit_book")
+remove_book = remote("remove_book")
+reader_choices = remote("reader_choices")
+get_reader = remote("get_reader")
+reader_summaries = remote("reader_summaries")
+search_readers = remote("search_readers")
+add_reader = remote("add_reader")
+edit_reader = remote("edit_reader")
+remove_reader = remote("remove_reader")
+reader_history = remote("reader_history")
+lend = remote("lend")
+return_book = remote("return_book")
+extend = remote("extend")
+reserve = remote("reserve")
+sweep_expired = remote("sweep_expired")
+
+def compact():
+    """The service compacts its data files itself when it stops."""
+
+def warm_up():
+    """The service holds the data in memory already."""
@@ -0,0 +1,40 @@
+import os
+
+#Part responsible for storage settings
+data_dir = "./library/data"
+
+# "xlsx" keeps everything in books.xlsx / readers.xlsx, "sqlite" uses library.db
+storage_engine = os.environ.get("LIBRARY_STORAGE", "xlsx")
+
+# xlsx writes go to a journal first; it is folded back into the workbook after this many records
+# (and on app exit). 1 rewrites the workbook on every change.
+journal_compact_threshold = int(os.environ.get("LIBRARY_JOURNAL_THRESHOLD", "200"))
+
+# Seconds a write waits for another desk sharing data_dir to release its lock before giving up
+lock_timeout = float(os.environ.get("LIBRARY_LOCK_TIMEOUT", "5"))
+
+# File format of books/readers in data_dir: "xlsx", "parquet" or "feather" (the last two need pyarrow)
+data_format = os.environ.get("LIBRARY_FORMAT", "xlsx")
+
+# Late return fees: days after the return date that are free, charge per further day, maximum per loan (empty = none)
+fee_grace_days = int(os.environ.get("LIBRARY_FEE_GRACE_DAYS", "0"))
+fee_daily_rate = float(os.environ.get("LIBRARY_FEE_DAILY_RATE", "0.5"))
+fee_cap = float(os.environ["LIBRARY_FEE_CAP"]) if os.environ.get("LIBRARY_FEE_CAP") else None
+
+# How long a returned book is held for the next reader in its reservation queue
+reservation_hold_days = int(os.environ.get("LIBRARY_RESERVATION_HOLD_DAYS", "7"))
+
+# Seconds between sweeps that release holds nobody picked up in time
+expiry_sweep_interval = float(os.environ.get("LIBRARY_EXPIRY_SWEEP_INTERVAL", "60"))
+
+# "host:port" of a running library service (python library/service.py); the screens then go through it
+# instead of loading the data files themselves
+service_address = os.environ.get("LIBRARY_SERVICE", "")
+
+# LIBRARY_METRICS=1 records call latencies and data file reads/writes (metrics.py), written to LIBRARY_METRICS_FILE
+# (default data/metrics.<pid>.json) at exit
+metrics_enabled = os.environ.get("LIBRARY_METRICS", "") not in ("", "0")
+metrics_file = os.environ.get("LIBRARY_METRICS_FILE", "")
+
+# LIBRARY_STARTUP_TIMES=1 starts the app, prints how long each startup phase took once the data is loaded and quits
+startup_times = os.environ.get("LIBRARY_STARTUP_TIMES", "") not in ("", "0")
@@ -0,0 +1,154 @@
+import os
+
+import pandas as pd
+
+import config
+import metrics
+
+#Part responsible for reading and writing the data files
+# .xlsx goes through pandas/openpyxl, .parquet and .feather through pyarrow with memory-mapped reads.
+data_formats = ("xlsx", "parquet", "feather")
+
+def data_path(name: str, data_format: str = None) -> str:
+    """data_path("books") -> ./library/data/books.<configured format>"""
+    return os.path.join(config.data_dir, f"{name}.{data_format or config.data_format}")
+
+def file_format(path: str) -> str:
+    data_format = os.path.splitext(path)[1].lstrip(".").lower()
+    if data_format not in data_formats:
+        raise ValueError(f"Unsupported data file {path}, expected one of {', '.join(data_formats)}")
+    return data_format
+
+def typed(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """Casts the columns to the storage types, columnar files keep them instead of guessing on read."""
+    df = df.copy()
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype.startswith("datetime64"):
+            df[column] = pd.to_datetime(df[column], errors="coerce").astype(dtype)
+        elif dtype == "str":
+            df[column] = df[column].map(lambda value: "" if pd.isna(value) else str(value)).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+def with_versions(df: pd.DataFrame) -> pd.DataFrame:
+    """Files written before rows were versioned have no Version column (or gaps after a journal replay), those rows are at 0."""
+    if "Version" not in df.columns:
+        return df.assign(Version=0)
+    if df["Version"].isna().any() or df["Version"].dtype != "int64":
+        df["Version"] = df["Version"].fillna(0).astype("int64")
+    return df
+
+def is_missing(value) -> bool:
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+def cast_text(value) -> str:
+    if is_missing(value):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return value if isinstance(value, str) else str(value)
+
+def row_caster(dtypes: dict):
+    """Row-dict counterpart of typed(): returns a function that gives each column of dtypes its storage type
+    (Version 0 when missing, NaT / NaN / "" for empty cells), so streamed and cached rows look the same."""
+    casts = {}
+    for column, dtype in dtypes.items():
+        if dtype.startswith("datetime64"):
+            casts[column] = lambda value: pd.NaT if is_missing(value) else pd.Timestamp(value)
+        elif dtype == "str":
+            casts[column] = cast_text
+        elif dtype == "int64":
+            casts[column] = lambda value: 0 if is_missing(value) else int(value)
+        elif dtype == "float64":
+            casts[column] = lambda value: float("nan") if is_missing(value) else float(value)
+        elif dtype == "bool":
+            casts[column] = lambda value: False if is_missing(value) else bool(value)
+    def cast(row: dict) -> dict:
+        return {column: cast_value(row.get(column)) for column, cast_value in casts.items()}
+    return cast
+
+def read_table(path: str, columns: list[str] = None) -> pd.DataFrame:
+    """Reads a data file, only the given columns when columns is set."""
+    data_format = file_format(path)
+    if data_format == "xlsx":
+        df = pd.read_excel(path, usecols=columns)
+    elif data_format == "parquet":
+        import pyarrow.parquet as pq
+        df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        import pyarrow.feather as feather
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    metrics.file_read(path, len(df))
+    return df
+
+def iter_table_rows(path: str, columns: list[str] = None, batch_size: int = 1024):
+    """Streams a data file as row dicts without loading it whole (openpyxl read-only / Arrow record batches)."""
+    data_format = file_format(path)
+    if data_format == "xlsx":
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+            wanted = [i for i, column in enumerate(header) if columns is None or column in columns]
+            for values in rows:
+                if any(value is not None for value in values):
+                    metrics.count("rows streamed")
+                    yield {header[i]: values[i] if i < len(values) else None for i in wanted}
+        finally:
+            workbook.close()
+        return
+
+    import pyarrow as pa
+    if data_format == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=batch_size, columns=columns)
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        if columns is not None:
+            batches = (batch.select(columns) for batch in batches)
+    for batch in batches:
+        metrics.count("rows streamed", batch.num_rows)
+        yield from batch.to_pylist()
+
+def write_table(df: pd.DataFrame, path: str, dtypes: dict = None):
+    data_format = file_format(path)
+    # Written next to the target and swapped in, so another desk never reads a half-written file
+    base, extension = os.path.splitext(path)
+    tmp_path = f"{base}.{os.getpid()}.tmp{extension}"
+    if data_format == "xlsx":
+        df.to_excel(tmp_path, index=False)
+    else:
+        df = typed(df, dtypes or {}).reset_index(drop=True)
+        if data_format == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            import pyarrow.feather as feather
+            # Uncompressed so reads can map the file instead of decoding it
+            feather.write_feather(df, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+    metrics.file_written(path, len(df))
+
+def convert(source_path: str, target_path: str, dtypes: dict = None):
+    write_table(read_table(source_path), target_path, dtypes)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from book import book_dtypes
+    from reader import reader_dtypes
+
+    parser = argparse.ArgumentParser(description="Converts books/readers data files between formats")
+    parser.add_argument("source", choices=data_formats)
+    parser.add_argument("target", choices=data_formats)
+    args = parser.parse_args()
+
+    convert(data_path("books", args.source), data_path("books", args.target), book_dtypes)
+    convert(data_path("readers", args.source), data_path("readers", args.target), reader_dtypes)
+    print(f"Converted books and readers from {args.source} to {args.target}. "
+          f"Set LIBRARY_FORMAT={args.target} to use them.")
@@ -0,0 +1,212 @@
+import config
+
+#Part responsible for the operations the desk screens perform
+# Everything here takes and returns plain values (IDs, dicts of storage columns, messages), so the same functions
+# can run in this process or in the library service (service.py). With LIBRARY_SERVICE set they are replaced by
+# the client.py calls at the bottom and this process never loads the catalog itself.
+# book.py / reader.py are imported inside the functions for that reason.
+
+book_statuses = {
+    None: None,
+    "available": lambda book: not book.lent,
+    "lent": lambda book: book.lent,
+    "reservable": lambda book: book.lent or book.reserved,
+}
+
+"""
+Books =====
+"""
+
+def book_choices(query: str, limit: int = 8, status: str = None) -> list[tuple[int, str]]:
+    """(ID, label) of the best matching books for a picker, status narrows them (see book_statuses)."""
+    from book import find_books
+    return [(int(book.id), f"{book.id}: {book.title}") for book in find_books(query, limit, book_statuses[status])]
+
+def get_book(book_id: int) -> dict | None:
+    from book import get_book
+    book = get_book(book_id)
+    return None if book is None else book.to_dict()
+
+def book_summaries() -> list[dict]:
+    """ID, Title, Author and Lent of every book."""
+    from book import load_books_columns
+    return load_books_columns(["Title", "Author", "Lent"]).to_dict("records")
+
+def search_books(query: str, limit: int = 50) -> list[dict]:
+    from book import search_book
+    return search_book(query, limit).to_dict("records")
+
+def query_books(limit: int = 50, offset: int = 0, after_id: int = None, sort_by: str = None,
+                descending: bool = False) -> list[dict]:
+    from book import query_books
+    return query_books(limit, offset, after_id, sort_by, descending)
+
+def book_from_values(values: dict):
+    from library_db import Book
+    return Book(values["Title"], values["Author"], values["ISBN"], values["Publisher"], int(values["Pages"]))
+
+def add_book(values: dict) -> int:
+    """Adds a book from {"Title", "Author", "ISBN", "Publisher", "Pages"} and returns its ID."""
+    from book import add_book
+    book = book_from_values(values)
+    add_book(book)
+    return int(book.id)
+
+def edit_book(book_id: int, values: dict, expected_version: int = None):
+    from book import edit_book
+    edit_book(book_id, book_from_values(values), expected_version)
+
+def remove_book(book_id: int):
+    from book import remove_book
+    remove_book(book_id)
+
+"""
+Readers =====
+"""
+
+def reader_choices(query: str, limit: int = 8) -> list[tuple[int, str]]:
+    from reader import find_readers
+    return [(int(reader.id), f"{reader.id}: {reader.name} {reader.surname}") for reader in find_readers(query, limit)]
+
+def get_reader(reader_id: int) -> dict | None:
+    from reader import get_reader
+    reader = get_reader(reader_id)
+    return None if reader is None else reader.to_dict()
+
+def reader_summaries() -> list[dict]:
+    """ID, Name and Surname of every reader."""
+    from reader import load_readers_object
+    return [{"ID": reader.id, "Name": reader.name, "Surname": reader.surname}
+            for reader in load_readers_object(with_loans=False)]
+
+def search_readers(query: str, limit: int = 50, within: list[int] = None) -> list[dict]:
+    """ID, Name and Surname of the readers matching query, within narrows an earlier result (see search_reader_ids)."""
+    from reader import get_reader, search_reader_ids
+    readers = (get_reader(reader_id) for reader_id in search_reader_ids(query, limit, within))
+    return [{"ID": reader.id, "Name": reader.name, "Surname": reader.surname} for reader in readers if reader is not None]
+
+def reader_from_values(values: dict):
+    from address import Address
+    from library_db import Reader
+    address = Address(values.get("City", ""), values.get("Street", ""), values.get("Apartment", ""),
+                      values.get("Postal Code", ""))
+    return Reader(values["Name"], values["Surname"], str(values["Phone"]), address)
+
+def add_reader(values: dict) -> int:
+    """Adds a reader from {"Name", "Surname", "Phone", "City", "Street", "Apartment", "Postal Code"}, returns the ID."""
+    from reader import add_reader
+    reader = reader_from_values(values)
+    add_reader(reader)
+    return int(reader.id)
+
+def edit_reader(reader_id: int, values: dict, expected_version: int = None):
+    from reader import edit_reader
+    edit_reader(reader_id, reader_from_values(values), expected_version)
+
+def remove_reader(reader_id: int):
+    from reader import remove_reader
+    remove_reader(reader_id)
+
+def reader_history(reader_id: int) -> dict | None:
+    """{"reader": row, "lent": current loans [{"Title", "Return date"}],
+    "borrowed" / "returned" / "extended" / "reserved": past events [{"Title", "At"}]}, None for an unknown reader.
+    """
+    from reader import get_reader, load_loans_by_reader
+    reader = get_reader(reader_id)
+    if reader is None:
+        return None
+    history = {
+        "reader": reader.to_dict(),
+        "lent": [{"Title": book.title, "Return date": book.return_date}
+                 for book in load_loans_by_reader().get(reader.id, ())],
+    }
+    past = reader.load_history()
+    for kind in ("borrowed", "returned", "extended", "reserved"):
+        history[kind] = [{"Title": book.title, "At": at} for book, dates in past.get(kind, {}).items() for at in dates]
+    return history
+
+"""
+Circulation =====
+"""
+
+def loan_parties(book_id: int, reader_id: int):
+    from book import get_book
+    from reader import get_reader
+    return get_book(book_id), get_reader(reader_id)
+
+def lend(book_id: int, reader_id: int) -> str:
+    book, reader = loan_parties(book_id, reader_id)
+    if not (reader and book):
+        return "Reader or book not found."
+    reader.borrow(book)
+    return f"Book '{book.title}' lent to {reader.name}."
+
+def return_book(book_id: int, reader_id: int) -> str:
+    from library_db import record_id
+    book, reader = loan_parties(book_id, reader_id)
+    if not (reader and book):
+        return "Reader or book not found."
+    if not book.lent or record_id(book.lent_to) != reader.id:
+        return f"Error: This book is not borrowed by {reader.name} {reader.surname}."
+
+    fee = reader.return_book(book)
+    if fee > 0:
+        return f"Book '{book.title}' returned with a fee of ${fee:.2f}."
+    return f"Book '{book.title}' returned successfully with no fee."
+
+def extend(book_id: int, reader_id: int) -> str:
+    from library_db import record_id
+    book, reader = loan_parties(book_id, reader_id)
+    if not (reader and book):
+        return "Reader or book not found."
+    if not book.lent or record_id(book.lent_to) != reader.id:
+        return f"Error: This book is not borrowed by {reader.name} {reader.surname}."
+    return reader.extend(book)
+
+def reserve(book_id: int, reader_id: int, priority: int = 0) -> str:
+    book, reader = loan_parties(book_id, reader_id)
+    if not (reader and book):
+        return "Reader or book not found."
+    position = reader.reserve(book, priority)
+    if position:
+        return f"{reader.name} is number {position} in the queue for '{book.title}'."
+    return f"Book '{book.title}' reserved for {reader.name} until {book.reserved_until.strftime('%Y-%m-%d')}."
+
+def sweep_expired() -> list[int]:
+    from expiry import sweep_expired
+    return sweep_expired()
+
+def compact():
+    """Folds the journals back into the data files and saves the search index, run when the app or service stops."""
+    from book import compact_books, save_search_index
+    from reader import compact_readers
+    compact_books()
+    compact_readers()
+    save_search_index()
+
+def warm_up():
+    """Loads the catalog, the readers and their search indexes, so the first request is answered from memory."""
+    from book import get_search_index, load_books_lookup
+    from reader import get_reader_index, load_loans_by_reader, load_readers_lookup
+    load_books_lookup()
+    get_search_index()
+    load_readers_lookup()
+    get_reader_index()
+    load_loans_by_reader()
+
+# Reads can run side by side in the service, everything else is serialized
+read_operations = {
+    "book_choices", "get_book", "book_summaries", "search_books", "query_books", "reader_choices", "get_reader",
+    "reader_summaries", "search_readers", "reader_history",
+}
+operations = read_operations | {
+    "add_book", "edit_book", "remove_book", "add_reader", "edit_reader", "remove_reader",
+    "lend", "return_book", "extend", "reserve", "sweep_expired",
+}
+
+remote = bool(config.service_address)
+if remote:
+    from client import (book_choices, get_book, book_summaries, search_books, query_books, add_book, edit_book,
+                        remove_book, reader_choices, get_reader, reader_summaries, search_readers, add_reader,
+                        edit_reader, remove_reader, reader_history, lend, return_book, extend, reserve,
+                        sweep_expired, compact, warm_up)
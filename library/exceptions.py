@@ -11,6 +11,14 @@ class AddingException(Exception):
     """Raised when can't add reader or book"""
     pass
 
+class WriteConflict(Exception):
+    """Raised when another desk changed the record first or holds the data lock for too long"""
+    pass
+
+class ServiceError(Exception):
+    """Raised when the library service can't be reached or fails unexpectedly"""
+    pass
+
 """READER EXCEPTIONS"""
 
 class InvalidPhoneNumber(Exception):
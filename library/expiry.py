@@ -0,0 +1,116 @@
+import heapq
+from datetime import datetime
+
+import pandas as pd
+
+import config
+
+#Part responsible for releasing expired reservation holds
+# A returned book is held for the reader at the front of its queue until "Reserved until".
+# Deadlines wait in a min-heap, so a sweep only looks at the holds that actually expired.
+
+class ExpiryScheduler:
+    """Min-heap of (deadline, book ID). Entries made stale by later changes are dropped when popped.
+
+    Holds this process writes are pushed by watch() and its own writes keep the heap current (book.commit_book_changes),
+    the heap is only re-scanned when another desk or process changed the books.
+    """
+
+    def __init__(self):
+        self.heap: list[tuple[pd.Timestamp, int]] = []
+        self.signature = None
+
+    def load(self):
+        """Collects every hold of a book on the shelf."""
+        from book import books_signature, load_books_columns
+        # Taken before reading, so a write landing meanwhile triggers another scan
+        self.signature = books_signature()
+        books = load_books_columns(["Lent", "Reserved", "Reserved until"])
+        held = books[books["Reserved"].astype(bool) & ~books["Lent"].astype(bool) & books["Reserved until"].notna()]
+        self.heap = list(zip(pd.to_datetime(held["Reserved until"]).tolist(), held["ID"].tolist()))
+        heapq.heapify(self.heap)
+
+    def is_current(self):
+        from book import books_signature
+        return self.signature is not None and self.signature == books_signature()
+
+    def mark_current(self):
+        """Called after this process's own writes, whose holds are scheduled through watch()."""
+        from book import books_signature
+        self.signature = books_signature()
+
+    def schedule(self, book_id: int, deadline):
+        heapq.heappush(self.heap, (pd.Timestamp(deadline), int(book_id)))
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+    def pop_expired(self, now: datetime = None) -> list[int]:
+        if not self.is_current():
+            self.load()
+        now = pd.Timestamp(now or datetime.now())
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            expired.append(heapq.heappop(self.heap))
+        return expired
+
+scheduler = ExpiryScheduler()
+
+def watch(book):
+    """Schedules the book's hold, if it is waiting on the shelf for someone."""
+    if book.reserved and not book.lent and book.reserved_until is not None and not pd.isna(book.reserved_until):
+        scheduler.schedule(book.id, book.reserved_until)
+
+def sweep_expired(now: datetime = None) -> list[int]:
+    """Passes every expired hold to the next reader in the queue (or clears it) with one write.
+
+    Runs under the books lock and checks each row's Version, so desks sweeping at the same time release a hold once.
+    Returns the IDs of the released books.
+    """
+    from book import books_lock, get_book, update_book_reservations
+    from reservations import hold_values, remove_reservations, waiting_readers
+
+    now = now or datetime.now()
+    with books_lock():
+        changes = {}
+        versions = {}
+        handed_over = []
+        for deadline, book_id in scheduler.pop_expired(now):
+            book = get_book(book_id)
+            # Skip entries for holds that were picked up or replaced since they were scheduled
+            if (book_id in changes or book is None or not book.reserved or book.lent or book.reserved_until is None
+                    or pd.isna(book.reserved_until) or pd.Timestamp(book.reserved_until) != deadline):
+                continue
+            waiting = waiting_readers(book_id)
+            reader_id = waiting[0] if waiting else None
+            changes[book_id] = hold_values(reader_id, now)
+            versions[book_id] = book.version
+            if reader_id is not None:
+                handed_over.append((book_id, reader_id))
+
+        if changes:
+            # The books are written first: if that fails, nobody has left a queue yet
+            update_book_reservations(list(changes.items()), versions)
+            remove_reservations(handed_over)
+            for book_id in changes:
+                book = get_book(book_id)
+                if book is not None:
+                    watch(book)
+    return list(changes)
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Releases reservation holds nobody picked up in time")
+    parser.add_argument("--daemon", action="store_true", help="keep sweeping every --interval seconds")
+    parser.add_argument("--interval", type=float, default=config.expiry_sweep_interval)
+    args = parser.parse_args()
+
+    while True:
+        released = sweep_expired()
+        if released:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} released holds on books {released}", flush=True)
+        if not args.daemon:
+            break
+        time.sleep(args.interval)
@@ -22,15 +22,12 @@ class Home(BoxLayout):
 
         buttons_layout = BoxLayout(orientation="vertical", padding=50, spacing=20)
 
-        from manage_books import ManageBooks
-        from manage_readers import ManageReaders
-
         btn_manage_books = Button(text="Manage Books", size_hint_y=None, height=60)
         btn_manage_readers = Button(text="Manage Readers", size_hint_y=None, height=60)
         btn_exit = Button(text="Exit", size_hint_y=None, height=60)
 
-        btn_manage_books.bind(on_press=lambda x: switch_layout_callback(ManageBooks))
-        btn_manage_readers.bind(on_press=lambda x: switch_layout_callback(ManageReaders))
+        btn_manage_books.bind(on_press=self.open_manage_books)
+        btn_manage_readers.bind(on_press=self.open_manage_readers)
         btn_exit.bind(on_press=self.exit_app)
 
         buttons_layout.add_widget(btn_manage_books)
@@ -40,6 +37,15 @@ class Home(BoxLayout):
         self.add_widget(top_layout)
         self.add_widget(buttons_layout)
 
+    # The screen modules are imported on first use, the home screen doesn't need them to paint
+    def open_manage_books(self, instance):
+        from manage_books import ManageBooks
+        self.switch_layout_callback(ManageBooks)
+
+    def open_manage_readers(self, instance):
+        from manage_readers import ManageReaders
+        self.switch_layout_callback(ManageReaders)
+
     @staticmethod
     def exit_app(instance):
         App.get_running_app().stop()
\ No newline at end of file
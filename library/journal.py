@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+
+logger = logging.getLogger("library.journal")
+
+#Part responsible for the append-only mutation journal
+# Every write is stored as one JSON line next to the snapshot (books.xlsx -> books.journal)
+# and replayed over the snapshot on load, until compaction folds it back in.
+
+def journal_path_for(snapshot_path: str):
+    return os.path.splitext(snapshot_path)[0] + ".journal"
+
+def encode_value(value):
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return {"__datetime__": value.isoformat()}
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict) and "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+def trim_torn_tail(path: str):
+    """Cuts a torn last line (a crash mid-append) back to the last newline, so the next append starts a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as file:
+        end = file.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        file.seek(end - 1)
+        if file.read(1) == b"\n":
+            return
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            file.seek(start)
+            chunk = file.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        logger.warning("dropping torn journal tail in %s (%d bytes)", path, end - position)
+        file.truncate(position)
+
+def append(path: str, op: str, row_id: int, values: dict = None):
+    """Appends one record ("add", "update" or "remove") and returns the journal length."""
+    record = {"op": op, "id": int(row_id)}
+    if values is not None:
+        record["values"] = {column: encode_value(value) for column, value in values.items()}
+    trim_torn_tail(path)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return count_records(path)
+
+def append_many(path: str, changes: list[tuple]):
+    """Appends [(op, ID, values)] with a single write and returns the journal length."""
+    lines = []
+    for op, row_id, values in changes:
+        record = {"op": op, "id": int(row_id)}
+        if values is not None:
+            record["values"] = {column: encode_value(value) for column, value in values.items()}
+        lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+    trim_torn_tail(path)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write("".join(lines))
+    return count_records(path)
+
+def count_records(path: str):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as file:
+        return sum(1 for _ in file)
+
+def read_records(path: str):
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, encoding="utf-8", errors="replace") as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn line from a crash mid-append, the records around it are still valid
+                logger.warning("skipping unreadable journal line %d in %s", number, path)
+                continue
+            record["values"] = {column: decode_value(value) for column, value in record.get("values", {}).items()}
+            records.append(record)
+    return records
+
+def replay(df: pd.DataFrame, path: str):
+    """Applies the journal on top of the snapshot frame. Replaying twice gives the same result."""
+    records = read_records(path)
+    if not records:
+        return df
+
+    df = df.set_index("ID", drop=False)
+    # Journaled values may not fit the dtype the snapshot was parsed with (e.g. a phone typed as text)
+    updated_columns = {column for record in records if record["op"] == "update" for column in record["values"]}
+    for column in updated_columns & set(df.columns):
+        df[column] = df[column].astype(object)
+
+    added = {}
+    removed = set()
+    for record in records:
+        op, row_id, values = record["op"], record["id"], record["values"]
+        if op == "add":
+            removed.discard(row_id)
+            if row_id in df.index:
+                removed.add(row_id)
+            added[row_id] = dict(values)
+        elif op == "update":
+            if row_id in added:
+                added[row_id].update(values)
+            elif row_id in df.index and row_id not in removed:
+                df.loc[row_id, list(values)] = list(values.values())
+        elif op == "remove":
+            added.pop(row_id, None)
+            removed.add(row_id)
+
+    df = df.drop(index=[row_id for row_id in removed if row_id in df.index]).reset_index(drop=True)
+    if added:
+        new_rows = pd.DataFrame(list(added.values()))
+        df = new_rows if df.empty else pd.concat([df, new_rows], ignore_index=True)
+    return df.sort_values("ID", ignore_index=True).infer_objects()
+
+def clear(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+def replay_rows(rows, path: str):
+    """Streaming counterpart of replay: applies the journal to an iterator of row dicts (ordered by ID)."""
+    records = read_records(path)
+    if not records:
+        yield from rows
+        return
+
+    updates = {}
+    added = {}
+    removed = set()
+    for record in records:
+        op, row_id, values = record["op"], record["id"], record["values"]
+        if op == "add":
+            removed.add(row_id)
+            added[row_id] = dict(values)
+            updates.pop(row_id, None)
+        elif op == "update":
+            if row_id in added:
+                added[row_id].update(values)
+            else:
+                updates.setdefault(row_id, {}).update(values)
+        elif op == "remove":
+            added.pop(row_id, None)
+            updates.pop(row_id, None)
+            removed.add(row_id)
+
+    pending = sorted(added)
+    position = 0
+    for row in rows:
+        row_id = row["ID"]
+        while position < len(pending) and pending[position] < row_id:
+            yield added[pending[position]]
+            position += 1
+        if row_id in removed:
+            continue
+        if row_id in updates:
+            row = {**row, **updates[row_id]}
+        yield row
+    for row_id in pending[position:]:
+        yield added[row_id]
@@ -2,19 +2,35 @@ import os
 from datetime import datetime, timedelta
 import pandas as pd
 
-from address import Address
+import config
+import metrics
+from address import Address, intern_str
 from exceptions import InvalidPhoneNumber, BookLentToSomeone, BookReserved
 
 
+def record_id(value):
+    """ID of a Reader/Book attribute, which holds the object itself or the (possibly float) ID loaded from storage."""
+    value = getattr(value, "id", value)
+    return None if value is None or value != value else int(value)
+
 #Part responsible for books
 class Book:
     __id = 0
+    __slots__ = ("id", "title", "author", "isbn", "publisher", "page_count", "lent_date", "lent_to",
+                 "return_date", "lent", "reserved", "reserved_until", "reserved_by", "version")
+    # Storage column -> attribute, lent_to / reserved_by hold reader IDs when loaded from storage
+    column_attributes = {
+        "ID": "id", "Title": "title", "Author": "author", "ISBN": "isbn", "Publisher": "publisher",
+        "Pages": "page_count", "Lent": "lent", "Lent to": "lent_to", "Lent date": "lent_date",
+        "Return date": "return_date", "Reserved": "reserved", "Reserved by": "reserved_by",
+        "Reserved until": "reserved_until", "Version": "version"
+    }
 
     def __init__(self, title: str, author: str, isbn: int, publisher: str, page_count: int):
         self.title = title
-        self.author = author
+        self.author = intern_str(author)
         self.isbn = isbn
-        self.publisher = publisher
+        self.publisher = intern_str(publisher)
         self.page_count = page_count
 
         Book.__id += 1
@@ -27,6 +43,8 @@ class Book:
         self.reserved = False
         self.reserved_until: datetime.date = datetime.now()
         self.reserved_by: Reader = None
+        # Bumped by every stored change, writes can check it to detect a concurrent change at another desk
+        self.version = 0
 
     def to_dict(self):
         return {
@@ -37,14 +55,21 @@ class Book:
             "Publisher": self.publisher,
             "Pages": self.page_count,
             "Lent": self.lent,
-            "Lent to": self.lent_to.id if self.lent_to else None,
+            "Lent to": getattr(self.lent_to, "id", self.lent_to),
             "Lent date": self.lent_date,
             "Return date": self.return_date,
             "Reserved": self.reserved,
-            "Reserved by": self.reserved_by.id if self.reserved_by else None,
-            "Reserved until": self.reserved_until
+            "Reserved by": getattr(self.reserved_by, "id", self.reserved_by),
+            "Reserved until": self.reserved_until,
+            "Version": self.version
         }
 
+    def apply(self, values: dict):
+        """Sets attributes from storage column values, as written by book.py."""
+        for column, value in values.items():
+            attribute = Book.column_attributes[column]
+            setattr(self, attribute, intern_str(value) if attribute in ("author", "publisher") else value)
+
     @staticmethod
     def from_dict(d):
         book = Book(
@@ -62,14 +87,53 @@ class Book:
         book.reserved = d.get("Reserved", False)
         book.reserved_by = d.get("Reserved by", None)
         book.reserved_until = d.get("Reserved until", None)
+        book.version = d.get("Version", 0)
 
         Book.__id = max(Book.__id, d["ID"])
         return book
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame):
+        """Builds all books of a frame at once, straight from its columns and without running __init__."""
+        books = []
+        columns = zip(
+            df["ID"].tolist(), df["Title"].tolist(), df["Author"].tolist(), df["ISBN"].tolist(),
+            df["Publisher"].tolist(), df["Pages"].tolist(), df["Lent"].tolist(), df["Lent to"].tolist(),
+            df["Lent date"].tolist(), df["Return date"].tolist(), df["Reserved"].tolist(),
+            df["Reserved by"].tolist(), df["Reserved until"].tolist(), df["Version"].tolist()
+        )
+        for (book_id, title, author, isbn, publisher, pages, lent, lent_to, lent_date,
+             return_date, reserved, reserved_by, reserved_until, version) in columns:
+            book = Book.__new__(Book)
+            book.id = book_id
+            book.title = title
+            book.author = intern_str(author)
+            book.isbn = isbn
+            book.publisher = intern_str(publisher)
+            book.page_count = pages
+            book.lent = lent
+            book.lent_to = lent_to
+            book.lent_date = lent_date
+            book.return_date = return_date
+            book.reserved = reserved
+            book.reserved_by = reserved_by
+            book.reserved_until = reserved_until
+            book.version = version
+            books.append(book)
+
+        if books:
+            Book.__id = max(Book.__id, int(df["ID"].max()))
+        metrics.count("books materialized", len(books))
+        return books
+
     def __str__(self):
         return f"{self.title} ({self.author}, {self.publisher}, {self.page_count} pages.)"
 
 class Reader:
     __readerID = 0
+    __slots__ = ("name", "surname", "phone_num", "address", "__id", "borrowed_books", "version")
+    column_attributes = {"Name": "name", "Surname": "surname", "Phone": "phone_num", "Version": "version"}
+    address_column_attributes = {"City": "city", "Street": "street", "Apartment": "apartment", "Postal Code": "postal_code"}
 
     def __init__(self, name: str, surname: str, phone_num: str, address: Address = None):
         if not phone_num.isdigit() or len(phone_num) != 9:
@@ -82,54 +146,76 @@ class Reader:
         Reader.__readerID += 1
         self.__id = Reader.__readerID
         self.borrowed_books: list[Book] = []
-
-        self.past_borrowed: dict[Book, list[datetime]] = {}
-        self.past_returned: dict[Book, list[datetime]] = {}
-        self.past_extended: dict[Book, list[datetime]] = {}
-        self.past_reserved: dict[Book, list[datetime]] = {}
+        self.version = 0
 
     @property
     def id(self):
         return self.__id
 
+    def history(self, kind: str) -> dict[Book, list[datetime]]:
+        return self.load_history().get(kind, {})
+
+    def load_history(self) -> dict[str, dict[Book, list[datetime]]]:
+        """Read from the loan history on every call (not kept on the shared object), so loans made at other desks show."""
+        from book import get_book
+        from loan_history import reader_loan_events
+        history = {}
+        for event in reader_loan_events(self.id):
+            book = get_book(event.book_id)
+            # Books removed since then are left out
+            if book is not None:
+                history.setdefault(event.kind, {}).setdefault(book, []).append(event.at)
+        return history
+
+    @property
+    def past_borrowed(self):
+        return self.history("borrowed")
+
+    @property
+    def past_returned(self):
+        return self.history("returned")
+
+    @property
+    def past_extended(self):
+        return self.history("extended")
+
+    @property
+    def past_reserved(self):
+        return self.history("reserved")
+
     def borrow(self, book: Book):
         now = datetime.now()
-        if not book.reserved or book.reserved_by == self:
-            if not book.lent:
-                self.borrowed_books.append(book)
-                if book in self.past_borrowed:
-                    self.past_borrowed[book].append(now)
-                else:
-                    self.past_borrowed[book] = [now]
-
-                book.lent = True
-                book.lent_to = self
-                book.lent_date = now
-                book.return_date = now + timedelta(days=30)
-
-                if book.reserved_by == self:
-                    book.reserved = False
-                    book.reserved_by = None
-
-                from book import update_book_status
-                update_book_status(book.id, True, self.id)
-            else:
-                raise BookLentToSomeone("Can't borrow already lent book.")
-        else:
+        if book.reserved and record_id(book.reserved_by) != self.id:
             raise BookReserved("Book reserved by someone else")
+        if book.lent:
+            raise BookLentToSomeone("Can't borrow already lent book.")
+
+        from book import update_book_status
+        from loan_history import record_loan_event
+        # Stored first, so a change made meanwhile at another desk (WriteConflict) leaves this object untouched
+        update_book_status(book.id, True, self.id, expected_version=book.version)
+
+        self.borrowed_books.append(book)
+
+        book.lent = True
+        book.lent_to = self
+        book.lent_date = now
+        book.return_date = now + timedelta(days=30)
+        record_loan_event("borrowed", book.id, self.id, now)
+
+        if book.reserved:
+            # The holder picked the book up, the next in the queue gets it after this loan
+            from reservations import hand_over
+            hand_over(book, book.return_date)
 
     def return_book(self, book: Book):
         now = datetime.now()
-        date_until_fee = book.return_date
-        fee = 0
-
-        if now.day > date_until_fee.day:
-            fee = 0.5 * (now - date_until_fee).days
+        from fees import fee_for
+        fee = fee_for(book.return_date, now)
 
-        if book in self.past_returned:
-            self.past_returned[book].append(now)
-        else:
-            self.past_returned[book] = [now]
+        from book import update_book_status, update_book_reservation
+        from loan_history import record_loan_event
+        update_book_status(book.id, False, None, expected_version=book.version)
 
         if book in self.borrowed_books:
             self.borrowed_books.remove(book)
@@ -138,13 +224,18 @@ class Reader:
         book.lent_to = None
         book.lent_date = None
         book.return_date = None
+        record_loan_event("returned", book.id, self.id, now)
 
-        if book.reserved and book.reserved_by == self:
-            book.reserved = False
-            book.reserved_by = None
-
-        from book import update_book_status
-        update_book_status(book.id, False, None)
+        if book.reserved:
+            from reservations import hand_over
+            if record_id(book.reserved_by) == self.id:
+                hand_over(book, now)
+            else:
+                # Held for the next reader from now on
+                book.reserved_until = now + timedelta(days=config.reservation_hold_days)
+                update_book_reservation(book.id, True, record_id(book.reserved_by), book.reserved_until)
+                from expiry import watch
+                watch(book)
 
         return fee
     def extend(self, book: Book):
@@ -153,18 +244,62 @@ class Reader:
         if book.reserved:
             return "Can't extend - book reserved by someone"
 
-        self.past_extended.setdefault(book, []).append(datetime.now())
-        book.return_date += timedelta(days=30)
+        now = datetime.now()
+        return_date = book.return_date + timedelta(days=30)
+        from book import update_book_return_date
+        from loan_history import record_loan_event
+        # Stored first, so other desks and the fee report see the new date and a concurrent change leaves this untouched
+        update_book_return_date(book.id, return_date, expected_version=book.version)
+
+        book.return_date = return_date
+        record_loan_event("extended", book.id, self.id, now)
         return f"Extended the return date, new return date: {book.return_date}"
 
-    def reserve(self, book: Book):
-        if book.lent and not book.reserved:
-            book.reserved_until = book.return_date + timedelta(days=7)
-            book.reserved_by = self
-            book.reserved = True
-            self.past_reserved.setdefault(book, []).append(datetime.now())
+    def reserve(self, book: Book, priority: int = 0) -> int:
+        """Holds a lent book for this reader, or queues them when it is already held for someone.
+
+        Returns the place in the queue, 0 when the book is held for this reader.
+        """
+        from book import update_book_reservation
+        from loan_history import record_loan_event
+        from reservations import enqueue_reservation, waiting_readers
+
+        if not book.lent and not book.reserved:
+            raise BookReserved("Can't reserve book - it is not lent, borrow it instead")
+        if self.id in (record_id(book.lent_to), record_id(book.reserved_by)) or self.id in waiting_readers(book.id):
+            raise BookReserved("Can't reserve book - already lent to or reserved by this reader")
+
+        now = datetime.now()
+        if book.reserved:
+            enqueue_reservation(book.id, self.id, priority)
+            position = waiting_readers(book.id).index(self.id) + 1
         else:
-            raise BookReserved("Can't reserve book - already reserved or not lent")
+            reserved_until = book.return_date + timedelta(days=config.reservation_hold_days)
+            update_book_reservation(book.id, True, self.id, reserved_until, expected_version=book.version)
+            book.reserved_until = reserved_until
+            book.reserved_by = self.id
+            book.reserved = True
+            position = 0
+
+        record_loan_event("reserved", book.id, self.id, now)
+        return position
+
+    def apply(self, values: dict):
+        """Sets attributes from storage column values, as written by reader.py."""
+        address_values = {}
+        for column, value in values.items():
+            if column == "ID":
+                self.__id = value
+            elif column in Reader.column_attributes:
+                setattr(self, Reader.column_attributes[column], value)
+            else:
+                address_values[column] = value
+        if address_values:
+            if self.address is None:
+                self.address = Address("", "", "", "")
+            for column, value in address_values.items():
+                setattr(self.address, Reader.address_column_attributes[column],
+                        intern_str(value) if column == "City" else value)
 
     def to_dict(self):
         return {
@@ -175,11 +310,12 @@ class Reader:
             "City": self.address.city if self.address else "",
             "Street": self.address.street if self.address else "",
             "Apartment": self.address.apartment if self.address else "",
-            "Postal Code": self.address.postal_code if self.address else ""
+            "Postal Code": self.address.postal_code if self.address else "",
+            "Version": self.version
         }
 
     @staticmethod
-    def from_dict(d):
+    def from_dict(d, borrowed_books: list[Book] = None):
         address = Address(
             d.get("City", ""),
             d.get("Street", ""),
@@ -190,9 +326,42 @@ class Reader:
         reader = Reader(d["Name"], d["Surname"], str(d["Phone"]), address=address)
         reader._Reader__id = d["ID"]
         Reader._Reader__readerID = max(Reader._Reader__readerID, d["ID"])
+        reader.version = d.get("Version", 0)
+
+        if borrowed_books is None:
+            from book import load_books_object
+            all_books = load_books_object()
+            borrowed_books = [book for book in all_books if book.lent and book.lent_to == reader.id]
+        reader.borrowed_books = borrowed_books
 
-        from book import load_books_object
-        all_books = load_books_object()
-        reader.borrowed_books = [book for book in all_books if book.lent and book.lent_to == reader.id]
+        return reader
 
-        return reader
\ No newline at end of file
+    @staticmethod
+    def from_frame(df: pd.DataFrame, loans: dict[int, list[Book]] = None):
+        """Bulk counterpart of from_dict. loans maps reader ID to borrowed books (see load_loans_by_reader)."""
+        loans = loans or {}
+        readers = []
+        columns = zip(
+            df["ID"].tolist(), df["Name"].tolist(), df["Surname"].tolist(), df["Phone"].tolist(),
+            df["City"].tolist(), df["Street"].tolist(), df["Apartment"].tolist(), df["Postal Code"].tolist(),
+            df["Version"].tolist()
+        )
+        for reader_id, name, surname, phone, city, street, apartment, postal_code, version in columns:
+            reader = Reader.__new__(Reader)
+            reader.name = name
+            reader.surname = surname
+            reader.phone_num = str(phone)
+            reader.address = Address(city, street, apartment, postal_code)
+            reader.__id = reader_id
+            reader.borrowed_books = loans.get(reader_id, [])
+            reader.version = version
+            readers.append(reader)
+
+        if readers:
+            Reader.__readerID = max(Reader.__readerID, int(df["ID"].max()))
+        metrics.count("readers materialized", len(readers))
+        return readers
+
+
+metrics.instrument_methods(Reader, ("borrow", "return_book", "extend", "reserve", "load_history", "apply", "to_dict",
+                                    "from_dict", "from_frame"))
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+import cache
+import config
+from config import storage_engine
+
+#Part responsible for the persistent loan history
+# Every borrow / return / extension / reservation is appended to loans.events as one fixed-size record,
+# the file is never rewritten. Lookups by reader and by book go through sorted positions (binary search).
+
+loans_events_path = os.path.join(config.data_dir, "loans.events")
+loan_events_key = ("loan events",)
+event_kinds = ("borrowed", "returned", "extended", "reserved")
+event_dtype = np.dtype([("at", "<f8"), ("book", "<i8"), ("reader", "<i8"), ("kind", "u1")])
+
+class LoanEvent(NamedTuple):
+    kind: str
+    book_id: int
+    reader_id: int
+    at: datetime
+
+
+class EventIndex:
+    """Events sorted by reader and by book. New events wait in a short tail until the next rebuild."""
+    rebuild_after = 1024
+
+    def __init__(self, events: np.ndarray):
+        self.events = events
+        self.tail = []
+        self.by_reader = np.argsort(events["reader"], kind="stable")
+        self.reader_keys = events["reader"][self.by_reader]
+        self.by_book = np.argsort(events["book"], kind="stable")
+        self.book_keys = events["book"][self.by_book]
+
+    def add(self, record):
+        """Returns the index to keep using, a rebuilt one once the tail got long."""
+        self.tail.append(record)
+        if len(self.tail) < self.rebuild_after:
+            return self
+        return EventIndex(np.concatenate([self.events, np.array(self.tail, dtype=event_dtype)]))
+
+    def find(self, column: str, value: int) -> list[LoanEvent]:
+        """Events of one reader ("reader") or book ("book"), oldest first."""
+        order, keys = (self.by_reader, self.reader_keys) if column == "reader" else (self.by_book, self.book_keys)
+        start = np.searchsorted(keys, value, side="left")
+        end = np.searchsorted(keys, value, side="right")
+        rows = self.events[order[start:end]].tolist()
+        rows += [record.item() for record in self.tail if record[column] == value]
+        return [LoanEvent(event_kinds[kind], book_id, reader_id, datetime.fromtimestamp(at))
+                for at, book_id, reader_id, kind in rows]
+
+    def __len__(self):
+        return len(self.events) + len(self.tail)
+
+
+def read_events() -> np.ndarray:
+    if not os.path.exists(loans_events_path):
+        return np.empty(0, dtype=event_dtype)
+    # A torn last record from a crash mid-append is ignored
+    count = os.path.getsize(loans_events_path) // event_dtype.itemsize
+    return np.fromfile(loans_events_path, dtype=event_dtype, count=count)
+
+def load_event_index() -> EventIndex:
+    return cache.cached(loan_events_key, [loans_events_path], lambda: EventIndex(read_events()))
+
+def record_loan_event(kind: str, book_id: int, reader_id: int, at: datetime = None):
+    index = cache.peek(loan_events_key) if cache.is_fresh(loan_events_key) else None
+    record = np.array([((at or datetime.now()).timestamp(), int(book_id), int(reader_id), event_kinds.index(kind))],
+                      dtype=event_dtype)[0]
+
+    os.makedirs(config.data_dir, exist_ok=True)
+    if os.path.exists(loans_events_path):
+        size = os.path.getsize(loans_events_path)
+        if size % event_dtype.itemsize:
+            os.truncate(loans_events_path, size - size % event_dtype.itemsize)
+    with open(loans_events_path, "ab") as file:
+        file.write(record.tobytes())
+
+    if index is not None:
+        cache.store(loan_events_key, [loans_events_path], index.add(record))
+
+def reader_loan_events(reader_id: int) -> list[LoanEvent]:
+    return load_event_index().find("reader", int(reader_id))
+
+def book_loan_events(book_id: int) -> list[LoanEvent]:
+    return load_event_index().find("book", int(book_id))
+
+if storage_engine == "sqlite":
+    from sqlite_storage import record_loan_event, reader_loan_events, book_loan_events
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+from exceptions import WriteConflict
+
+#Part responsible for coordinating writers across processes
+# Desks sharing one data folder take an advisory lock file (data/<name>.lock) around every
+# read-modify-write, so two of them never allocate the same ID or overwrite each other's change.
+# The lock is re-entrant within a process: compaction inside a commit does not deadlock.
+if os.name == "nt":
+    import msvcrt
+
+    def try_lock_file(file) -> bool:
+        try:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def unlock_file(file):
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def try_lock_file(file) -> bool:
+        # lockf (POSIX record locks) also works on NFS shares, unlike flock
+        try:
+            fcntl.lockf(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def unlock_file(file):
+        fcntl.lockf(file.fileno(), fcntl.LOCK_UN)
+
+
+class DataLock:
+    """Advisory lock file plus an in-process re-entrant lock, with wait/hold timings."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.path = os.path.join(config.data_dir, f"{name}.lock")
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+        self.locked_at = 0.0
+
+        self.acquired = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+
+    def acquire(self, timeout: float):
+        started = time.perf_counter()
+        if not self.thread_lock.acquire(timeout=timeout):
+            raise WriteConflict(f"The {self.name} data is busy, please try again.")
+        if self.depth == 0:
+            try:
+                self.lock_file(started + timeout)
+            except BaseException:
+                self.thread_lock.release()
+                raise
+            self.locked_at = time.perf_counter()
+            self.acquired += 1
+            self.wait_seconds += self.locked_at - started
+        self.depth += 1
+
+    def lock_file(self, deadline: float):
+        if self.file is None:
+            os.makedirs(config.data_dir, exist_ok=True)
+            self.file = open(self.path, "a+b")
+        delay = 0.002
+        if try_lock_file(self.file):
+            return
+        self.contended += 1
+        while not try_lock_file(self.file):
+            if time.perf_counter() >= deadline:
+                raise WriteConflict(f"The {self.name} data is locked by another desk, please try again.")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+            held = time.perf_counter() - self.locked_at
+            self.held_seconds += held
+            self.max_held_seconds = max(self.max_held_seconds, held)
+        self.thread_lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_ms": round(self.wait_seconds * 1000, 3),
+            "held_ms": round(self.held_seconds * 1000, 3),
+            "max_held_ms": round(self.max_held_seconds * 1000, 3),
+        }
+
+
+_locks: dict[str, DataLock] = {}
+_locks_guard = threading.Lock()
+
+def get_lock(name: str) -> DataLock:
+    with _locks_guard:
+        if name not in _locks:
+            _locks[name] = DataLock(name)
+        return _locks[name]
+
+@contextmanager
+def data_lock(name: str, timeout: float = None):
+    """with data_lock("books"): ... holds data/books.lock, raises WriteConflict after timeout seconds of waiting."""
+    lock = get_lock(name)
+    lock.acquire(config.lock_timeout if timeout is None else timeout)
+    try:
+        yield
+    finally:
+        lock.release()
+
+def stats() -> dict:
+    """Per lock: acquisitions, how many had to wait for another desk, total wait / hold time and the longest hold."""
+    return {name: lock.stats() for name, lock in _locks.items()}
+
+def check_version(current: int, expected: int | None, what: str):
+    """Raises WriteConflict when the row changed since the caller read it (expected=None skips the check)."""
+    if expected is not None and int(current) != int(expected):
+        raise WriteConflict(f"{what} was changed at another desk, reload it and try again.")
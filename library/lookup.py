@@ -0,0 +1,85 @@
+from bisect import bisect_left, bisect_right, insort
+
+#Part responsible for keyed lookups
+class KeyedStore:
+    """Objects by primary key plus hash indexes on other attributes.
+
+    indexed maps an attribute name to the function normalizing its values (e.g. ISBN dashes).
+    The storage layer patches the store in place on writes instead of rebuilding it.
+    """
+
+    def __init__(self, records, key: str, indexed: dict = None):
+        self.key = key
+        self.records = {}
+        self.sorted_keys = []
+        self.indexes = {attribute: {} for attribute in (indexed or {})}
+        self.normalizers = dict(indexed or {})
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def values(self):
+        return self.records.values()
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def find(self, attribute: str, value) -> list:
+        keys = self.indexes[attribute].get(self.normalizers[attribute](value), ())
+        return [self.records[key] for key in keys]
+
+    def max_key(self):
+        return self.sorted_keys[-1] if self.sorted_keys else 0
+
+    def ordered(self, after=None):
+        """Records in key order, starting after the given key (keyset pagination)."""
+        keys = self.sorted_keys
+        start = 0 if after is None else bisect_right(keys, after)
+        for position in range(start, len(keys)):
+            yield self.records[keys[position]]
+
+    def add(self, record):
+        key = getattr(record, self.key)
+        if key in self.records:
+            self.remove(key)
+        self.records[key] = record
+        if not self.sorted_keys or key > self.sorted_keys[-1]:
+            self.sorted_keys.append(key)
+        else:
+            insort(self.sorted_keys, key)
+        self._index(key, record)
+
+    def remove(self, key):
+        record = self.records.pop(key, None)
+        if record is not None:
+            del self.sorted_keys[bisect_left(self.sorted_keys, key)]
+            self._unindex(key, record)
+        return record
+
+    def update(self, key, apply):
+        """Calls apply(record) and re-indexes the record afterwards."""
+        record = self.records.get(key)
+        if record is None:
+            return None
+        self._unindex(key, record)
+        apply(record)
+        self._index(key, record)
+        return record
+
+    def _index(self, key, record):
+        for attribute, index in self.indexes.items():
+            index.setdefault(self.normalizers[attribute](getattr(record, attribute)), []).append(key)
+
+    def _unindex(self, key, record):
+        for attribute, index in self.indexes.items():
+            value = self.normalizers[attribute](getattr(record, attribute))
+            keys = index.get(value)
+            if keys and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del index[value]
@@ -1,4 +1,13 @@
-from app import GuiApp
+import importlib
+
+import startup
+
+startup.begin()
+# Kivy on its own first, so its start-up cost shows apart from ours
+with startup.phase("import kivy"):
+    importlib.import_module("kivy.app")
+with startup.phase("import app"):
+    from app import GuiApp
 
 gui = GuiApp()
 gui.run()
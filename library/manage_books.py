@@ -3,14 +3,18 @@ from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.scrollview import ScrollView
-from kivy.uix.spinner import Spinner
 from kivy.uix.textinput import TextInput
 
+from background import io_queue
 from gui import Home
 from exceptions import *
-from book import add_book, load_books_object, edit_book, remove_book
-from library_db import Book
-from reader import load_readers_object
+import desk
+from manage_readers import reader_matches
+from widgets import RecordList, RecordPicker
+
+def book_matches(status=None):
+    """Search function for a RecordPicker over the books with the given status (see desk.book_statuses)."""
+    return lambda query, limit: desk.book_choices(query, limit, status)
 
 class ManageBooks(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -115,13 +119,18 @@ class AddBook(BoxLayout):
             self.message_label.text = "Page count must be numbers."
             return
 
-        try:
-            book = Book(title, author, isbn, publisher, pages)
-            add_book(book)
-            self.message_label.text = f"Book '{title}' added successfully!"
-            self.clear_inputs()
-        except AddingException as e:
-            self.message_label.text = f"Error: {e}"
+        values = {"Title": title, "Author": author, "ISBN": isbn, "Publisher": publisher, "Pages": pages}
+
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.add_book(values), lambda result: self.book_added(title), self.show_error,
+                        key=("add book", title, isbn))
+
+    def book_added(self, title):
+        self.message_label.text = f"Book '{title}' added successfully!"
+        self.clear_inputs()
+
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
     def clear_inputs(self):
         self.title_input.text = ""
@@ -144,20 +153,14 @@ class BookList(BoxLayout):
         free_books_layout = BoxLayout(orientation="vertical")
         free_books_layout.add_widget(Label(text="Available Books", size_hint_y=0.1))
 
-        self.free_scroll = ScrollView()
-        self.free_list = GridLayout(cols=1, spacing=10, size_hint_y=None)
-        self.free_list.bind(minimum_height=self.free_list.setter('height'))
-        self.free_scroll.add_widget(self.free_list)
-        free_books_layout.add_widget(self.free_scroll)
+        self.free_list = RecordList()
+        free_books_layout.add_widget(self.free_list)
 
         lent_books_layout = BoxLayout(orientation="vertical")
         lent_books_layout.add_widget(Label(text="Borrowed Books", size_hint_y=0.1))
 
-        self.lent_scroll = ScrollView()
-        self.lent_list = GridLayout(cols=1, spacing=10, size_hint_y=None)
-        self.lent_list.bind(minimum_height=self.lent_list.setter('height'))
-        self.lent_scroll.add_widget(self.lent_list)
-        lent_books_layout.add_widget(self.lent_scroll)
+        self.lent_list = RecordList()
+        lent_books_layout.add_widget(self.lent_list)
 
         columns_layout.add_widget(free_books_layout)
         columns_layout.add_widget(lent_books_layout)
@@ -171,21 +174,27 @@ class BookList(BoxLayout):
         self.refresh_list()
 
     def refresh_list(self):
-        self.free_list.clear_widgets()
-        self.lent_list.clear_widgets()
-
-        books = load_books_object()
-
-        for book in books:
-            book_label = Label(text=f"{book.id}: {book.title} by {book.author}",
-                               size_hint_y=None, height=40)
-
-            if book.lent:
-                book_label.color = (1, 0, 0, 1)
-                self.lent_list.add_widget(book_label)
+        self.free_list.show([{"text": "Loading...", "color": (1, 1, 1, 1)}])
+        self.lent_list.clear()
+        io_queue.submit(self.load_rows, self.show_rows, key=("book list",))
+
+    @staticmethod
+    def load_rows():
+        free_rows = []
+        lent_rows = []
+
+        for book in desk.book_summaries():
+            book_id, title, author = book["ID"], book["Title"], book["Author"]
+            if book["Lent"]:
+                lent_rows.append({"text": f"{book_id}: {title} by {author}", "color": (1, 0, 0, 1)})
             else:
-                book_label.color = (0, 1, 0, 1)
-                self.free_list.add_widget(book_label)
+                free_rows.append({"text": f"{book_id}: {title} by {author}", "color": (0, 1, 0, 1)})
+        return free_rows, lent_rows
+
+    def show_rows(self, rows):
+        free_rows, lent_rows = rows
+        self.free_list.show(free_rows)
+        self.lent_list.show(lent_rows)
 
 class EditBook(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -195,9 +204,9 @@ class EditBook(BoxLayout):
 
         self.add_widget(Label(text="Edit Book:"))
 
-        self.book_spinner = Spinner(text="Select Book to edit")
-        self.update_books()
-        self.add_widget(self.book_spinner)
+        self.book_picker = RecordPicker(book_matches(), hint_text="Select Book to edit")
+        self.book_picker.bind(selected_id=self.show_book_details)
+        self.add_widget(self.book_picker)
 
         self.title_input = TextInput(hint_text="Title")
         self.author_input = TextInput(hint_text="Author")
@@ -229,53 +238,55 @@ class EditBook(BoxLayout):
         self.message_label = Label()
         self.add_widget(self.message_label)
 
-    def update_books(self):
-        self.books = load_books_object()
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books]
-        self.book_spinner.bind(text=self.show_book_details)
+        # Version of the book when its details were shown, saving fails if another desk changed it since
+        self.loaded_version = None
+
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
+        if isinstance(error, WriteConflict):
+            self.show_book_details(self.book_picker, self.book_picker.selected_id)
 
-    def show_book_details(self, spinner, text):
-        if text == "Select Book to edit":
+    def show_book_details(self, picker, book_id):
+        if book_id is None:
             return
 
-        book_id = int(text.split(":")[0])
-        book = next((b for b in self.books if b.id == book_id), None)
+        io_queue.submit(lambda: desk.get_book(book_id), self.fill_book_details, self.show_error)
 
+    def fill_book_details(self, book):
         if book:
-            self.title_input.text = book.title
-            self.author_input.text = book.author
-            self.isbn_input.text = str(book.isbn)
-            self.publisher_input.text = book.publisher
-            self.pages_input.text = str(book.page_count)
+            self.loaded_version = book["Version"]
+            self.title_input.text = book["Title"]
+            self.author_input.text = book["Author"]
+            self.isbn_input.text = str(book["ISBN"])
+            self.publisher_input.text = book["Publisher"]
+            self.pages_input.text = str(book["Pages"])
 
     def save_changes(self, instance):
-        book_text = self.book_spinner.text
-        if book_text == "Select Book to edit":
+        book_id = self.book_picker.selected_id
+        if book_id is None:
             self.message_label.text = "Please select a book to edit."
             return
 
-        book_id = int(book_text.split(":")[0])
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if not book_search:
-            self.message_label.text = "Book not found."
+        try:
+            values = {
+                "Title": self.title_input.text.strip(),
+                "Author": self.author_input.text.strip(),
+                "ISBN": int(self.isbn_input.text.strip()),
+                "Publisher": self.publisher_input.text.strip(),
+                "Pages": int(self.pages_input.text.strip())
+            }
+        except ValueError:
+            self.message_label.text = "Error: ISBN and page count must be numbers."
             return
 
-        try:
-            updated_book = Book(
-                self.title_input.text.strip(),
-                self.author_input.text.strip(),
-                int(self.isbn_input.text.strip()),
-                self.publisher_input.text.strip(),
-                int(self.pages_input.text.strip())
-            )
-            updated_book.id = book_id
-
-            edit_book(book_id, updated_book)
-            self.message_label.text = "Book updated successfully!"
-            self.update_books()
-        except BookEditException as e:
-            self.message_label.text = f"Error: {e}"
+        self.message_label.text = "Saving..."
+        expected_version = self.loaded_version
+        io_queue.submit(lambda: desk.edit_book(book_id, values, expected_version), self.book_saved, self.show_error,
+                        key=("edit book", book_id))
+
+    def book_saved(self, result):
+        self.message_label.text = "Book updated successfully!"
+        self.loaded_version = None if self.loaded_version is None else self.loaded_version + 1
 
 class LendBook(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -285,13 +296,11 @@ class LendBook(BoxLayout):
 
         self.add_widget(Label(text="Lend a Book"))
 
-        self.reader_spinner = Spinner(text="Select Reader")
-        self.book_spinner = Spinner(text="Select Book")
-
-        self.update_readers_and_books()
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader")
+        self.book_picker = RecordPicker(book_matches("available"), hint_text="Select Book")
 
-        self.add_widget(self.reader_spinner)
-        self.add_widget(self.book_spinner)
+        self.add_widget(self.reader_picker)
+        self.add_widget(self.book_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint=(1, 0.2))
 
@@ -312,34 +321,24 @@ class LendBook(BoxLayout):
     def go_back(self, instance):
         self.switch_layout_callback(Home)
 
-    def update_readers_and_books(self):
-        self.readers = load_readers_object()
-        self.books = [b for b in load_books_object() if not getattr(b, "lent", False)]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
-        self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books]
+    def show_result(self, message):
+        self.message_label.text = message
+        self.reader_picker.clear()
+        self.book_picker.clear()
 
     def lend_book(self, instance):
-        reader_text = self.reader_spinner.text
-        book_text = self.book_spinner.text
+        reader_id = self.reader_picker.selected_id
+        book_id = self.book_picker.selected_id
 
-        if reader_text == "Select Reader" or book_text == "Select Book":
+        if reader_id is None or book_id is None:
             self.message_label.text = "Please select both reader and book."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        book_id = int(book_text.split(":")[0])
-
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if reader_search and book_search:
-            try:
-                reader_search.borrow(book_search)
-                self.message_label.text = f"Book '{book_search.title}' lent to {reader_search.name}."
-                self.update_readers_and_books()
-            except (BookLentToSomeone, BookReserved) as e:
-                self.message_label.text = f"Error: {e}"
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.lend(book_id, reader_id), self.show_result, self.show_error, key=("lend", book_id))
 
 
 class ReturnBook(BoxLayout):
@@ -350,13 +349,11 @@ class ReturnBook(BoxLayout):
 
         self.add_widget(Label(text="Return a Book"))
 
-        self.reader_spinner = Spinner(text="Select Reader")
-        self.book_spinner = Spinner(text="Select Book to Return")
-
-        self.update_readers_and_books()
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader")
+        self.book_picker = RecordPicker(book_matches("lent"), hint_text="Select Book to Return")
 
-        self.add_widget(self.reader_spinner)
-        self.add_widget(self.book_spinner)
+        self.add_widget(self.reader_picker)
+        self.add_widget(self.book_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint=(1, 0.2))
 
@@ -377,43 +374,24 @@ class ReturnBook(BoxLayout):
     def go_back(self, instance):
         self.switch_layout_callback(Home)
 
-    def update_readers_and_books(self):
-        self.readers = load_readers_object()
-        self.books = [b for b in load_books_object() if getattr(b, "lent", False)]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
-        self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books if b.lent]
+    def show_result(self, message):
+        self.message_label.text = message
+        self.reader_picker.clear()
+        self.book_picker.clear()
 
     def return_book(self, instance):
-        reader_text = self.reader_spinner.text
-        book_text = self.book_spinner.text
+        reader_id = self.reader_picker.selected_id
+        book_id = self.book_picker.selected_id
 
-        if reader_text == "Select Reader" or book_text == "Select Book to Return":
+        if reader_id is None or book_id is None:
             self.message_label.text = "Please select both reader and book."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        book_id = int(book_text.split(":")[0])
-
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if reader_search and book_search:
-            if not book_search.lent or book_search.lent_to != reader_id:
-                self.message_label.text = f"Error: This book is not borrowed by {reader_search.name} {reader_search.surname}."
-                return
-
-            try:
-                fee = reader_search.return_book(book_search)
-                if fee > 0:
-                    self.message_label.text = f"Book '{book_search.title}' returned with a fee of ${fee:.2f}."
-                else:
-                    self.message_label.text = f"Book '{book_search.title}' returned successfully with no fee."
-                self.update_readers_and_books()
-            except Exception as e:
-                self.message_label.text = f"Error: {e}"
-        else:
-            self.message_label.text = "Reader or book not found."
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.return_book(book_id, reader_id), self.show_result, self.show_error, key=("return", book_id))
 
 class RemoveBook(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -423,10 +401,8 @@ class RemoveBook(BoxLayout):
 
         self.add_widget(Label(text="Remove a book:"))
 
-        self.book_spinner = Spinner(text="Select Book to remove")
-        self.update_books()
-
-        self.add_widget(self.book_spinner)
+        self.book_picker = RecordPicker(book_matches(), hint_text="Select Book to remove")
+        self.add_widget(self.book_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint_y=0.2)
 
@@ -447,29 +423,29 @@ class RemoveBook(BoxLayout):
     def go_back(self, instance):
         self.switch_layout_callback(Home)
 
-    def update_books(self):
-        self.books = load_books_object()
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
     def remove_book(self, instance):
-        book_text = self.book_spinner.text
+        book_id = self.book_picker.selected_id
 
-        if book_text == "Select Book to remove":
+        if book_id is None:
             self.message_label.text = "Please select a book to remove."
             return
 
-        book_id = int(book_text.split(":")[0])
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if book_search:
-            try:
-                remove_book(book_id)
-                self.message_label.text = f"Book '{book_search.title}' removed successfully!"
-                self.update_books()
-            except DeletionException as e:
-                self.message_label.text = f"Error: {e}"
-        else:
-            self.message_label.text = "Book not found."
+        def remove():
+            book = desk.get_book(book_id)
+            if book is None:
+                return "Book not found."
+            desk.remove_book(book_id)
+            return f"Book '{book['Title']}' removed successfully!"
+
+        self.message_label.text = "Saving..."
+        io_queue.submit(remove, self.book_removed, self.show_error, key=("remove book", book_id))
+
+    def book_removed(self, message):
+        self.message_label.text = message
+        self.book_picker.clear()
             
 class ReserveBook(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -479,13 +455,11 @@ class ReserveBook(BoxLayout):
 
         self.add_widget(Label(text="Reserve a Book"))
 
-        self.reader_spinner = Spinner(text="Select Reader")
-        self.book_spinner = Spinner(text="Select Book to Reserve")
-
-        self.update_readers_and_books()
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader")
+        self.book_picker = RecordPicker(book_matches("reservable"), hint_text="Select Book to Reserve")
 
-        self.add_widget(self.reader_spinner)
-        self.add_widget(self.book_spinner)
+        self.add_widget(self.reader_picker)
+        self.add_widget(self.book_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint=(1, 0.2))
 
@@ -506,36 +480,24 @@ class ReserveBook(BoxLayout):
     def go_back(self, instance):
         self.switch_layout_callback(Home)
 
-    def update_readers_and_books(self):
-        self.readers = load_readers_object()
-        self.books = [b for b in load_books_object() if getattr(b, "lent", False) and not getattr(b, "reserved", False)]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
-        self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books]
+    def show_result(self, message):
+        self.message_label.text = message
+        self.reader_picker.clear()
+        self.book_picker.clear()
 
     def reserve_book(self, instance):
-        reader_text = self.reader_spinner.text
-        book_text = self.book_spinner.text
+        reader_id = self.reader_picker.selected_id
+        book_id = self.book_picker.selected_id
 
-        if reader_text == "Select Reader" or book_text == "Select Book to Reserve":
+        if reader_id is None or book_id is None:
             self.message_label.text = "Please select both reader and book."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        book_id = int(book_text.split(":")[0])
-
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if reader_search and book_search:
-            try:
-                reader_search.reserve(book_search)
-                self.message_label.text = f"Book '{book_search.title}' reserved for {reader_search.name} until {book_search.reserved_until.strftime('%Y-%m-%d')}."
-                self.update_readers_and_books()
-            except Exception as e:
-                self.message_label.text = f"Error: {e}"
-        else:
-            self.message_label.text = "Reader or book not found."
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.reserve(book_id, reader_id), self.show_result, self.show_error, key=("reserve", book_id))
 
 class ExtendReturnDate(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -545,13 +507,11 @@ class ExtendReturnDate(BoxLayout):
 
         self.add_widget(Label(text="Extend Return Date"))
 
-        self.reader_spinner = Spinner(text="Select Reader")
-        self.book_spinner = Spinner(text="Select Book to Extend")
-
-        self.update_readers_and_books()
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader")
+        self.book_picker = RecordPicker(book_matches("lent"), hint_text="Select Book to Extend")
 
-        self.add_widget(self.reader_spinner)
-        self.add_widget(self.book_spinner)
+        self.add_widget(self.reader_picker)
+        self.add_widget(self.book_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint=(1, 0.2))
 
@@ -572,37 +532,21 @@ class ExtendReturnDate(BoxLayout):
     def go_back(self, instance):
         self.switch_layout_callback(Home)
 
-    def update_readers_and_books(self):
-        self.readers = load_readers_object()
-        self.books = [b for b in load_books_object() if getattr(b, "lent", False)]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
-        self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-        self.book_spinner.values = [f"{b.id}: {b.title}" for b in self.books if b.lent]
+    def show_result(self, message):
+        self.message_label.text = message
+        self.reader_picker.clear()
+        self.book_picker.clear()
 
     def extend_return_date(self, instance):
-        reader_text = self.reader_spinner.text
-        book_text = self.book_spinner.text
+        reader_id = self.reader_picker.selected_id
+        book_id = self.book_picker.selected_id
 
-        if reader_text == "Select Reader" or book_text == "Select Book to Extend":
+        if reader_id is None or book_id is None:
             self.message_label.text = "Please select both reader and book."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        book_id = int(book_text.split(":")[0])
-
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
-        book_search = next((b for b in self.books if b.id == book_id), None)
-
-        if reader_search and book_search:
-            if not book_search.lent or book_search.lent_to != reader_id:
-                self.message_label.text = f"Error: This book is not borrowed by {reader_search.name} {reader_search.surname}."
-                return
-
-            try:
-                result = reader_search.extend(book_search)
-                self.message_label.text = result
-                self.update_readers_and_books()
-            except Exception as e:
-                self.message_label.text = f"Error: {e}"
-        else:
-            self.message_label.text = "Reader or book not found."
\ No newline at end of file
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.extend(book_id, reader_id), self.show_result, self.show_error, key=("extend", book_id))
\ No newline at end of file
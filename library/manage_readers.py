@@ -3,16 +3,27 @@ from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.scrollview import ScrollView
-from kivy.uix.spinner import Spinner
 from kivy.uix.textinput import TextInput
 
+from background import io_queue
 from gui import Home
 from exceptions import *
-from address import Address
-from library_db import Reader
-from reader import load_readers_object, add_reader, edit_reader, remove_reader, search_reader
+import desk
+from search_index import tokenize
+from widgets import RecordList, RecordPicker, TwoColumnRow
 
 
+def reader_matches(query, limit):
+    """Search function for a RecordPicker over the readers."""
+    return desk.reader_choices(query, limit)
+
+def reader_label(reader: dict) -> str:
+    return f"{reader['ID']}: {reader['Name']} {reader['Surname']}"
+
+def search_text(text: str) -> str:
+    """The typed query as the index sees its words, to tell whether it changed or only grew."""
+    return " ".join(tokenize(text))
+
 class ManageReaders(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
         super(ManageReaders, self).__init__(**kwargs)
@@ -119,17 +130,22 @@ class AddReader(BoxLayout):
             self.message_label.text = "Please fill in all required fields."
             return
 
-        try:
-            address = Address(city, street, apartment, postal_code)
-            reader = Reader(name, surname, phone, address)
-            add_reader(reader)
+        values = {"Name": name, "Surname": surname, "Phone": phone, "City": city, "Street": street,
+                  "Apartment": apartment, "Postal Code": postal_code}
 
-            self.message_label.text = f"Reader '{name} {surname}' added successfully!"
-            self.clear_inputs()
-        except InvalidPhoneNumber as e:
-            self.message_label.text = f"Invalid phone number: {e}"
-        except AddingException as e:
-            self.message_label.text = f"Error: {e}"
+        self.message_label.text = "Saving..."
+        io_queue.submit(lambda: desk.add_reader(values), lambda result: self.reader_added(name, surname), self.show_error,
+                        key=("add reader", name, surname, phone))
+
+    def reader_added(self, name, surname):
+        self.message_label.text = f"Reader '{name} {surname}' added successfully!"
+        self.clear_inputs()
+
+    def show_error(self, error):
+        if isinstance(error, InvalidPhoneNumber):
+            self.message_label.text = f"Invalid phone number: {error}"
+        else:
+            self.message_label.text = f"Error: {error}"
 
     def clear_inputs(self):
         self.name.text = ""
@@ -148,9 +164,9 @@ class EditReader(BoxLayout):
 
         self.add_widget(Label(text="Edit Reader:"))
 
-        self.reader_spinner = Spinner(text="Select Reader to edit")
-        self.update_readers()
-        self.add_widget(self.reader_spinner)
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader to edit")
+        self.reader_picker.bind(selected_id=self.show_reader_details)
+        self.add_widget(self.reader_picker)
 
         self.name = TextInput(hint_text="Name")
         self.surname = TextInput(hint_text="Surname")
@@ -177,6 +193,9 @@ class EditReader(BoxLayout):
         self.message_label = Label()
         self.add_widget(self.message_label)
 
+        # Version of the reader when their details were shown, saving fails if another desk changed them since
+        self.loaded_version = None
+
     def text_input_layout(self):
         layout = BoxLayout(orientation='horizontal')
 
@@ -195,64 +214,55 @@ class EditReader(BoxLayout):
         layout.add_widget(col2)
         return layout
 
-    def update_readers(self):
-        self.readers = load_readers_object()
-        self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-        self.reader_spinner.bind(text=self.show_reader_details)
+    def show_error(self, error):
+        if isinstance(error, InvalidPhoneNumber):
+            self.message_label.text = f"Invalid phone number: {error}"
+        else:
+            self.message_label.text = f"Error: {error}"
+        if isinstance(error, WriteConflict):
+            self.show_reader_details(self.reader_picker, self.reader_picker.selected_id)
 
-    def show_reader_details(self, spinner, text):
-        if text == "Select Reader to edit":
+    def show_reader_details(self, picker, reader_id):
+        if reader_id is None:
             return
 
-        reader_id = int(text.split(":")[0])
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
+        io_queue.submit(lambda: desk.get_reader(reader_id), self.fill_reader_details, self.show_error)
 
-        if reader_search:
-            self.name.text = reader_search.name
-            self.surname.text = reader_search.surname
-            self.phone_num.text = reader_search.phone_num
-            if reader_search.address:
-                self.city.text = reader_search.address.city
-                self.street.text = reader_search.address.street
-                self.apartment.text = reader_search.address.apartment
-                self.postal_code.text = reader_search.address.postal_code
+    def fill_reader_details(self, reader):
+        if reader:
+            self.loaded_version = reader["Version"]
+            self.name.text = reader["Name"]
+            self.surname.text = reader["Surname"]
+            self.phone_num.text = str(reader["Phone"])
+            self.city.text = reader["City"]
+            self.street.text = reader["Street"]
+            self.apartment.text = reader["Apartment"]
+            self.postal_code.text = reader["Postal Code"]
 
     def save_changes(self, instance):
-        reader_text = self.reader_spinner.text
-        if reader_text == "Select Reader to edit":
+        reader_id = self.reader_picker.selected_id
+        if reader_id is None:
             self.message_label.text = "Please select a reader to edit."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        reader = next((r for r in self.readers if r.id == reader_id), None)
-
-        if not reader:
-            self.message_label.text = "Reader not found."
-            return
-
-        try:
-            address = Address(
-                self.city.text.strip(),
-                self.street.text.strip(),
-                self.apartment.text.strip(),
-                self.postal_code.text.strip()
-            )
-
-            updated_reader = Reader(
-                self.name.text.strip(),
-                self.surname.text.strip(),
-                self.phone_num.text.strip(),
-                address
-            )
-            updated_reader._Reader__id = reader_id
-
-            edit_reader(reader_id, updated_reader)
-            self.message_label.text = "Reader updated successfully!"
-            self.update_readers()
-        except InvalidPhoneNumber as e:
-            self.message_label.text = f"Invalid phone number: {e}"
-        except Exception as e:
-            self.message_label.text = f"Error: {e}"
+        values = {
+            "Name": self.name.text.strip(),
+            "Surname": self.surname.text.strip(),
+            "Phone": self.phone_num.text.strip(),
+            "City": self.city.text.strip(),
+            "Street": self.street.text.strip(),
+            "Apartment": self.apartment.text.strip(),
+            "Postal Code": self.postal_code.text.strip()
+        }
+
+        self.message_label.text = "Saving..."
+        expected_version = self.loaded_version
+        io_queue.submit(lambda: desk.edit_reader(reader_id, values, expected_version), self.reader_saved, self.show_error,
+                        key=("edit reader", reader_id))
+
+    def reader_saved(self, result):
+        self.message_label.text = "Reader updated successfully!"
+        self.loaded_version = None if self.loaded_version is None else self.loaded_version + 1
 
 class ReaderList(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -262,26 +272,21 @@ class ReaderList(BoxLayout):
 
         self.add_widget(Label(text="Reader List", size_hint_y=0.1))
 
-        scroll_view = ScrollView()
-        self.list_layout = GridLayout(cols=1, spacing=10, size_hint_y=None)
-        self.list_layout.bind(minimum_height=self.list_layout.setter('height'))
-
+        self.list_layout = RecordList()
         self.refresh_list()
-
-        scroll_view.add_widget(self.list_layout)
-        self.add_widget(scroll_view)
+        self.add_widget(self.list_layout)
 
         btn_back = Button(text="Back", size_hint_y=0.1)
         btn_back.bind(on_press=lambda x: switch_layout_callback(ManageReaders))
         self.add_widget(btn_back)
 
     def refresh_list(self):
-        self.list_layout.clear_widgets()
-        readers = load_readers_object()
-        for reader in readers:
-            reader_label = Label(text=f"{reader.id}: {reader.name} {reader.surname}",
-                                 size_hint_y=None, height=40)
-            self.list_layout.add_widget(reader_label)
+        self.list_layout.show([{"text": "Loading..."}])
+        io_queue.submit(self.load_rows, self.list_layout.show, key=("reader list",))
+
+    @staticmethod
+    def load_rows():
+        return [{"text": reader_label(reader)} for reader in desk.reader_summaries()]
 
 class RemoveReader(BoxLayout):
     def __init__(self, switch_layout_callback, **kwargs):
@@ -291,10 +296,8 @@ class RemoveReader(BoxLayout):
 
         self.add_widget(Label(text="Remove Reader:"))
 
-        self.reader_spinner = Spinner(text="Select Reader to remove")
-        self.update_readers()
-
-        self.add_widget(self.reader_spinner)
+        self.reader_picker = RecordPicker(reader_matches, hint_text="Select Reader to remove")
+        self.add_widget(self.reader_picker)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint_y=0.2)
 
@@ -315,32 +318,34 @@ class RemoveReader(BoxLayout):
     def go_back(self, instance):
             self.switch_layout_callback(ManageReaders)
 
-    def update_readers(self):
-            self.readers = load_readers_object()
-            self.reader_spinner.values = [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
+    def show_error(self, error):
+        self.message_label.text = f"Error: {error}"
 
     def remove_reader(self, instance):
-        reader_text = self.reader_spinner.text
+        reader_id = self.reader_picker.selected_id
 
-        if reader_text == "Select Reader to remove":
+        if reader_id is None:
             self.message_label.text = "Please select a reader to remove."
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        reader_search = next((r for r in self.readers if r.id == reader_id), None)
+        def remove():
+            reader = desk.get_reader(reader_id)
+            if reader is None:
+                return "Reader not found."
+            desk.remove_reader(reader_id)
+            return f"Reader '{reader['Name']} {reader['Surname']}' removed successfully!"
 
-        if reader_search:
-            try:
-                remove_reader(reader_id)
-                self.message_label.text = f"Reader '{reader_search.name} {reader_search.surname}' removed successfully!"
-                self.update_readers()
-            except DeletionException as e:
-                self.message_label.text = f"Error: {e}"
-        else:
-            self.message_label.text = "Reader not found."
+        self.message_label.text = "Saving..."
+        io_queue.submit(remove, self.reader_removed, self.show_error, key=("remove reader", reader_id))
+
+    def reader_removed(self, message):
+        self.message_label.text = message
+        self.reader_picker.clear()
 
 
 class HistoryReader(BoxLayout):
+    search_limit = 50
+
     def __init__(self, switch_layout_callback, **kwargs):
         super(HistoryReader, self).__init__(**kwargs)
         self.orientation = "vertical"
@@ -348,23 +353,15 @@ class HistoryReader(BoxLayout):
 
         self.add_widget(Label(text="Reader History", size_hint_y=0.1))
 
-        search_layout = BoxLayout(orientation='horizontal', size_hint_y=0.1)
-        self.search_input = TextInput(hint_text="Search reader...")
-        search_btn = Button(text="Search", size_hint_x=0.3)
-        search_btn.bind(on_press=self.search_reader)
-        search_layout.add_widget(self.search_input)
-        search_layout.add_widget(search_btn)
-        self.add_widget(search_layout)
-
-        self.reader_spinner = Spinner(text="Select Reader", size_hint_y=None, height=50)
-        self.update_readers()
-        self.add_widget(self.reader_spinner)
+        # Only the best search_limit matches are rendered, never the whole reader list
+        self.last_query = None
+        self.last_results = None
+        self.reader_picker = RecordPicker(self.reader_matches, hint_text="Search reader...", limit=self.search_limit,
+                                          size_hint_y=0.3)
+        self.add_widget(self.reader_picker)
 
-        scroll_view = ScrollView()
-        self.history_layout = GridLayout(cols=1, spacing=10, size_hint_y=None)
-        self.history_layout.bind(minimum_height=self.history_layout.setter('height'))
-        scroll_view.add_widget(self.history_layout)
-        self.add_widget(scroll_view)
+        self.history_layout = RecordList(viewclass=TwoColumnRow, row_height=30)
+        self.add_widget(self.history_layout)
 
         buttons_layout = BoxLayout(orientation='horizontal', size_hint_y=0.1)
         btn_back = Button(text="Back")
@@ -380,88 +377,81 @@ class HistoryReader(BoxLayout):
         buttons_layout.add_widget(btn_clear)
         self.add_widget(buttons_layout)
 
-    def update_readers(self):
-        self.readers = load_readers_object()
-        self.reader_spinner.values = ["Select Reader"] + [f"{r.id}: {r.name} {r.surname}" for r in self.readers]
-
-    def search_reader(self, instance):
-        query = self.search_input.text.strip()
+    def reader_matches(self, query, limit):
+        """Search function for the picker, runs on the I/O queue."""
+        query = search_text(query)
         if not query:
-            self.update_readers()
-            return
+            self.last_query = None
+            self.last_results = None
+            return desk.reader_choices("", limit)
 
-        search_results = search_reader(query)
-        self.reader_spinner.values = ["Select Reader"] + [
-            f"{row['ID']}: {row['Name']} {row['Surname']}"
-            for _, row in search_results.iterrows()
-        ]
+        # A longer query can only match a subset of a complete earlier result
+        within = None
+        if (self.last_query and query.startswith(self.last_query)
+                and self.last_results is not None and len(self.last_results) < limit):
+            within = self.last_results
+
+        readers = desk.search_readers(query, limit, within)
+        self.last_query = query
+        self.last_results = [reader["ID"] for reader in readers]
+        return [(reader["ID"], reader_label(reader)) for reader in readers]
 
     def show_history(self, instance):
-        self.history_layout.clear_widgets()
+        self.history_layout.clear()
 
-        reader_text = self.reader_spinner.text
-        if reader_text == "Select Reader":
+        reader_id = self.reader_picker.selected_id
+        if reader_id is None:
             return
 
-        reader_id = int(reader_text.split(":")[0])
-        reader = next((r for r in self.readers if r.id == reader_id), None)
+        io_queue.submit(lambda: self.history_rows(reader_id), self.history_layout.show, key=("history", reader_id))
 
-        if not reader:
-            return
+    def history_rows(self, reader_id):
+        history = desk.reader_history(reader_id)
+
+        if not history:
+            return []
+
+        reader = history["reader"]
+        rows = [{"main_text": f"[b]{reader['Name']} {reader['Surname']}[/b] (ID: {reader['ID']}, Phone: {reader['Phone']})",
+                 "sub_text": "", "color": (1, 1, 1, 1)}]
 
-        reader_header = Label(
-            text=f"[b]{reader.name} {reader.surname}[/b] (ID: {reader.id}, Phone: {reader.phone_num})",
-            markup=True,
-            size_hint_y=None,
-            height=60
-        )
-        self.history_layout.add_widget(reader_header)
-
-        self.add_section_header("Currently borrowed books:")
-        if reader.borrowed_books:
-            for book in reader.borrowed_books:
+        self.add_section_header(rows, "Currently borrowed books:")
+        if history["lent"]:
+            for book in history["lent"]:
                 self.add_history_item(
-                    f"- {book.title}",
-                    f"Due: {book.return_date.strftime('%Y-%m-%d')}"
+                    rows,
+                    f"- {book['Title']}",
+                    f"Due: {book['Return date'].strftime('%Y-%m-%d')}"
                 )
         else:
-            self.add_history_item("- None", "")
-
-        self.show_history_section(reader.past_borrowed, "Borrowing history:")
-        self.show_history_section(reader.past_returned, "Return history:")
-        self.show_history_section(reader.past_reserved, "Reservation history:")
-
-    def show_history_section(self, history_dict, section_title):
-        self.add_section_header(section_title)
-        if history_dict:
-            for book, dates in history_dict.items():
-                for date in dates:
-                    self.add_history_item(
-                        f"- {book.title}",
-                        f"Date: {date.strftime('%Y-%m-%d')}"
-                    )
+            self.add_history_item(rows, "- None", "")
+
+        self.show_history_section(rows, history["borrowed"], "Borrowing history:")
+        self.show_history_section(rows, history["returned"], "Return history:")
+        self.show_history_section(rows, history["extended"], "Extension history:")
+        self.show_history_section(rows, history["reserved"], "Reservation history:")
+        return rows
+
+    def show_history_section(self, rows, events, section_title):
+        self.add_section_header(rows, section_title)
+        if events:
+            for event in events:
+                self.add_history_item(
+                    rows,
+                    f"- {event['Title']}",
+                    f"Date: {event['At'].strftime('%Y-%m-%d')}"
+                )
         else:
-            self.add_history_item("- None", "")
-
-    def add_section_header(self, text):
-        header = Label(
-            text=f"[b]{text}[/b]",
-            markup=True,
-            size_hint_y=None,
-            height=40,
-            color=(0.2, 0.4, 0.8, 1)
-        )
-        self.history_layout.add_widget(header)
-
-    def add_history_item(self, main_text, sub_text):
-        item_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height=30)
-        main_label = Label(text=main_text, size_hint_x=0.7, halign='left')
-        sub_label = Label(text=sub_text, size_hint_x=0.3, halign='right')
-        item_layout.add_widget(main_label)
-        item_layout.add_widget(sub_label)
-        self.history_layout.add_widget(item_layout)
+            self.add_history_item(rows, "- None", "")
+
+    @staticmethod
+    def add_section_header(rows, text):
+        rows.append({"main_text": f"[b]{text}[/b]", "sub_text": "", "color": (0.2, 0.4, 0.8, 1)})
+
+    @staticmethod
+    def add_history_item(rows, main_text, sub_text):
+        rows.append({"main_text": main_text, "sub_text": sub_text, "color": (1, 1, 1, 1)})
 
     def clear_history(self, instance):
-        self.history_layout.clear_widgets()
-        self.reader_spinner.text = "Select Reader"
-        self.search_input.text = ""
\ No newline at end of file
+        self.history_layout.clear()
+        self.reader_picker.clear()
@@ -0,0 +1,245 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import types
+from bisect import bisect_left
+from contextlib import nullcontext
+from datetime import datetime
+
+import config
+
+#Part responsible for opt-in instrumentation
+# With LIBRARY_METRICS=1 the storage functions, the Reader methods and the screen constructors record their
+# latency in histograms, and every full read/write of a data file is counted with its bytes and rows and charged
+# to the outermost instrumented call that caused it. Disabled (the default) nothing is wrapped at all and the
+# counting functions return right away.
+# metrics.dump() writes everything as JSON (also done at exit), F12 in the app shows the same numbers.
+
+enabled = config.metrics_enabled
+
+# Upper bounds of the latency buckets in ms, the last bucket holds everything slower
+bucket_bounds_ms = (0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000, 3000, 10000)
+
+class Histogram:
+    """Call latencies in log-spaced buckets, percentiles are reported as the bound of their bucket."""
+    __slots__ = ("counts", "calls", "errors", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(bucket_bounds_ms) + 1)
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float, failed: bool = False):
+        self.counts[bisect_left(bucket_bounds_ms, ms)] += 1
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, share: float) -> float:
+        wanted = share * self.calls
+        seen = 0
+        for bound, count in zip(bucket_bounds_ms, self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound}" for bound in bucket_bounds_ms] + [f">{bucket_bounds_ms[-1]}"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 4) if self.calls else 0,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+_lock = threading.Lock()
+histograms: dict[str, Histogram] = {}
+counters: dict[str, int] = {}
+started = datetime.now()
+# Names of the instrumented calls running on each thread, outermost first
+_active = threading.local()
+
+def active_calls() -> list[str]:
+    calls = getattr(_active, "calls", None)
+    if calls is None:
+        calls = _active.calls = []
+    return calls
+
+def record(name: str, seconds: float, failed: bool = False):
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(seconds * 1000, failed)
+
+def count(name: str, amount: int = 1):
+    if not enabled:
+        return
+    with _lock:
+        counters[name] = counters.get(name, 0) + amount
+
+def charge(name: str, amount: int = 1):
+    """Counts under name and under "<name> by <outermost instrumented call>"."""
+    if not enabled:
+        return
+    calls = active_calls()
+    count(name, amount)
+    count(f"{name} by {calls[0] if calls else 'other code'}", amount)
+
+"""
+Wrapping =====
+"""
+
+def timed(name: str, function):
+    """function wrapped to record its latency under name."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        calls = active_calls()
+        calls.append(name)
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException:
+            record(name, time.perf_counter() - start, failed=True)
+            raise
+        finally:
+            calls.pop()
+        record(name, time.perf_counter() - start)
+        return result
+    return wrapper
+
+def instrument(namespace: dict, prefix: str):
+    """Wraps the public functions of a module, call as instrument(globals(), "book") after the sqlite rebinding."""
+    if not enabled:
+        return
+    for name, value in list(namespace.items()):
+        if name.startswith("_") or not isinstance(value, types.FunctionType) or hasattr(value, "__wrapped__"):
+            continue
+        # Functions imported from other modules are instrumented there
+        if value.__module__ in (namespace["__name__"], "sqlite_storage"):
+            namespace[name] = timed(f"{prefix}.{name}", value)
+
+def instrument_methods(cls, names: tuple[str, ...]):
+    if not enabled:
+        return
+    for name in names:
+        method = cls.__dict__[name]
+        if isinstance(method, staticmethod):
+            setattr(cls, name, staticmethod(timed(f"{cls.__name__}.{name}", method.__func__)))
+        else:
+            setattr(cls, name, timed(f"{cls.__name__}.{name}", method))
+
+class Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        active_calls().append(self.name)
+        self.start = time.perf_counter()
+
+    def __exit__(self, error_type, error, traceback):
+        active_calls().pop()
+        record(self.name, time.perf_counter() - self.start, error_type is not None)
+
+_no_timer = nullcontext()
+
+def timer(name: str):
+    """with metrics.timer("screen.Home"): ... records the block like an instrumented call."""
+    return Timer(name) if enabled else _no_timer
+
+"""
+Data files =====
+"""
+
+def file_read(path: str, rows: int):
+    """One data file read whole into a frame."""
+    if not enabled:
+        return
+    name = os.path.basename(path)
+    charge(f"full reads {name}")
+    count(f"bytes read {name}", os.path.getsize(path))
+    count(f"rows read {name}", rows)
+
+def file_written(path: str, rows: int):
+    """One data file rewritten whole."""
+    if not enabled:
+        return
+    name = os.path.basename(path)
+    charge(f"full writes {name}")
+    count(f"bytes written {name}", os.path.getsize(path))
+    count(f"rows written {name}", rows)
+
+def table_read(table: str, rows: int):
+    """One SQLite table read whole into a frame."""
+    if not enabled:
+        return
+    charge(f"full reads {table} table")
+    count(f"rows read {table} table", rows)
+
+"""
+Reports =====
+"""
+
+def snapshot() -> dict:
+    import cache
+    import locks
+    with _lock:
+        calls = {name: histogram.to_dict() for name, histogram in histograms.items()}
+        counted = dict(sorted(counters.items()))
+    return {
+        "enabled": enabled,
+        "pid": os.getpid(),
+        "started": started.isoformat(timespec="seconds"),
+        "taken": datetime.now().isoformat(timespec="seconds"),
+        "calls": dict(sorted(calls.items(), key=lambda item: -item[1]["total_ms"])),
+        "counters": counted,
+        "cache": cache.stats(),
+        "locks": locks.stats(),
+    }
+
+def report(limit: int = 15) -> str:
+    """A few lines for the debug overlay: the slowest calls by total time, then the file counters."""
+    if not enabled:
+        return "Metrics are off, start the app with LIBRARY_METRICS=1 to collect them."
+    data = snapshot()
+    lines = [f"{'call':<40}{'calls':>8}{'total ms':>11}{'p50':>8}{'p99':>8}{'max ms':>10}"]
+    for name, call in list(data["calls"].items())[:limit]:
+        lines.append(f"{name[:39]:<40}{call['calls']:>8}{call['total_ms']:>11.1f}"
+                     f"{call['p50_ms']:>8}{call['p99_ms']:>8}{call['max_ms']:>10.1f}")
+    lines.append("")
+    lines += [f"{name}: {value}" for name, value in data["counters"].items() if " by " not in name]
+    lines.append(f"cache: {data['cache']}")
+    return "\n".join(lines)
+
+def dump(path: str = None) -> str:
+    """Writes snapshot() as JSON to path (LIBRARY_METRICS_FILE, or data/metrics.<pid>.json) and returns the path."""
+    path = path or config.metrics_file or os.path.join(config.data_dir, f"metrics.{os.getpid()}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(snapshot(), file, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def reset():
+    with _lock:
+        histograms.clear()
+        counters.clear()
+
+if enabled:
+    atexit.register(dump)
@@ -0,0 +1,43 @@
+from itertools import islice
+
+from search_index import normalize_text
+
+#Part responsible for paginated catalog queries
+# Pages are lists of row dicts keyed by the storage column names.
+
+def sort_value(value):
+    """Sort key that puts empty cells last and compares text without case or diacritics."""
+    if value is None or value != value:
+        return (1, "")
+    if isinstance(value, str):
+        return (0, normalize_text(value))
+    return (0, value)
+
+def query(fresh_store, load_store, stream, limit: int = 50, offset: int = 0, after_id: int = None,
+          sort_by: str = None, descending: bool = False, where=None, cast=None) -> list[dict]:
+    """One page of rows.
+
+    fresh_store is the loaded KeyedStore when it is warm (None otherwise), load_store() loads it and
+    stream(after_id=...) yields the rows after that ID, in ID order, straight from storage.
+    cast(row) gives the store's rows the storage types stream already yields (data_files.row_caster).
+    Unsorted pages only read as many rows as the page needs. sort_by has to see every row.
+    """
+    if after_id is not None and sort_by is not None:
+        raise ValueError("after_id pages in ID order and cannot be combined with sort_by, use offset")
+    cast = cast or (lambda row: row)
+
+    if sort_by is None:
+        if fresh_store is not None:
+            rows = (cast(record.to_dict()) for record in fresh_store.ordered(after_id))
+        else:
+            rows = stream(after_id=after_id)
+        if where is not None:
+            rows = filter(where, rows)
+        return list(islice(rows, offset, offset + limit))
+
+    rows = [cast(record.to_dict()) for record in load_store().values()]
+    if where is not None:
+        rows = [row for row in rows if where(row)]
+    rows.sort(key=lambda row: row["ID"])
+    rows.sort(key=lambda row: sort_value(row[sort_by]), reverse=descending)
+    return rows[offset:offset + limit]
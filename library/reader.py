@@ -1,12 +1,29 @@
 import os
+import threading
+from itertools import islice
+
 import pandas as pd
 
+import cache
+import data_files
+import journal
+import locks
+import lookup
+import metrics
+import paging
+import search_index
+from book import books_store_paths, load_books_object
+from config import storage_engine, journal_compact_threshold
 from exceptions import NoReader
 from library_db import Reader
 
 #Part responsible for readers
-readers_path = "./library/data/readers.xlsx"
-readers_columns = ["ID", "Name", "Surname", "Phone", "City", "Street", "Apartment", "Postal Code"]
+readers_path = data_files.data_path("readers")
+readers_journal_path = journal.journal_path_for(readers_path)
+readers_lookup_key = ("objects", "readers")
+readers_columns = ["ID", "Name", "Surname", "Phone", "City", "Street", "Apartment", "Postal Code", "Version"]
+reader_dtypes = {column: "str" for column in readers_columns} | {"ID": "int64", "Version": "int64"}
+cast_reader_row = data_files.row_caster(reader_dtypes)
 
 """
 Pandas readers =====
@@ -14,53 +31,247 @@ Pandas readers =====
 
 def prepare_readers_file():
     os.makedirs("./library/data", exist_ok=True)
-    if not os.path.exists(readers_path):
-        df = pd.DataFrame(columns=readers_columns)
-        df.to_excel(readers_path, index=False)
+    if os.path.exists(readers_path):
+        return
+    with locks.data_lock("readers"):
+        if not os.path.exists(readers_path):
+            df = pd.DataFrame(columns=readers_columns)
+            data_files.write_table(df, readers_path, reader_dtypes)
+            cache.invalidate(readers_path)
+
+def readers_store_paths():
+    return [readers_path, readers_journal_path]
 
 def load_readers():
     prepare_readers_file()
-    return pd.read_excel(readers_path)
+    snapshot = cache.cached(("frame", readers_path), [readers_path], lambda: data_files.read_table(readers_path))
+    return data_files.with_versions(journal.replay(snapshot.copy(), readers_journal_path))
+
+def load_readers_lookup():
+    """Reader objects by ID, shared between callers and patched in place by the write functions."""
+    return cache.cached(readers_lookup_key, readers_store_paths(),
+                        lambda: lookup.KeyedStore(Reader.from_frame(load_readers()), "id"))
+
+def get_reader(reader_id: int) -> Reader | None:
+    return load_readers_lookup().get(int(reader_id))
+
+def load_loans_by_reader():
+    """Groups lent books by the ID of the reader holding them, in one pass over the catalog."""
+    def build():
+        loans = {}
+        for book in load_books_object():
+            if book.lent and pd.notna(book.lent_to):
+                loans.setdefault(int(getattr(book.lent_to, "id", book.lent_to)), []).append(book)
+        return loans
+    return cache.cached(("loans",), books_store_paths(), build)
+
+def load_readers_object(with_loans: bool = True):
+    """With with_loans=False borrowed_books is not refreshed, enough for screens that only show names."""
+    readers = list(load_readers_lookup().values())
+    if with_loans:
+        loans = load_loans_by_reader()
+        for reader in readers:
+            reader.borrowed_books = list(loans.get(reader.id, ()))
+    return readers
 
-def load_readers_object():
-    df = load_readers()
-    return [Reader.from_dict(row) for _, row in df.iterrows()]
+def fresh_readers_lookup():
+    return cache.peek(readers_lookup_key) if cache.is_fresh(readers_lookup_key) else None
+
+def apply_reader_change(readers: lookup.KeyedStore, op: str, reader_id: int, values: dict = None):
+    if op == "add":
+        readers.add(Reader.from_dict(values, []))
+    elif op == "update":
+        readers.update(reader_id, lambda reader: reader.apply(values))
+    elif op == "remove":
+        readers.remove(reader_id)
+
+def commit_reader_changes(changes: list[tuple], write):
+    """Runs write() and applies changes [(op, ID, values)] to the loaded lookup and prefix index instead of dropping them."""
+    readers = fresh_readers_lookup()
+    index_in_sync = reader_index_in_sync()
+    write()
+    if readers is not None:
+        for op, reader_id, values in changes:
+            apply_reader_change(readers, op, reader_id, values)
+        cache.store(readers_lookup_key, readers_store_paths(), readers)
+    if index_in_sync:
+        for op, reader_id, values in changes:
+            update_reader_index(op, reader_id, values)
+        mark_reader_index_synced()
+
+def record_reader_change(op: str, reader_id: int, values: dict = None, expected_version: int = None):
+    """Journals one change under the readers lock, updates fail with WriteConflict if the row is not at expected_version."""
+    with locks.data_lock("readers"):
+        if op == "update":
+            reader = load_readers_lookup().get(reader_id)
+            if reader is None:
+                raise NoReader(f"No reader with ID {reader_id}.")
+            locks.check_version(reader.version, expected_version, f"Reader {reader_id}")
+            values = {**values, "Version": int(reader.version) + 1}
+        def write():
+            if journal.append(readers_journal_path, op, reader_id, values) >= journal_compact_threshold:
+                compact_readers()
+            cache.invalidate(readers_journal_path)
+        commit_reader_changes([(op, reader_id, values)], write)
+
+def compact_readers():
+    """Folds the journal back into readers.xlsx."""
+    with locks.data_lock("readers"):
+        if not journal.count_records(readers_journal_path):
+            return
+        def write():
+            df = load_readers()
+            data_files.write_table(df, readers_path, reader_dtypes)
+            journal.clear(readers_journal_path)
+            cache.invalidate(readers_path)
+        commit_reader_changes([], write)
 
 def add_reader(reader: Reader):
-    df = load_readers()
-    new_id = 1 if df.empty else int(df["ID"].max()) + 1
-    reader._Reader__id = new_id
-    Reader._Reader__readerID = new_id
-    df = pd.concat([df, pd.DataFrame([reader.to_dict()])], ignore_index=True)
-    df.to_excel(readers_path, index=False)
+    # The next ID is taken under the lock, so two desks never hand out the same one
+    with locks.data_lock("readers"):
+        new_id = int(load_readers_lookup().max_key()) + 1
+        reader._Reader__id = new_id
+        Reader._Reader__readerID = new_id
+        record_reader_change("add", new_id, reader.to_dict())
+
+def add_readers(readers: list[Reader]):
+    """Adds many readers with a single workbook write, their IDs form one contiguous block."""
+    if not readers:
+        return
+    prepare_readers_file()
+
+    with locks.data_lock("readers"):
+        first_id = int(load_readers_lookup().max_key()) + 1
+        for reader_id, reader in enumerate(readers, start=first_id):
+            reader._Reader__id = reader_id
+        Reader._Reader__readerID = max(Reader._Reader__readerID, readers[-1].id)
+        rows = [reader.to_dict() for reader in readers]
+
+        def write():
+            df = pd.concat([load_readers(), pd.DataFrame(rows, columns=readers_columns)], ignore_index=True)
+            data_files.write_table(df, readers_path, reader_dtypes)
+            journal.clear(readers_journal_path)
+            cache.invalidate(readers_path)
+        commit_reader_changes([("add", row["ID"], row) for row in rows], write)
 
 def remove_reader(reader_id: int):
-    df = load_readers()
-    df = df[df["ID"] != reader_id]
-    df.to_excel(readers_path, index=False)
-
-def edit_reader(reader_id: int, updated_reader: Reader):
-    df = load_readers()
-    if reader_id in df["ID"].values:
-        df.loc[df["ID"] == reader_id, ["Name", "Surname", "Phone", "City", "Street", "Apartment", "Postal Code"]] = [
-            updated_reader.name,
-            updated_reader.surname,
-            updated_reader.phone_num,
-            updated_reader.address.city if updated_reader.address else "",
-            updated_reader.address.street if updated_reader.address else "",
-            updated_reader.address.apartment if updated_reader.address else "",
-            updated_reader.address.postal_code if updated_reader.address else ""
-        ]
-        df.to_excel(readers_path, index=False)
+    record_reader_change("remove", reader_id)
+
+def edit_reader(reader_id: int, updated_reader: Reader, expected_version: int = None):
+    record_reader_change("update", reader_id, {
+        "Name": updated_reader.name,
+        "Surname": updated_reader.surname,
+        "Phone": updated_reader.phone_num,
+        "City": updated_reader.address.city if updated_reader.address else "",
+        "Street": updated_reader.address.street if updated_reader.address else "",
+        "Apartment": updated_reader.address.apartment if updated_reader.address else "",
+        "Postal Code": updated_reader.address.postal_code if updated_reader.address else ""
+    }, expected_version)
+
+def search_reader(query: str, limit: int = 50):
+    """Readers whose phone number, name, surname, "name surname" or "surname name" starts with the query.
+
+    Polish letters are folded, so "zolw" finds "Żółw".
+    """
+    readers = load_readers_lookup()
+    ids = get_reader_index().search(normalize_reader_query(query), limit)
+    return pd.DataFrame([reader.to_dict() for reader in map(readers.get, ids) if reader is not None], columns=readers_columns)
+
+def search_reader_ids(query: str, limit: int = 50, within: list[int] = None) -> list[int]:
+    """IDs of the readers search_reader would return.
+
+    within narrows the complete result of a shorter query instead of searching the whole index (search-as-you-type).
+    """
+    prefix = normalize_reader_query(query)
+    if within is not None:
+        return get_reader_index().narrow(within, prefix, limit)
+    return get_reader_index().search(prefix, limit)
+
+def find_readers(query: str, limit: int = 10) -> list[Reader]:
+    """Best matching readers for a picker. An empty query lists readers by ID."""
+    readers = load_readers_lookup()
+    if not normalize_reader_query(query):
+        return list(islice(readers.ordered(), limit))
+    return [reader for reader in map(readers.get, search_reader_ids(query, limit)) if reader is not None]
+
+"""
+Reader prefix index =====
+"""
+
+_reader_index: search_index.PrefixIndex | None = None
+_reader_index_signature = None
+_reader_index_lock = threading.RLock()
+
+def readers_signature():
+    return tuple(cache.file_signature(path) for path in readers_store_paths())
+
+def normalize_phone(phone) -> str:
+    if isinstance(phone, float) and phone.is_integer():
+        phone = int(phone)
+    return "".join(c for c in str(phone) if c.isdigit()) if phone == phone else ""
+
+def normalize_reader_query(query: str) -> str:
+    normalized = " ".join(search_index.tokenize(query))
+    return normalized.replace(" ", "") if normalized.replace(" ", "").isdigit() else normalized
+
+def reader_index_keys(record: dict) -> list[str]:
+    name = " ".join(search_index.tokenize(record.get("Name")))
+    surname = " ".join(search_index.tokenize(record.get("Surname")))
+    return [normalize_phone(record.get("Phone")), name, surname, f"{name} {surname}", f"{surname} {name}"]
+
+def get_reader_index():
+    global _reader_index, _reader_index_signature
+    signature = readers_signature()
+    if _reader_index is not None and _reader_index_signature == signature:
+        return _reader_index
+    with _reader_index_lock:
+        signature = readers_signature()
+        if _reader_index is None or _reader_index_signature != signature:
+            records = load_readers()[["ID", "Name", "Surname", "Phone"]].to_dict("records")
+            index = search_index.PrefixIndex.build((record["ID"], reader_index_keys(record)) for record in records)
+            _reader_index, _reader_index_signature = index, signature
+        return _reader_index
+
+def reader_index_in_sync():
+    return _reader_index is not None and _reader_index_signature == readers_signature()
+
+def mark_reader_index_synced():
+    global _reader_index_signature
+    _reader_index_signature = readers_signature()
+
+def update_reader_index(op: str, reader_id: int, values: dict = None):
+    if op == "remove":
+        _reader_index.remove(reader_id)
     else:
-        raise NoReader(f"No reader with ID {reader_id}.")
-
-def search_reader(query: str):
-    df = load_readers()
-    query = query.lower()
-    mask = (
-        df["Name"].str.lower().str.contains(query) |
-        df["Surname"].str.lower().str.contains(query) |
-        df["Phone"].astype(str).str.contains(query)
-    )
-    return df[mask]
+        _reader_index.update(reader_id, reader_index_keys(values))
+
+"""
+Paging =====
+"""
+
+def stream_readers(after_id: int = None):
+    """Raw reader rows in ID order from the data file with the journal applied, types as the file gives them."""
+    prepare_readers_file()
+    rows = journal.replay_rows(data_files.iter_table_rows(readers_path), readers_journal_path)
+    if after_id is not None:
+        rows = (row for row in rows if row["ID"] > after_id)
+    return rows
+
+def iter_readers(where=None, after_id: int = None):
+    """Streams reader rows (dicts, ID order) from the data file with the journal applied, without loading every reader.
+
+    Every engine and file format yields the same dicts: columns and types of reader_dtypes, as query_readers returns them.
+    """
+    rows = map(cast_reader_row, stream_readers(after_id))
+    return rows if where is None else filter(where, rows)
+
+def query_readers(limit: int = 50, offset: int = 0, after_id: int = None, sort_by: str = None,
+                  descending: bool = False, where=None) -> list[dict]:
+    """A page of reader rows, same arguments as query_books."""
+    return paging.query(fresh_readers_lookup(), load_readers_lookup, iter_readers, limit, offset, after_id,
+                        sort_by, descending, where, cast_reader_row)
+
+if storage_engine == "sqlite":
+    from sqlite_storage import readers_store_paths, load_readers, add_reader, add_readers, remove_reader, edit_reader, search_reader, stream_readers
+
+metrics.instrument(globals(), "reader")
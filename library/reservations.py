@@ -0,0 +1,172 @@
+import heapq
+import json
+import os
+from datetime import datetime, timedelta
+
+import cache
+import config
+import journal
+import locks
+from config import storage_engine
+
+#Part responsible for the reservation waitlists
+# The reader a book is held for is stored on the book ("Reserved by" / "Reserved until"),
+# everyone queued behind them waits here. Changes are appended to reservations.journal and replayed on load.
+
+reservations_path = os.path.join(config.data_dir, "reservations.journal")
+reservations_key = ("reservations",)
+
+class ReservationQueues:
+    """A heap of [priority, seq, reader ID, queued at] per book: lower priority first, then first come first served.
+
+    Cancelled entries are only marked and skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self.heaps: dict[int, list] = {}
+        self.entries: dict[tuple[int, int], list] = {}
+        self.last_seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: tuple[int, int]):
+        return key in self.entries
+
+    def enqueue(self, book_id: int, reader_id: int, priority: int = 0, seq: int = None, queued_at: datetime = None):
+        seq = seq if seq is not None else self.last_seq + 1
+        self.last_seq = max(self.last_seq, seq)
+        entry = [priority, seq, reader_id, queued_at, True]
+        self.entries[(book_id, reader_id)] = entry
+        heapq.heappush(self.heaps.setdefault(book_id, []), entry)
+        return entry
+
+    def peek(self, book_id: int):
+        """Reader ID of the next in line, None when nobody waits."""
+        heap = self.heaps.get(book_id)
+        while heap and not heap[0][4]:
+            heapq.heappop(heap)
+        if not heap:
+            self.heaps.pop(book_id, None)
+            return None
+        return heap[0][2]
+
+    def pop(self, book_id: int):
+        """Like peek, but also removes the reader from the queue."""
+        reader_id = self.peek(book_id)
+        if reader_id is not None:
+            heapq.heappop(self.heaps[book_id])
+            del self.entries[(book_id, reader_id)]
+        return reader_id
+
+    def remove(self, book_id: int, reader_id: int):
+        entry = self.entries.pop((book_id, reader_id), None)
+        if entry is not None:
+            entry[4] = False
+
+    def waiting(self, book_id: int) -> list[int]:
+        return [entry[2] for entry in sorted(self.heaps.get(book_id, ())) if entry[4]]
+
+    def apply(self, record: dict):
+        values = record["values"]
+        if record["op"] == "enqueue":
+            self.enqueue(record["id"], values["Reader"], values["Priority"], values["Seq"], values["At"])
+        elif record["op"] == "pop":
+            self.pop(record["id"])
+        elif record["op"] == "remove":
+            self.remove(record["id"], values["Reader"])
+
+
+def load_queues() -> ReservationQueues:
+    def load():
+        queues = ReservationQueues()
+        for record in journal.read_records(reservations_path):
+            queues.apply(record)
+        return queues
+    return cache.cached(reservations_key, [reservations_path], load)
+
+def record_queue_change(op: str, book_id: int, values: dict = None):
+    record_queue_changes([(op, book_id, values)])
+
+def record_queue_changes(changes: list[tuple]):
+    """Journals [(op, book ID, values)] with a single write and applies them to the loaded queues."""
+    queues = load_queues()
+    os.makedirs(config.data_dir, exist_ok=True)
+    records = journal.append_many(reservations_path, changes)
+    for op, book_id, values in changes:
+        queues.apply({"op": op, "id": book_id, "values": values or {}})
+    if records > 4 * len(queues) + 100:
+        compact_queues(queues)
+    cache.store(reservations_key, [reservations_path], queues)
+
+def compact_queues(queues: ReservationQueues):
+    """Rewrites the journal with only the readers still waiting."""
+    tmp_path = reservations_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        for (book_id, reader_id), (priority, seq, _, queued_at, _) in sorted(queues.entries.items(), key=lambda item: item[1][1]):
+            values = {"Reader": reader_id, "Priority": priority, "Seq": seq, "At": journal.encode_value(queued_at)}
+            file.write(json.dumps({"op": "enqueue", "id": book_id, "values": values}) + "\n")
+    os.replace(tmp_path, reservations_path)
+
+def enqueue_reservation(book_id: int, reader_id: int, priority: int = 0):
+    """Puts the reader at the end of the book's waitlist (before everyone with a higher priority number)."""
+    with locks.data_lock("reservations"):
+        record_queue_change("enqueue", int(book_id), {
+            "Reader": int(reader_id), "Priority": int(priority), "Seq": load_queues().last_seq + 1, "At": datetime.now()
+        })
+
+def pop_reservation(book_id: int):
+    book_id = int(book_id)
+    with locks.data_lock("reservations"):
+        reader_id = load_queues().peek(book_id)
+        if reader_id is not None:
+            record_queue_change("pop", book_id)
+    return reader_id
+
+def remove_reservation(book_id: int, reader_id: int):
+    with locks.data_lock("reservations"):
+        if (int(book_id), int(reader_id)) in load_queues():
+            record_queue_change("remove", int(book_id), {"Reader": int(reader_id)})
+
+def remove_reservations(entries: list[tuple[int, int]]):
+    """Takes several (book ID, reader ID) off their waitlists with one journal write."""
+    if not entries:
+        return
+    with locks.data_lock("reservations"):
+        queues = load_queues()
+        changes = [("remove", int(book_id), {"Reader": int(reader_id)}) for book_id, reader_id in entries
+                   if (int(book_id), int(reader_id)) in queues]
+        if changes:
+            record_queue_changes(changes)
+
+def waiting_readers(book_id: int) -> list[int]:
+    return load_queues().waiting(int(book_id))
+
+def hold_values(reader_id: int | None, available_from: datetime) -> dict:
+    """Column values holding a book for reader_id until available_from plus the hold period (None clears the hold)."""
+    if reader_id is None:
+        return {"Reserved": False, "Reserved by": None, "Reserved until": None}
+    return {"Reserved": True, "Reserved by": reader_id,
+            "Reserved until": available_from + timedelta(days=config.reservation_hold_days)}
+
+def next_holder(book, available_from: datetime) -> dict:
+    """Moves the book's hold to the next reader in its queue, until available_from plus the hold period.
+
+    Clears the reservation when nobody waits. Returns the new column values for update_book_reservations.
+    """
+    values = hold_values(pop_reservation(book.id), available_from)
+    book.reserved = values["Reserved"]
+    book.reserved_by = values["Reserved by"]
+    book.reserved_until = values["Reserved until"]
+    return values
+
+def hand_over(book, available_from: datetime):
+    from book import update_book_reservation
+    from expiry import watch
+    values = next_holder(book, available_from)
+    update_book_reservation(book.id, values["Reserved"], values["Reserved by"], values["Reserved until"])
+    watch(book)
+    return values["Reserved by"]
+
+if storage_engine == "sqlite":
+    from sqlite_storage import enqueue_reservation, pop_reservation, remove_reservation, remove_reservations, waiting_readers
@@ -0,0 +1,184 @@
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+#Part responsible for in-memory search indexes
+
+_token_pattern = re.compile(r"[0-9a-z]+")
+_folded_letters = str.maketrans({"ł": "l", "ß": "ss", "ø": "o", "đ": "d"})
+
+def normalize_text(text) -> str:
+    """Lowercases and strips diacritics, so "Żółć" and "zolc" match."""
+    if text is None or text != text:
+        return ""
+    text = str(text).lower().translate(_folded_letters)
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+def tokenize(text) -> list[str]:
+    return _token_pattern.findall(normalize_text(text))
+
+
+class TokenIndex:
+    """Inverted index from normalized tokens to document IDs, with prefix lookups over a sorted vocabulary.
+
+    fields maps a record key to its weight in the ranking.
+    """
+
+    def __init__(self, fields: dict[str, int]):
+        self.fields = fields
+        self.postings: dict[str, dict[int, int]] = {}
+        self.vocabulary: list[str] = []
+        self.documents: dict[int, set[str]] = {}
+
+    @classmethod
+    def build(cls, fields: dict[str, int], records):
+        """Bulk load from (ID, record) pairs, sorting the vocabulary once at the end."""
+        index = cls(fields)
+        for doc_id, record in records:
+            index.add(doc_id, record, keep_sorted=False)
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def add(self, doc_id: int, record: dict, keep_sorted: bool = True):
+        if doc_id in self.documents:
+            self.remove(doc_id)
+        tokens = set()
+        for field, weight in self.fields.items():
+            for token in tokenize(record.get(field)):
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = {}
+                    if keep_sorted:
+                        insort(self.vocabulary, token)
+                posting[doc_id] = max(posting.get(doc_id, 0), weight)
+                tokens.add(token)
+        self.documents[doc_id] = tokens
+
+    def remove(self, doc_id: int):
+        for token in self.documents.pop(doc_id, ()):
+            posting = self.postings[token]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def update(self, doc_id: int, record: dict):
+        self.add(doc_id, record)
+
+    def prefix_matches(self, prefix: str):
+        vocabulary = self.vocabulary
+        for position in range(bisect_left(vocabulary, prefix), len(vocabulary)):
+            token = vocabulary[position]
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, query: str, limit: int = None) -> list[int]:
+        """IDs of documents containing every query token as a word prefix, best matches first.
+
+        Exact word matches score double, ties are broken by ID.
+        """
+        scores = None
+        for query_token in set(tokenize(query)):
+            token_scores = {}
+            for token in self.prefix_matches(query_token):
+                bonus = 2 if token == query_token else 1
+                for doc_id, weight in self.postings[token].items():
+                    token_scores[doc_id] = max(token_scores.get(doc_id, 0), weight * bonus)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items() if doc_id in token_scores}
+            if not scores:
+                return []
+
+        if scores is None:
+            return []
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+        return ranked if limit is None else ranked[:limit]
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def save_index(index, path: str, signature):
+    """Stores the index together with the signature of the data it was built from."""
+    # Unique per process and thread, so two builds racing never write into the same file
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as file:
+        pickle.dump((signature, index), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_index(path: str, signature):
+    """Returns the stored index, or None when it is missing or was built from different data."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as file:
+            stored_signature, index = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    return index if stored_signature == signature else None
+
+
+class PrefixIndex:
+    """Sorted (key, ID) pairs. Finds IDs whose key starts with a prefix in O(log n + k)."""
+
+    def __init__(self):
+        self.entries: list[tuple[str, int]] = []
+        self.keys: dict[int, list[str]] = {}
+
+    @classmethod
+    def build(cls, items):
+        """Bulk load from (ID, keys) pairs with a single sort."""
+        index = cls()
+        for doc_id, keys in items:
+            keys = sorted(set(key for key in keys if key))
+            index.keys[doc_id] = keys
+            index.entries.extend((key, doc_id) for key in keys)
+        index.entries.sort()
+        return index
+
+    def add(self, doc_id: int, keys):
+        if doc_id in self.keys:
+            self.remove(doc_id)
+        keys = sorted(set(key for key in keys if key))
+        for key in keys:
+            insort(self.entries, (key, doc_id))
+        self.keys[doc_id] = keys
+
+    def remove(self, doc_id: int):
+        for key in self.keys.pop(doc_id, ()):
+            del self.entries[bisect_left(self.entries, (key, doc_id))]
+
+    def update(self, doc_id: int, keys):
+        self.add(doc_id, keys)
+
+    def search(self, prefix: str, limit: int = None) -> list[int]:
+        """IDs in key order, stops scanning as soon as limit distinct IDs were found."""
+        found = {}
+        entries = self.entries
+        for position in range(bisect_left(entries, (prefix,)), len(entries)):
+            key, doc_id = entries[position]
+            if not key.startswith(prefix):
+                break
+            found[doc_id] = None
+            if limit is not None and len(found) >= limit:
+                break
+        return list(found)
+
+    def narrow(self, ids, prefix: str, limit: int = None) -> list[int]:
+        """Keeps the IDs of an earlier search that still match a longer prefix, in their order."""
+        found = []
+        for doc_id in ids:
+            if any(key.startswith(prefix) for key in self.keys.get(doc_id, ())):
+                found.append(doc_id)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def __len__(self):
+        return len(self.keys)
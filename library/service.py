@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import config
+import desk
+import exceptions
+import metrics
+from client import encode, decode_object
+
+#Part responsible for the library service
+# One headless process owns the data in memory and the desks call it over local HTTP:
+# POST /<desk operation> with {"args": [...], "kwargs": {...}} answers {"result": ...}
+# or {"error": "<exception name>", "message": "..."}. GET / lists the operations, GET /metrics returns metrics.snapshot().
+logger = logging.getLogger("library.service")
+
+not_found_errors = (exceptions.NoBookFound, exceptions.NoReader, exceptions.ReaderOrBookNotFound)
+# Refused requests (invalid input, book not available...), anything else is logged as a failure
+request_errors = (
+    exceptions.AddingException, exceptions.DeletionException, exceptions.InvalidPhoneNumber,
+    exceptions.PageCountException, exceptions.BookLentToSomeone, exceptions.BookReserved,
+    exceptions.BookEditException, ValueError, TypeError, KeyError,
+)
+
+class ReadWriteLock:
+    """Any number of readers or a single writer. Waiting writers go first, so steady reads can't starve them."""
+
+    def __init__(self):
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.writing and not self.waiting_writers)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.readers -= 1
+                self.condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.condition:
+            self.waiting_writers += 1
+            await self.condition.wait_for(lambda: not self.writing and not self.readers)
+            self.waiting_writers -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+class LibraryService:
+    """Runs desk operations on worker threads: reads side by side, writes one at a time and never during a read."""
+
+    def __init__(self, workers: int = 4):
+        self.lock = ReadWriteLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="library-service")
+        # Open client connections (handler task -> writer), closed when the service stops
+        self.connections = {}
+
+    async def call(self, operation: str, args: list = (), kwargs: dict = None):
+        function = getattr(desk, operation)
+        work = lambda: function(*args, **(kwargs or {}))
+        loop = asyncio.get_running_loop()
+        access = self.lock.read() if operation in desk.read_operations else self.lock.write()
+        async with access:
+            return await loop.run_in_executor(self.executor, work)
+
+    async def respond(self, method: str, path: str, body: bytes) -> tuple[str, dict]:
+        operation = path.strip("/")
+        if method == "GET" and not operation:
+            return "200 OK", {"result": sorted(desk.operations)}
+        if method == "GET" and operation == "metrics":
+            return "200 OK", {"result": metrics.snapshot()}
+        if method != "POST" or operation not in desk.operations:
+            return "404 Not Found", {"error": "NotFound", "message": f"Unknown operation {method} {path}"}
+
+        try:
+            request = json.loads(body or b"{}", object_hook=decode_object)
+            result = await self.call(operation, request.get("args", []), request.get("kwargs", {}))
+        except exceptions.WriteConflict as e:
+            return "409 Conflict", {"error": type(e).__name__, "message": str(e)}
+        except not_found_errors as e:
+            return "404 Not Found", {"error": type(e).__name__, "message": str(e)}
+        except request_errors as e:
+            return "400 Bad Request", {"error": type(e).__name__, "message": str(e)}
+        except Exception as e:
+            logger.exception("%s failed", operation)
+            return "500 Internal Server Error", {"error": type(e).__name__, "message": str(e)}
+        return "200 OK", {"result": result}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One client connection, requests are answered in order until it closes (HTTP/1.1 keep-alive)."""
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while request_line := await reader.readline():
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, response = await self.respond(method, path, body)
+                payload = json.dumps(encode(response), ensure_ascii=False).encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def sweep_reservations(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                released = await self.call("sweep_expired")
+                if released:
+                    logger.info("released holds on books %s", released)
+            except Exception:
+                logger.exception("reservation sweep failed")
+
+    async def serve(self, host: str, port: int):
+        """Serves until SIGINT/SIGTERM, then waits for the requests in progress."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, desk.warm_up)
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stop.set)
+            except NotImplementedError:
+                # Windows: Ctrl+C interrupts asyncio.run instead
+                pass
+
+        server = await asyncio.start_server(self.handle, host, port)
+        sweeper = asyncio.create_task(self.sweep_reservations(config.expiry_sweep_interval))
+        logger.info("serving the library on %s:%s", host, port)
+        async with server:
+            await stop.wait()
+        sweeper.cancel()
+        # Idle keep-alive connections see the end of the stream and their handlers return
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+    def shutdown(self):
+        """Lets running operations finish, then folds the journals back into the data files."""
+        self.executor.shutdown(wait=True)
+        desk.compact()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serves the library data to the desks over local HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="threads answering reads side by side")
+    args = parser.parse_args()
+    if desk.remote:
+        parser.error("LIBRARY_SERVICE is set, the service has to work on the data files itself")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    service = LibraryService(args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
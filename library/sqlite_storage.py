@@ -0,0 +1,518 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import cache
+import config
+import data_files
+import journal
+import locks
+import metrics
+from exceptions import NoBookFound, NoReader, WriteConflict
+from library_db import Book, Reader
+
+#Part responsible for SQLite storage
+db_path = os.path.join(config.data_dir, "library.db")
+
+book_date_columns = ["Lent date", "Return date", "Reserved until"]
+
+"""
+SQLite connection =====
+"""
+
+_connection = None
+_database_id = None
+# Per-table change counters as last read, valid while PRAGMA data_version says no other connection committed
+_data_version = None
+_table_counters: dict[str, int] = {}
+
+def get_connection():
+    global _connection, _database_id
+    if _connection is None:
+        os.makedirs(config.data_dir, exist_ok=True)
+        _connection = sqlite3.connect(db_path, timeout=config.lock_timeout, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        create_tables(_connection)
+        _database_id = os.stat(db_path).st_ino
+    return _connection
+
+def close_connection():
+    global _connection, _data_version
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+        _data_version = None
+
+@contextmanager
+def writing(*tables: str):
+    """One write transaction, serialized with the other desks on data/library.lock (read-then-write stays atomic).
+
+    Bumps the change counter of every table in tables, which is what the cached books/readers are checked against.
+    """
+    conn = get_connection()
+    with locks.data_lock("library"):
+        with conn:
+            yield conn
+            conn.executemany('UPDATE table_versions SET "Counter" = "Counter" + 1 WHERE "Table" = ?',
+                             ((table,) for table in tables))
+            counters = {table: counter for table, counter in conn.execute('SELECT "Table", "Counter" FROM table_versions')
+                        if table in tables}
+        _table_counters.update(counters)
+
+def table_signature(table: str):
+    """Changes whenever a row of table is written, by this or any other process. Costs one PRAGMA when nothing changed."""
+    global _data_version, _table_counters
+    conn = get_connection()
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _data_version:
+        _table_counters = dict(conn.execute('SELECT "Table", "Counter" FROM table_versions'))
+        _data_version = data_version
+    return _database_id, table, _table_counters.get(table, 0)
+
+books_source = db_path + "#books"
+readers_source = db_path + "#readers"
+cache.register_source(books_source, lambda: table_signature("books"))
+cache.register_source(readers_source, lambda: table_signature("readers"))
+
+def books_store_paths():
+    return [books_source]
+
+def readers_store_paths():
+    return [readers_source]
+
+def books_lock():
+    return locks.data_lock("library")
+
+def create_tables(conn):
+    with conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS books (
+                "ID" INTEGER PRIMARY KEY,
+                "Title" TEXT,
+                "Author" TEXT,
+                "ISBN" TEXT,
+                "Publisher" TEXT,
+                "Pages" INTEGER,
+                "Lent" INTEGER NOT NULL DEFAULT 0,
+                "Lent to" INTEGER,
+                "Lent date" TEXT,
+                "Return date" TEXT,
+                "Reserved" INTEGER NOT NULL DEFAULT 0,
+                "Reserved by" INTEGER,
+                "Reserved until" TEXT,
+                "Version" INTEGER NOT NULL DEFAULT 0
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS readers (
+                "ID" INTEGER PRIMARY KEY,
+                "Name" TEXT,
+                "Surname" TEXT,
+                "Phone" TEXT,
+                "City" TEXT,
+                "Street" TEXT,
+                "Apartment" TEXT,
+                "Postal Code" TEXT,
+                "Version" INTEGER NOT NULL DEFAULT 0
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS table_versions (
+                "Table" TEXT PRIMARY KEY,
+                "Counter" INTEGER NOT NULL DEFAULT 0
+            )""")
+        conn.executemany('INSERT OR IGNORE INTO table_versions ("Table") VALUES (?)', [("books",), ("readers",)])
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS loan_events (
+                "At" TEXT NOT NULL,
+                "Kind" TEXT NOT NULL,
+                "Book ID" INTEGER NOT NULL,
+                "Reader ID" INTEGER NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS reservations (
+                "Book ID" INTEGER NOT NULL,
+                "Reader ID" INTEGER NOT NULL,
+                "Priority" INTEGER NOT NULL DEFAULT 0,
+                "At" TEXT,
+                PRIMARY KEY ("Book ID", "Reader ID")
+            )""")
+        for table in ("books", "readers"):
+            # Databases created before rows were versioned
+            if "Version" not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN "Version" INTEGER NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS books_isbn ON books ("ISBN")')
+        conn.execute('CREATE INDEX IF NOT EXISTS books_lent_to ON books ("Lent to")')
+        conn.execute('CREATE INDEX IF NOT EXISTS loan_events_reader ON loan_events ("Reader ID")')
+        conn.execute('CREATE INDEX IF NOT EXISTS loan_events_book ON loan_events ("Book ID")')
+        conn.execute('CREATE INDEX IF NOT EXISTS reservations_queue ON reservations ("Book ID", "Priority")')
+
+def to_sql_value(value):
+    """Converts pandas/python values into something sqlite3 can store."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.isoformat(sep=" ", timespec="microseconds")
+    if isinstance(value, bool):
+        return int(value)
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def insert_rows(conn, table: str, columns: list, rows, replace: bool = False):
+    names = ", ".join(f'"{c}"' for c in columns)
+    placeholders = ", ".join("?" * len(columns))
+    verb = "INSERT OR REPLACE" if replace else "INSERT"
+    conn.executemany(
+        f"{verb} INTO {table} ({names}) VALUES ({placeholders})",
+        ([to_sql_value(v) for v in row] for row in rows)
+    )
+
+def iter_rows(table: str, after_id: int = None, date_columns: list = ()):
+    """Streams the rows of a table as dicts in ID order, fetching from the cursor in batches."""
+    cursor = get_connection().execute(
+        f'SELECT * FROM {table} WHERE "ID" > ? ORDER BY "ID"', (-1 if after_id is None else after_id,)
+    )
+    columns = [description[0] for description in cursor.description]
+    while batch := cursor.fetchmany(1024):
+        for values in batch:
+            row = dict(zip(columns, values))
+            for column in date_columns:
+                if row[column] is not None:
+                    row[column] = datetime.fromisoformat(row[column])
+            yield row
+
+def update_versioned(conn, table: str, row_id: int, values: dict, expected_version: int = None):
+    """UPDATEs one row and bumps its Version; with expected_version only if nobody changed the row since.
+
+    Returns values plus the new Version, or None when the row does not exist. Raises WriteConflict (rolling back the
+    transaction) when the row is at another version.
+    """
+    assignments = ", ".join(f'"{column}" = ?' for column in values)
+    params = [to_sql_value(value) for value in values.values()] + [row_id]
+    sql = f'UPDATE {table} SET {assignments}, "Version" = "Version" + 1 WHERE "ID" = ?'
+    if expected_version is not None:
+        sql += ' AND "Version" = ?'
+        params.append(int(expected_version))
+    if conn.execute(sql, params).rowcount:
+        version = conn.execute(f'SELECT "Version" FROM {table} WHERE "ID" = ?', (row_id,)).fetchone()[0]
+        return {**values, "Version": version}
+    if conn.execute(f'SELECT 1 FROM {table} WHERE "ID" = ?', (row_id,)).fetchone() is None:
+        return None
+    raise WriteConflict(f"{table[:-1].capitalize()} {row_id} was changed at another desk, reload it and try again.")
+
+def commit_books(write):
+    """Runs write(conn) in a books transaction. It returns the changes [(op, ID, values)] it made, which are applied
+    to the loaded book objects and search index (book.commit_book_changes) instead of reloading the table."""
+    from book import commit_book_changes
+    changes = []
+    def run():
+        with writing("books") as conn:
+            changes.extend(write(conn))
+    with books_lock():
+        commit_book_changes(changes, run)
+
+def commit_readers(write):
+    """Readers counterpart of commit_books."""
+    from reader import commit_reader_changes
+    changes = []
+    def run():
+        with writing("readers") as conn:
+            changes.extend(write(conn))
+    with locks.data_lock("library"):
+        commit_reader_changes(changes, run)
+
+def read_ranked_rows(read, table: str, ids: list[int]) -> pd.DataFrame:
+    """The rows with the given IDs, in the order of ids (a search ranking), read in chunks of 500 IDs."""
+    found = [read(f'SELECT * FROM {table} WHERE "ID" IN ({", ".join("?" * len(chunk))})', chunk)
+             for chunk in (ids[start:start + 500] for start in range(0, len(ids), 500))]
+    if not found:
+        return read(f'SELECT * FROM {table} WHERE 0')
+    df = pd.concat(found, ignore_index=True).set_index("ID", drop=False)
+    return df.loc[[row_id for row_id in ids if row_id in df.index]].reset_index(drop=True)
+
+"""
+SQLite books =====
+"""
+
+def read_books(sql: str, params=()):
+    df = pd.read_sql_query(sql, get_connection(), params=params)
+    for column in book_date_columns:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format="ISO8601")
+    for column in ("Lent", "Reserved"):
+        if column in df.columns:
+            df[column] = df[column].astype(bool)
+    return df
+
+def load_books():
+    df = read_books('SELECT * FROM books ORDER BY "ID"')
+    metrics.table_read("books", len(df))
+    return df
+
+def load_books_columns(columns: list[str]):
+    columns = ["ID", *(column for column in columns if column != "ID")]
+    names = ", ".join(f'"{c}"' for c in columns)
+    return read_books(f'SELECT {names} FROM books ORDER BY "ID"')
+
+def stream_books(after_id: int = None):
+    return iter_rows("books", after_id, book_date_columns)
+
+def add_book(book: Book):
+    def write(conn):
+        new_id = conn.execute('SELECT COALESCE(MAX("ID"), 0) + 1 FROM books').fetchone()[0]
+        book.id = new_id
+        Book._Book__id = new_id
+        row = book.to_dict()
+        insert_rows(conn, "books", list(row), [row.values()])
+        return [("add", new_id, row)]
+    commit_books(write)
+
+def add_books(books: list[Book]):
+    if not books:
+        return
+    def write(conn):
+        first_id = conn.execute('SELECT COALESCE(MAX("ID"), 0) + 1 FROM books').fetchone()[0]
+        for book_id, book in enumerate(books, start=first_id):
+            book.id = book_id
+        Book._Book__id = max(Book._Book__id, books[-1].id)
+        rows = [book.to_dict() for book in books]
+        insert_rows(conn, "books", list(rows[0]), [row.values() for row in rows])
+        return [("add", row["ID"], row) for row in rows]
+    commit_books(write)
+
+def remove_book(book_id: int):
+    def write(conn):
+        conn.execute('DELETE FROM books WHERE "ID" = ?', (book_id,))
+        return [("remove", book_id, None)]
+    commit_books(write)
+
+def update_book(book_id: int, values: dict, expected_version: int = None):
+    def write(conn):
+        values_written = update_versioned(conn, "books", book_id, values, expected_version)
+        if values_written is None:
+            raise NoBookFound(f"No book with ID {book_id} found.")
+        return [("update", book_id, values_written)]
+    commit_books(write)
+
+def edit_book(book_id: int, updated_book: Book, expected_version: int = None):
+    update_book(book_id, {
+        "Title": updated_book.title,
+        "Author": updated_book.author,
+        "ISBN": updated_book.isbn,
+        "Publisher": updated_book.publisher,
+        "Pages": updated_book.page_count
+    }, expected_version)
+
+def update_book_status(book_id: int, is_lent: bool, lent_to: int = None, expected_version: int = None):
+    now = datetime.now()
+    update_book(book_id, {
+        "Lent": is_lent,
+        "Lent to": lent_to,
+        "Lent date": now if is_lent else None,
+        "Return date": now + timedelta(days=30) if is_lent else None
+    }, expected_version)
+
+def update_book_return_date(book_id: int, return_date: datetime, expected_version: int = None):
+    update_book(book_id, {"Return date": return_date}, expected_version)
+
+def update_book_reservation(book_id: int, reserved: bool, reserved_by: int = None, reserved_until: datetime = None,
+                            expected_version: int = None):
+    update_book(book_id, {
+        "Reserved": reserved,
+        "Reserved by": reserved_by,
+        "Reserved until": reserved_until
+    }, expected_version)
+
+def update_book_reservations(changes: list[tuple[int, dict]], expected_versions: dict[int, int] = None):
+    if not changes:
+        return
+    expected_versions = expected_versions or {}
+    def write(conn):
+        written = []
+        for book_id, values in changes:
+            values = {"Reserved": values["Reserved"], "Reserved by": values["Reserved by"],
+                      "Reserved until": values["Reserved until"]}
+            # A conflict rolls back the rows already updated
+            values_written = update_versioned(conn, "books", book_id, values, expected_versions.get(book_id))
+            if values_written is not None:
+                written.append(("update", book_id, values_written))
+        return written
+    commit_books(write)
+
+def search_book(query: str, limit: int = 50):
+    """Same ranked token-index search as the xlsx engine (book.get_search_index), reading only the matched rows."""
+    from book import get_search_index
+    return read_ranked_rows(read_books, "books", get_search_index().search(query, limit))
+
+"""
+SQLite readers =====
+"""
+
+def load_readers():
+    df = read_readers('SELECT * FROM readers ORDER BY "ID"')
+    metrics.table_read("readers", len(df))
+    return df
+
+def stream_readers(after_id: int = None):
+    return iter_rows("readers", after_id)
+
+def add_reader(reader: Reader):
+    def write(conn):
+        new_id = conn.execute('SELECT COALESCE(MAX("ID"), 0) + 1 FROM readers').fetchone()[0]
+        reader._Reader__id = new_id
+        Reader._Reader__readerID = new_id
+        row = reader.to_dict()
+        insert_rows(conn, "readers", list(row), [row.values()])
+        return [("add", new_id, row)]
+    commit_readers(write)
+
+def add_readers(readers: list[Reader]):
+    if not readers:
+        return
+    def write(conn):
+        first_id = conn.execute('SELECT COALESCE(MAX("ID"), 0) + 1 FROM readers').fetchone()[0]
+        for reader_id, reader in enumerate(readers, start=first_id):
+            reader._Reader__id = reader_id
+        Reader._Reader__readerID = max(Reader._Reader__readerID, readers[-1].id)
+        rows = [reader.to_dict() for reader in readers]
+        insert_rows(conn, "readers", list(rows[0]), [row.values() for row in rows])
+        return [("add", row["ID"], row) for row in rows]
+    commit_readers(write)
+
+def remove_reader(reader_id: int):
+    def write(conn):
+        conn.execute('DELETE FROM readers WHERE "ID" = ?', (reader_id,))
+        return [("remove", reader_id, None)]
+    commit_readers(write)
+
+def edit_reader(reader_id: int, updated_reader: Reader, expected_version: int = None):
+    address = updated_reader.address
+    values = {
+        "Name": updated_reader.name,
+        "Surname": updated_reader.surname,
+        "Phone": updated_reader.phone_num,
+        "City": address.city if address else "",
+        "Street": address.street if address else "",
+        "Apartment": address.apartment if address else "",
+        "Postal Code": address.postal_code if address else ""
+    }
+    def write(conn):
+        values_written = update_versioned(conn, "readers", reader_id, values, expected_version)
+        if values_written is None:
+            raise NoReader(f"No reader with ID {reader_id}.")
+        return [("update", reader_id, values_written)]
+    commit_readers(write)
+
+def read_readers(sql: str, params=()):
+    return pd.read_sql_query(sql, get_connection(), params=params)
+
+def search_reader(query: str, limit: int = 50):
+    """Same prefix-index search as the xlsx engine (reader.search_reader_ids), reading only the matched rows."""
+    from reader import search_reader_ids
+    return read_ranked_rows(read_readers, "readers", search_reader_ids(query, limit))
+
+"""
+SQLite loan history =====
+"""
+
+def record_loan_event(kind: str, book_id: int, reader_id: int, at: datetime = None):
+    conn = get_connection()
+    with conn:
+        conn.execute('INSERT INTO loan_events ("At", "Kind", "Book ID", "Reader ID") VALUES (?, ?, ?, ?)',
+                     (to_sql_value(at or datetime.now()), kind, int(book_id), int(reader_id)))
+
+def read_loan_events(column: str, value: int):
+    from loan_history import LoanEvent
+    rows = get_connection().execute(
+        f'SELECT "Kind", "Book ID", "Reader ID", "At" FROM loan_events WHERE "{column}" = ? ORDER BY rowid',
+        (int(value),)
+    )
+    return [LoanEvent(kind, book_id, reader_id, datetime.fromisoformat(at)) for kind, book_id, reader_id, at in rows]
+
+def reader_loan_events(reader_id: int):
+    return read_loan_events("Reader ID", reader_id)
+
+def book_loan_events(book_id: int):
+    return read_loan_events("Book ID", book_id)
+
+"""
+SQLite reservation queues =====
+"""
+
+def enqueue_reservation(book_id: int, reader_id: int, priority: int = 0):
+    conn = get_connection()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO reservations ("Book ID", "Reader ID", "Priority", "At") VALUES (?, ?, ?, ?)',
+                     (int(book_id), int(reader_id), int(priority), to_sql_value(datetime.now())))
+
+def pop_reservation(book_id: int):
+    with writing() as conn:
+        row = conn.execute('SELECT rowid, "Reader ID" FROM reservations WHERE "Book ID" = ? '
+                           'ORDER BY "Priority", rowid LIMIT 1', (int(book_id),)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM reservations WHERE rowid = ?", (row[0],))
+    return row[1]
+
+def remove_reservation(book_id: int, reader_id: int):
+    conn = get_connection()
+    with conn:
+        conn.execute('DELETE FROM reservations WHERE "Book ID" = ? AND "Reader ID" = ?', (int(book_id), int(reader_id)))
+
+def remove_reservations(entries: list[tuple[int, int]]):
+    if not entries:
+        return
+    with writing() as conn:
+        conn.executemany('DELETE FROM reservations WHERE "Book ID" = ? AND "Reader ID" = ?',
+                         ((int(book_id), int(reader_id)) for book_id, reader_id in entries))
+
+def waiting_readers(book_id: int) -> list[int]:
+    rows = get_connection().execute('SELECT "Reader ID" FROM reservations WHERE "Book ID" = ? '
+                                    'ORDER BY "Priority", rowid', (int(book_id),))
+    return [reader_id for (reader_id,) in rows]
+
+"""
+Migration and export =====
+"""
+
+def insert_frame(table: str, df: pd.DataFrame):
+    if df.empty:
+        return
+    with writing(table) as conn:
+        insert_rows(conn, table, list(df.columns), df.itertuples(index=False, name=None), replace=True)
+
+def load_file_table(path: str) -> pd.DataFrame:
+    """A books/readers data file (xlsx, parquet or feather) with its not yet compacted journal replayed, as book.py reads it."""
+    return data_files.with_versions(journal.replay(data_files.read_table(path), journal.journal_path_for(path)))
+
+def migrate_from_excel(books_file: str = data_files.data_path("books"), readers_file: str = data_files.data_path("readers")):
+    """One-shot copy of the data files (LIBRARY_FORMAT, journals included) into library.db. Existing IDs are overwritten."""
+    if os.path.exists(books_file):
+        insert_frame("books", load_file_table(books_file))
+    if os.path.exists(readers_file):
+        insert_frame("readers", load_file_table(readers_file))
+
+def export_to_excel(books_xlsx: str = os.path.join(config.data_dir, "books.xlsx"),
+                    readers_xlsx: str = os.path.join(config.data_dir, "readers.xlsx")):
+    """Writes the current database content back to xlsx for the staff."""
+    load_books().to_excel(books_xlsx, index=False)
+    load_readers().to_excel(readers_xlsx, index=False)
+    # The workbooks are complete now, an old journal next to them must not be replayed over them
+    journal.clear(journal.journal_path_for(books_xlsx))
+    journal.clear(journal.journal_path_for(readers_xlsx))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Library SQLite storage tools")
+    parser.add_argument("command", choices=["migrate", "export"])
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_from_excel()
+    else:
+        export_to_excel()
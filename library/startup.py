@@ -0,0 +1,58 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+#Part responsible for measuring the startup
+# main.py and app.py time their phases here: the imports and the home screen up to the first painted frame on the
+# main thread, the pandas import and the data warm-up on the I/O thread right after it.
+# With LIBRARY_STARTUP_TIMES=1 the app prints them as JSON once the data is warm and quits.
+
+enabled = config.startup_times
+
+_began = time.perf_counter()
+# {"phase", "thread", "start_ms", "ms"} in the order they finished. Marks have no "ms" but tell how many modules
+# were loaded by then and whether pandas was among them.
+phases: list[dict] = []
+
+def since_start_ms(moment: float = None) -> float:
+    return round(((moment or time.perf_counter()) - _began) * 1000, 1)
+
+def begin():
+    """Restarts the clock, called first thing in main.py."""
+    global _began
+    _began = time.perf_counter()
+    phases.clear()
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append({"phase": name, "thread": threading.current_thread().name, "start_ms": since_start_ms(start),
+                       "ms": round((time.perf_counter() - start) * 1000, 1)})
+
+def mark(name: str):
+    phases.append({"phase": name, "thread": threading.current_thread().name, "start_ms": since_start_ms(),
+                   "modules": len(sys.modules), "pandas": "pandas" in sys.modules})
+
+def reached(name: str) -> float | None:
+    """ms from the start to the mark or the end of the phase called name, None when it didn't happen yet."""
+    for entry in phases:
+        if entry["phase"] == name:
+            return round(entry["start_ms"] + entry.get("ms", 0), 1)
+    return None
+
+def report() -> dict:
+    return {
+        "first_paint_ms": reached("first paint"),
+        "data_warm_ms": reached("data warm"),
+        "phases": list(phases),
+    }
+
+def print_report():
+    print(json.dumps(report(), indent=2))
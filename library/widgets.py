@@ -0,0 +1,164 @@
+from kivy.clock import Clock
+from kivy.properties import ColorProperty, ObjectProperty, StringProperty
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.textinput import TextInput
+
+import metrics
+from background import io_queue
+
+#Part responsible for widgets shared by the screens
+
+class RecordList(RecycleView):
+    """Scrollable list fed with data dicts instead of widgets.
+
+    Only the rows on screen get a viewclass widget, they are reused while scrolling,
+    so opening a list costs the same for 100 and for 100k rows.
+    """
+
+    def __init__(self, viewclass="Label", row_height: int = 40, **kwargs):
+        super(RecordList, self).__init__(**kwargs)
+        self.viewclass = viewclass
+        layout = RecycleBoxLayout(orientation="vertical", spacing=10, size_hint_y=None,
+                                  default_size=(None, row_height), default_size_hint=(1, None))
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
+    def show(self, rows: list[dict]):
+        self.data = rows
+        self.scroll_y = 1
+
+    def clear(self):
+        self.data = []
+
+
+class TwoColumnRow(BoxLayout):
+    """Row for RecordList: main_text on the left, sub_text on the right."""
+    main_text = StringProperty("")
+    sub_text = StringProperty("")
+    color = ColorProperty((1, 1, 1, 1))
+
+    def __init__(self, **kwargs):
+        super(TwoColumnRow, self).__init__(orientation="horizontal", **kwargs)
+        main_label = Label(size_hint_x=0.7, halign='left', markup=True)
+        sub_label = Label(size_hint_x=0.3, halign='right')
+        self.bind(main_text=main_label.setter('text'), sub_text=sub_label.setter('text'),
+                  color=main_label.setter('color'))
+        self.add_widget(main_label)
+        self.add_widget(sub_label)
+
+
+class ActivityLabel(Label):
+    """Shows how many storage operations are still running in the background."""
+
+    def __init__(self, io_queue, **kwargs):
+        super(ActivityLabel, self).__init__(size_hint_y=None, height=24, color=(0.7, 0.7, 0.7, 1), **kwargs)
+        io_queue.bind(pending=self.show_pending)
+
+    def show_pending(self, io_queue, pending):
+        self.text = f"Working... ({pending} in progress)" if pending else ""
+
+
+class MetricsOverlay(BoxLayout):
+    """Hidden debug panel with the metrics.report() numbers, refreshed every second while it is shown."""
+    refresh_interval = 1
+
+    def __init__(self, **kwargs):
+        super(MetricsOverlay, self).__init__(orientation="vertical", size_hint_y=0.6, **kwargs)
+        self.report = Label(font_name="RobotoMono-Regular", font_size=12, halign="left", valign="top")
+        self.report.bind(size=self.report.setter("text_size"))
+        buttons = BoxLayout(orientation="horizontal", size_hint_y=None, height=32)
+        dump_button = Button(text="Dump to file")
+        dump_button.bind(on_press=self.dump)
+        reset_button = Button(text="Reset")
+        reset_button.bind(on_press=lambda x: metrics.reset() or self.refresh())
+        buttons.add_widget(dump_button)
+        buttons.add_widget(reset_button)
+        self.status = Label(size_hint_y=None, height=24)
+        self.add_widget(self.report)
+        self.add_widget(buttons)
+        self.add_widget(self.status)
+        self.refresh_event = None
+
+    def on_parent(self, instance, parent):
+        if parent is not None and self.refresh_event is None:
+            self.refresh()
+            self.refresh_event = Clock.schedule_interval(self.refresh, self.refresh_interval)
+        elif parent is None and self.refresh_event is not None:
+            self.refresh_event.cancel()
+            self.refresh_event = None
+
+    def refresh(self, *args):
+        self.report.text = metrics.report()
+
+    def dump(self, instance):
+        self.status.text = f"Written to {metrics.dump()}"
+
+
+class PickerRow(Button):
+    """Row for RecordPicker, picks its record when released."""
+    record_id = ObjectProperty(None, allownone=True)
+    picker = ObjectProperty(None, allownone=True)
+
+    def on_release(self):
+        self.picker.select(self.record_id, self.text)
+
+
+class RecordPicker(BoxLayout):
+    """Type-ahead replacement for a Spinner over every book/reader.
+
+    search(query, limit) returns [(ID, label)] for the best matches and runs on the I/O queue,
+    only those few rows are rendered. selected_id is the ID of the picked record, None until one is picked.
+    """
+    selected_id = ObjectProperty(None, allownone=True)
+    search_delay = 0.2
+
+    def __init__(self, search, hint_text: str = "Search...", limit: int = 8, **kwargs):
+        super(RecordPicker, self).__init__(orientation="vertical", **kwargs)
+        self.search = search
+        self.limit = limit
+        self.selected_label = None
+
+        self.input = TextInput(hint_text=hint_text, multiline=False, size_hint_y=None, height=40)
+        self.input.bind(text=self.on_input_text)
+        self.matches = RecordList(viewclass=PickerRow, row_height=36)
+        self.add_widget(self.input)
+        self.add_widget(self.matches)
+
+        self.search_trigger = Clock.create_trigger(self.refresh, self.search_delay)
+        self.search_trigger()
+
+    def on_input_text(self, instance, text):
+        if text == self.selected_label:
+            return
+        self.selected_id = None
+        self.selected_label = None
+        self.search_trigger.cancel()
+        self.search_trigger()
+
+    def refresh(self, *args):
+        query = self.input.text.strip()
+        io_queue.submit(lambda: self.search(query, self.limit), lambda matches: self.show_matches(query, matches))
+
+    def show_matches(self, query, matches):
+        if query != self.input.text.strip() or self.selected_id is not None:
+            return
+        self.matches.show([{"text": label, "record_id": record_id, "picker": self} for record_id, label in matches])
+
+    def select(self, record_id, label):
+        self.selected_label = label
+        self.input.text = label
+        self.selected_id = record_id
+        self.matches.clear()
+
+    def clear(self):
+        """Drops the selection and shows the first matches again (e.g. after the record was lent)."""
+        self.selected_label = None
+        self.selected_id = None
+        if self.input.text:
+            self.input.text = ""
+        else:
+            self.refresh()